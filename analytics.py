@@ -0,0 +1,277 @@
+# analytics.py
+#
+# 管理者ダッシュボード向けの応募傾向分析モジュールです。
+# 応募と募集のデータを1本のCOPYクエリでストリーミングし、pandas/NumPyの列データとして
+# 受け取ったうえで、カテゴリ別・市町村別・曜日別・リードタイム別の応募率と相関を
+# ベクトル演算で計算します (Pythonのループで1行ずつ処理しないため、1000万件規模でも数秒で終わります)。
+#
+# pandas/NumPyは読み込みが重いため、server.py からは使用時にだけインポートしてください。
+#
+# 合成データでの計測:
+#   python analytics.py --synthetic 10000000
+
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# 応募1件につき1行 (応募のない募集も1行) を返すクエリ
+APPLICATION_STREAM_QUERY = """
+    SELECT
+        r.recruitment_id,
+        r.organization_id,
+        EXTRACT(ISODOW FROM r.start_date)::int AS weekday,
+        (r.end_date - r.start_date) AS duration_days,
+        s.sentiment_score,
+        (r.start_date - a.application_date::date) AS lead_days,
+        CASE WHEN a.application_id IS NULL THEN NULL
+             WHEN a.status = 'Approved' THEN 1 ELSE 0 END AS approved
+    FROM Recruitments r
+    LEFT JOIN Applications a ON a.recruitment_id = r.recruitment_id
+    LEFT JOIN RecruitmentSentiment s ON s.recruitment_id = r.recruitment_id
+    WHERE r.status <> 'Draft'
+"""
+APPLICATION_COLUMNS = {
+    'recruitment_id': 'int32',
+    'organization_id': 'int32',
+    'weekday': 'int8',
+    'duration_days': 'float32',   # end_date が NULL の場合があるため float
+    'sentiment_score': 'float32',  # 未分析の募集は NULL
+    'lead_days': 'float32',       # 応募のない募集は NULL
+    'approved': 'float32',        # 応募のない募集は NULL
+}
+
+CATEGORY_MAP_QUERY = "SELECT recruitment_id, category_id FROM RecruitmentCategoryMap"
+CATEGORY_MAP_COLUMNS = {'recruitment_id': 'int32', 'category_id': 'int32'}
+
+WEEKDAY_NAMES = ['月', '火', '水', '木', '金', '土', '日']
+
+# リードタイム (応募日から活動開始日までの日数) の区分
+LEAD_TIME_EDGES = [0, 4, 8, 15, 31]
+LEAD_TIME_LABELS = ['活動開始後', '0-3日前', '4-7日前', '8-14日前', '15-30日前', '31日以上前']
+
+
+def stream_columns(conn, query, columns):
+    """
+    COPY ... TO STDOUT の出力をパイプ経由で pandas に流し込み、列ごとの配列として読み込みます。
+    行をPythonのタプルとして生成しないため、大量の行でも高速に読み込めます。
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        try:
+            with os.fdopen(write_fd, 'wb') as writer:
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", writer)
+        except Exception as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    with os.fdopen(read_fd, 'rb') as reader:
+        frame = pd.read_csv(reader, names=list(columns), dtype=columns, header=None)
+    producer.join()
+    if errors:
+        raise errors[0]
+    return frame
+
+
+def _correlation(x, y):
+    """NaNを除外してピアソン相関係数を計算します。計算できない場合は None を返します。"""
+    mask = ~(np.isnan(x) | np.isnan(y))
+    if mask.sum() < 3:
+        return None
+    x, y = x[mask], y[mask]
+    if x.std() == 0 or y.std() == 0:
+        return None
+    return round(float(np.corrcoef(x, y)[0, 1]), 3)
+
+
+def _group_rates(group_index, group_count, recruitments_weight, applications, approvals):
+    """グループ番号ごとに募集数・応募数・承認数を集計し、応募率と承認率を返します。"""
+    recruitments = np.bincount(group_index, weights=recruitments_weight, minlength=group_count)
+    total_applications = np.bincount(group_index, weights=applications, minlength=group_count)
+    total_approvals = np.bincount(group_index, weights=approvals, minlength=group_count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        application_rate = np.where(recruitments > 0, total_applications / recruitments, 0.0)
+        approval_rate = np.where(total_applications > 0, total_approvals / total_applications, 0.0)
+    return recruitments, total_applications, application_rate, approval_rate
+
+
+def compute_popularity(applications, category_map, category_names=None, organization_names=None):
+    """
+    ストリーミングした列データから人気傾向のレポートを計算します。
+    applications / category_map は stream_columns の戻り値と同じ列を持つ DataFrame です。
+    """
+    category_names = category_names or {}
+    organization_names = organization_names or {}
+
+    recruitment_col = applications['recruitment_id'].to_numpy()
+    approved_col = applications['approved'].to_numpy()
+    lead_days_col = applications['lead_days'].to_numpy()
+    has_application = ~np.isnan(approved_col)
+
+    # 募集単位に集約 (rec_index は各行が何番目の募集かを表す)
+    recruitment_ids, first_row, rec_index = np.unique(recruitment_col, return_index=True, return_inverse=True)
+    rec_count = len(recruitment_ids)
+    if rec_count == 0:
+        return {'totals': {'recruitments': 0, 'applications': 0, 'approved': 0},
+                'by_category': [], 'by_municipality': [], 'by_weekday': [], 'by_lead_time': [], 'correlations': {}}
+
+    apps_per_rec = np.bincount(rec_index, weights=has_application, minlength=rec_count)
+    approved_per_rec = np.bincount(rec_index, weights=np.nan_to_num(approved_col), minlength=rec_count)
+    ones = np.ones(rec_count)
+
+    rec_org = applications['organization_id'].to_numpy()[first_row]
+    rec_weekday = applications['weekday'].to_numpy()[first_row].astype(np.int64) - 1
+    rec_duration = applications['duration_days'].to_numpy()[first_row].astype(np.float64)
+    rec_sentiment = applications['sentiment_score'].to_numpy()[first_row].astype(np.float64)
+
+    def rows(keys, stats, name_of):
+        recruitments, total_apps, app_rate, appr_rate = stats
+        result = []
+        for i, key in enumerate(keys):
+            if recruitments[i] == 0:
+                continue
+            result.append({
+                'key': int(key) if isinstance(key, (np.integer, int)) else key,
+                'name': name_of(key),
+                'recruitments': int(recruitments[i]),
+                'applications': int(total_apps[i]),
+                'application_rate': round(float(app_rate[i]), 3),
+                'approval_rate': round(float(appr_rate[i]), 3),
+            })
+        return sorted(result, key=lambda r: r['application_rate'], reverse=True)
+
+    # 市町村別
+    org_ids, org_index = np.unique(rec_org, return_inverse=True)
+    by_municipality = rows(
+        org_ids, _group_rates(org_index, len(org_ids), ones, apps_per_rec, approved_per_rec),
+        lambda key: organization_names.get(int(key), str(key))
+    )
+
+    # 曜日別 (活動開始日の曜日)
+    by_weekday = rows(
+        range(7), _group_rates(rec_weekday, 7, ones, apps_per_rec, approved_per_rec),
+        lambda key: WEEKDAY_NAMES[key]
+    )
+    by_weekday.sort(key=lambda r: r['key'])
+
+    # カテゴリ別 (1つの募集が複数カテゴリに属する場合は、それぞれに計上する)
+    map_rec = category_map['recruitment_id'].to_numpy()
+    map_cat = category_map['category_id'].to_numpy()
+    positions = np.searchsorted(recruitment_ids, map_rec)
+    positions = np.clip(positions, 0, rec_count - 1)
+    valid = recruitment_ids[positions] == map_rec
+    positions, map_cat = positions[valid], map_cat[valid]
+    category_ids, category_index = np.unique(map_cat, return_inverse=True)
+    by_category = rows(
+        category_ids,
+        _group_rates(category_index, len(category_ids), np.ones(len(positions)),
+                     apps_per_rec[positions], approved_per_rec[positions]),
+        lambda key: category_names.get(int(key), str(key))
+    )
+
+    # リードタイム別 (応募単位)
+    lead_days = lead_days_col[has_application]
+    lead_bucket = np.digitize(lead_days, LEAD_TIME_EDGES)
+    lead_counts = np.bincount(lead_bucket, minlength=len(LEAD_TIME_LABELS))
+    lead_approved = np.bincount(lead_bucket, weights=approved_col[has_application], minlength=len(LEAD_TIME_LABELS))
+    total_applications = int(has_application.sum())
+    by_lead_time = []
+    for i, label in enumerate(LEAD_TIME_LABELS):
+        count = int(lead_counts[i])
+        by_lead_time.append({
+            'key': i,
+            'name': label,
+            'applications': count,
+            'share': round(count / total_applications, 3) if total_applications else 0.0,
+            'approval_rate': round(float(lead_approved[i]) / count, 3) if count else 0.0,
+        })
+
+    # 募集単位の応募数と各指標の相関
+    categories_per_rec = np.bincount(positions, minlength=rec_count).astype(np.float64)
+    lead_sum = np.bincount(rec_index[has_application], weights=lead_days, minlength=rec_count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_lead = np.where(apps_per_rec > 0, lead_sum / apps_per_rec, np.nan)
+    correlations = {
+        'sentiment_score': _correlation(rec_sentiment, apps_per_rec),
+        'duration_days': _correlation(rec_duration, apps_per_rec),
+        'category_count': _correlation(categories_per_rec, apps_per_rec),
+        'mean_lead_days': _correlation(mean_lead, apps_per_rec),
+    }
+
+    return {
+        'totals': {
+            'recruitments': rec_count,
+            'applications': total_applications,
+            'approved': int(approved_per_rec.sum()),
+        },
+        'by_category': by_category,
+        'by_municipality': by_municipality,
+        'by_weekday': by_weekday,
+        'by_lead_time': by_lead_time,
+        'correlations': correlations,
+    }
+
+
+def build_popularity_report(conn):
+    """データベースからデータを読み込み、人気傾向レポートを作成します。"""
+    started = time.monotonic()
+    applications = stream_columns(conn, APPLICATION_STREAM_QUERY, APPLICATION_COLUMNS)
+    category_map = stream_columns(conn, CATEGORY_MAP_QUERY, CATEGORY_MAP_COLUMNS)
+    loaded = time.monotonic()
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT category_id, category_name FROM RecruitmentCategories")
+        category_names = dict(cursor.fetchall())
+        cursor.execute("SELECT organization_id, name FROM Organizations")
+        organization_names = dict(cursor.fetchall())
+
+    report = compute_popularity(applications, category_map, category_names, organization_names)
+    report['timing'] = {
+        'load_seconds': round(loaded - started, 3),
+        'compute_seconds': round(time.monotonic() - loaded, 3),
+    }
+    return report
+
+
+def _synthetic_frames(application_count, recruitment_count=200000, seed=0):
+    """計測用の合成データを生成します。"""
+    rng = np.random.default_rng(seed)
+    rec_ids = rng.integers(1, recruitment_count + 1, application_count).astype(np.int32)
+    applications = pd.DataFrame({
+        'recruitment_id': rec_ids,
+        'organization_id': (rec_ids % 300 + 1).astype(np.int32),
+        'weekday': (rec_ids % 7 + 1).astype(np.int8),
+        'duration_days': (rec_ids % 30).astype(np.float32),
+        'sentiment_score': ((rec_ids % 200) / 100 - 1).astype(np.float32),
+        'lead_days': rng.integers(-5, 60, application_count).astype(np.float32),
+        'approved': (rng.random(application_count) < 0.6).astype(np.float32),
+    })
+    map_rec = np.repeat(np.arange(1, recruitment_count + 1, dtype=np.int32), 2)
+    category_map = pd.DataFrame({
+        'recruitment_id': map_rec,
+        'category_id': (map_rec * np.tile([1, 7], recruitment_count) % 12 + 1).astype(np.int32),
+    })
+    return applications, category_map
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="応募傾向分析の計測")
+    parser.add_argument('--synthetic', type=int, default=10_000_000, help="合成データの応募件数")
+    args = parser.parse_args()
+
+    applications, category_map = _synthetic_frames(args.synthetic)
+    started = time.monotonic()
+    report = compute_popularity(applications, category_map)
+    elapsed = time.monotonic() - started
+    print(json.dumps(report['totals'], ensure_ascii=False))
+    print(json.dumps(report['correlations'], ensure_ascii=False))
+    print(f"{args.synthetic:,}件の集計時間: {elapsed:.2f}秒")
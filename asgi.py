@@ -0,0 +1,250 @@
+# asgi.py
+#
+# 読み込みの多い公開APIを非同期 (ASGI + asyncpg) で処理するエントリーポイントです。
+# 同期のFlaskビューでは、DBの応答を待つ間もワーカー (スレッド) が1つ占有されますが、
+# ここでは待ち時間中に他のリクエストを処理できるため、1ワーカーで多数の同時接続を扱えます。
+#
+#   非同期で処理するAPI : ASYNC_ROUTES を参照 (GETのみ)
+#   それ以外のURL       : 既存のFlaskアプリ (server.app) をスレッドプールで実行
+#
+# DATABASE_REPLICA_URL を設定すると、非同期のAPIはすべてレプリカから読み込みます
+# (直前に書き込みを行ったセッションの /api/my_activities を除く。server.py の read_only を参照)。
+#
+# SQL文の実行時間の上限は server.py と同じ DB_STATEMENT_TIMEOUT_MS です。クライアントが切断した場合や
+# REQUEST_DEADLINE_SECONDS を過ぎた場合は、処理中のタスクを取り消します (asyncpgが実行中のクエリも取り消します)。
+#
+# 使い方 (gunicorn.conf.py の SERVER_MODE=asgi で選択):
+#   SERVER_MODE=asgi gunicorn -c gunicorn.conf.py
+#   または: gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+import asyncio
+import itertools
+import os
+import re
+from urllib.parse import parse_qs
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from werkzeug.http import parse_cookie
+
+import prepared_queries
+import server
+
+flask_app = server.app
+wsgi_fallback = WSGIMiddleware(flask_app, workers=int(os.getenv("ASGI_WSGI_THREADS", "10")))
+
+_pools = {}
+_pool_lock = asyncio.Lock()
+
+
+def to_asyncpg(query):
+    """psycopg2形式の %s プレースホルダーを、asyncpg形式の $1, $2, ... に変換します。"""
+    counter = itertools.count(1)
+    return re.sub(r"%s", lambda _: f"${next(counter)}", query)
+
+
+OPPORTUNITIES_QUERY = to_asyncpg(server.OPPORTUNITIES_QUERY)
+PREFECTURES_QUERY = to_asyncpg(server.PREFECTURES_QUERY)
+MUNICIPALITIES_QUERY = to_asyncpg(server.MUNICIPALITIES_QUERY)
+MY_ACTIVITIES_QUERY = to_asyncpg(server.MY_ACTIVITIES_QUERY)
+
+
+async def get_pool(database_url=None):
+    """asyncpgの接続プールを接続先ごとに初回利用時に作成して返します (省略時は DATABASE_URL)。"""
+    database_url = database_url or os.environ["DATABASE_URL"]
+    if database_url not in _pools:
+        async with _pool_lock:
+            if database_url not in _pools:
+                options = {}
+                if not prepared_queries.is_enabled_for_dsn(database_url):
+                    # トランザクション単位のプーラー (6543番ポート) では、名前付きの PREPARE 文を使い回せない
+                    options['statement_cache_size'] = 0
+                _pools[database_url] = await asyncpg.create_pool(
+                    database_url,
+                    min_size=1,
+                    max_size=int(os.getenv("ASYNC_DB_POOL_SIZE", "10")),
+                    server_settings={'statement_timeout': str(server.DB_STATEMENT_TIMEOUT_MS)},
+                    **options,
+                )
+    return _pools[database_url]
+
+
+async def fetch_all(query, *args, replica=True):
+    """クエリを実行し、結果を辞書のリストで返します。replica=True ならレプリカがあればそちらから読み込みます。"""
+    replica_url = os.getenv("DATABASE_REPLICA_URL") if replica else None
+    if replica_url:
+        try:
+            pool = await get_pool(replica_url)
+            async with pool.acquire() as conn:
+                return [dict(record) for record in await conn.fetch(query, *args)]
+        except (OSError, asyncpg.CannotConnectNowError) as err:
+            # レプリカに接続できない場合はプライマリから読み込む
+            print(f"レプリカ接続エラー: {err}")
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return [dict(record) for record in await conn.fetch(query, *args)]
+
+
+def query_int(query_string, name):
+    """クエリ文字列から整数を取得します (request.args.get(name, type=int) と同じ扱い)。"""
+    try:
+        return int(query_string[name][0])
+    except (KeyError, ValueError):
+        return None
+
+
+class CookieRequest:
+    """セッションインターフェースに渡すための、Cookieだけを持つリクエスト"""
+
+    def __init__(self, scope):
+        header = b"; ".join(value for key, value in scope['headers'] if key == b"cookie")
+        self.cookies = parse_cookie(header.decode('latin-1'))
+
+
+async def load_session(scope):
+    """server.py と同じセッションインターフェースでセッションを読み込みます。"""
+    return await asyncio.to_thread(flask_app.session_interface.open_session, flask_app, CookieRequest(scope))
+
+# ------------------------------
+# 非同期で処理するAPI
+# ------------------------------
+# 各ハンドラは (レスポンスのデータ, ステータスコード) を返します。
+# レスポンスの内容とエラーメッセージは server.py の同名のビューと同じです。
+
+async def get_opportunities(scope, query_string):
+    try:
+        return await fetch_all(OPPORTUNITIES_QUERY), 200
+    except (asyncpg.PostgresError, OSError) as err:
+        print(f"クエリエラー: {err}")
+        return {"error": f"データの取得に失敗しました: {err}"}, 500
+
+
+async def get_prefectures_api(scope, query_string):
+    try:
+        return await fetch_all(PREFECTURES_QUERY), 200
+    except (asyncpg.PostgresError, OSError) as err:
+        print(f"クエリエラー: {err}")
+        return {"error": "都道府県の取得に失敗しました。"}, 500
+
+
+async def get_municipalities_api(scope, query_string):
+    prefecture_id = query_int(query_string, 'prefecture_id')
+    if not prefecture_id:
+        return {"error": "prefecture_idが必要です。"}, 400
+    try:
+        return await fetch_all(MUNICIPALITIES_QUERY, prefecture_id), 200
+    except (asyncpg.PostgresError, OSError) as err:
+        print(f"クエリエラー: {err}")
+        return {"error": "市町村の取得に失敗しました。"}, 500
+
+
+async def get_recruitments_api(scope, query_string):
+    query, params = server.build_recruitments_query(
+        query_int(query_string, 'prefecture_id'),
+        query_int(query_string, 'organization_id'),
+        query_string.get('category', [''])[0].strip(),
+    )
+    try:
+        return await fetch_all(to_asyncpg(query), *params), 200
+    except Exception as e:
+        print(f"Database error: {e}")
+        return {"error": "データベースの取得に失敗しました。"}, 500
+
+
+async def get_my_activities(scope, query_string):
+    session = await load_session(scope)
+    if not session.get('logged_in') or not session.get('volunteer_id'):
+        return {'error': 'ログインしていません。'}, 401
+    try:
+        # 日付は MY_ACTIVITIES_QUERY の中で表示用の文字列に整形済み
+        return await fetch_all(
+            MY_ACTIVITIES_QUERY, session['volunteer_id'], replica=not server.requires_primary(session)
+        ), 200
+    except Exception as e:
+        print(f"Database error fetching activities: {e}")
+        return {'error': '活動履歴の取得に失敗しました。'}, 500
+
+
+ASYNC_ROUTES = {
+    '/api/opportunities': get_opportunities,
+    '/api/prefectures': get_prefectures_api,
+    '/api/municipalities': get_municipalities_api,
+    '/api/recruitments': get_recruitments_api,
+    '/api/my_activities': get_my_activities,
+}
+
+# これらのパラメータを含むリクエストは Flask 側で処理する (近くの募集の検索は郵便番号の位置の検索が必要なため)
+WSGI_ONLY_PARAMS = {
+    '/api/recruitments': ('postal_code', 'near'),
+}
+
+# ------------------------------
+# ASGIアプリケーション
+# ------------------------------
+
+async def send_json(send, data, status):
+    """Flaskの jsonify と同じ形式でJSONレスポンスを送信します。"""
+    body = flask_app.json.dumps(data).encode() + b"\n"
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    """サーバーの起動・終了時に接続プールを作成・破棄します。"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await get_pool()
+            except Exception as e:
+                # DBに接続できなくても起動は続け、最初のリクエストで再試行する
+                print(f"データベース接続エラー: {e}")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for pool in _pools.values():
+                await pool.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def wait_for_disconnect(receive):
+    """クライアントが切断するまで待ちます。"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    handler = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+    query_string = parse_qs(scope.get('query_string', b'').decode('latin-1')) if handler else {}
+    if handler is None or any(name in query_string for name in WSGI_ONLY_PARAMS.get(scope['path'], ())):
+        await wsgi_fallback(scope, receive, send)
+        return
+
+    task = asyncio.ensure_future(handler(scope, query_string))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    deadline = server.REQUEST_DEADLINE_SECONDS if server.REQUEST_DEADLINE_SECONDS > 0 else None
+    done, _ = await asyncio.wait({task, disconnect}, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+    disconnect.cancel()
+    if task not in done:
+        # 切断または期限切れ: 実行中のクエリごと処理を取り消す
+        task.cancel()
+        if disconnect in done:
+            return
+        print(f"リクエストの期限 ({server.REQUEST_DEADLINE_SECONDS}秒) を過ぎたため取り消しました: {scope.get('path')}")
+        await send_json(send, {"error": "処理に時間がかかりすぎたため中断しました。"}, 503)
+        return
+    data, status = task.result()
+    await send_json(send, data, status)
@@ -0,0 +1,204 @@
+# bench/bench_flash_crowd.py
+#
+# 1つの人気の募集に多数のボランティアが同時に応募した場合に、募集人数どおりに枠が割り当てられ、
+# 残りがキャンセル待ちになり、キャンセルで応募順に繰り上がることを確認し、応募1件あたりの時間を計測します。
+# 応募は /api/apply と同じ seats.apply で行い、各スレッドは自分の接続を使います。
+#   1. 計測用の募集 (募集人数 --capacity) とボランティア (--applicants 人) を作成する
+#   2. 全員が同時に応募する (--duplicates 人は同じ応募を2回送る)
+#   3. 枠を持つ応募のうち --cancel 件を同時に取り消す
+#   4. 作成したデータを削除する (--keep を指定した場合は残す)
+#
+# 使い方:
+#   python bench/bench_flash_crowd.py --organization-id 1 [--applicants 5000] [--capacity 100] \
+#       [--concurrency 16] [--duplicates 200] [--cancel 20] [--keep]
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from dotenv import load_dotenv
+
+import seats
+
+load_dotenv()
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
+def thread_connection():
+    """スレッドごとの接続を返します。"""
+    if not hasattr(_local, "conn"):
+        _local.conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+        with _connections_lock:
+            _connections.append(_local.conn)
+    return _local.conn
+
+
+def in_transaction(f, *args):
+    """f(cursor, *args) を1つのトランザクションで実行し、(結果, ミリ秒) を返します。"""
+    conn = thread_connection()
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        result = f(cursor, *args)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run_concurrently(f, items, concurrency):
+    """items を concurrency 個のスレッドで、できるだけ同時に開始して実行します。"""
+    start = threading.Event()
+
+    def task(item):
+        start.wait()
+        return f(item)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(task, item) for item in items]
+        started = time.perf_counter()
+        start.set()
+        results = [future.result() for future in futures]
+    return results, time.perf_counter() - started
+
+
+def print_timings(label, timings, elapsed):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label}: {len(timings)}件 / {elapsed:.2f}秒 ({len(timings) / elapsed:.0f}件/秒) "
+          f"中央値 {statistics.median(timings):.2f} ms / p95 {p95:.2f} ms")
+
+
+def setup(cursor, organization_id, applicants, capacity):
+    """計測用の募集とボランティアを作成し、(募集ID, ボランティアIDの一覧) を返します。"""
+    cursor.execute("""
+        INSERT INTO Recruitments (organization_id, title, description, start_date, end_date, status, contact_email)
+        VALUES (%s, '応募集中の計測用の募集', 'bench_flash_crowd.py が作成しました。', %s, %s, 'Open', 'bench@example.com')
+        RETURNING recruitment_id
+    """, (organization_id, date.today(), date.today()))
+    recruitment_id = cursor.fetchone()[0]
+    seats.set_capacity(cursor, recruitment_id, capacity)
+    cursor.execute("""
+        INSERT INTO Volunteers (organization_id, username, password_hash, full_name)
+        SELECT %s, 'bench-flash-' || %s || '-' || i, repeat('x', 60), '計測用ボランティア ' || i
+        FROM generate_series(1, %s) AS i
+        RETURNING volunteer_id
+    """, (organization_id, recruitment_id, applicants))
+    return recruitment_id, [row[0] for row in cursor.fetchall()]
+
+
+def fetch_state(cursor, recruitment_id):
+    """応募の状態ごとの件数、空き枠の合計、ApplicationKeys の件数を返します。"""
+    cursor.execute("SELECT status, COUNT(*) FROM Applications WHERE recruitment_id = %s GROUP BY status", (recruitment_id,))
+    statuses = dict(cursor.fetchall())
+    cursor.execute("SELECT COALESCE(SUM(remaining), 0) FROM RecruitmentSeatShards WHERE recruitment_id = %s", (recruitment_id,))
+    remaining = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM ApplicationKeys WHERE recruitment_id = %s", (recruitment_id,))
+    return statuses, remaining, cursor.fetchone()[0]
+
+
+def check(label, actual, expected):
+    ok = actual == expected
+    print(f"  [{'OK' if ok else 'NG'}] {label}: {actual} (期待値 {expected})")
+    return ok
+
+
+def cleanup(cursor, recruitment_id, volunteer_ids):
+    cursor.execute("DELETE FROM Applications WHERE recruitment_id = %s", (recruitment_id,))
+    cursor.execute("DELETE FROM ApplicationKeys WHERE recruitment_id = %s", (recruitment_id,))
+    cursor.execute("DELETE FROM Recruitments WHERE recruitment_id = %s", (recruitment_id,))
+    cursor.execute("DELETE FROM Volunteers WHERE volunteer_id = ANY(%s)", (volunteer_ids,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="人気の募集への同時応募を計測します。")
+    parser.add_argument("--organization-id", type=int, required=True)
+    parser.add_argument("--applicants", type=int, default=5000)
+    parser.add_argument("--capacity", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duplicates", type=int, default=200)
+    parser.add_argument("--cancel", type=int, default=20)
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    (recruitment_id, volunteer_ids), _ = in_transaction(setup, args.organization_id, args.applicants, args.capacity)
+    print(f"募集 {recruitment_id} (募集人数 {args.capacity}) に {args.applicants}人が同時に応募します "
+          f"(同時接続 {args.concurrency}, シャード {seats.SEAT_SHARDS})。")
+    all_ok = True
+    try:
+        # 1. 同時応募 (一部は同じ応募を2回送る)
+        requests = volunteer_ids + volunteer_ids[:args.duplicates]
+        results, elapsed = run_concurrently(
+            lambda volunteer_id: in_transaction(seats.apply, recruitment_id, volunteer_id), requests, args.concurrency
+        )
+        print_timings("応募", [ms for _, ms in results], elapsed)
+        outcomes = Counter(outcome for (outcome, _), _ in results)
+        expected_applied = min(args.capacity, args.applicants)
+        expected_waitlisted = args.applicants - expected_applied
+
+        cursor = thread_connection().cursor()
+        statuses, remaining, keys = fetch_state(cursor, recruitment_id)
+        all_ok &= check("応募できた件数", outcomes['applied'], expected_applied)
+        all_ok &= check("キャンセル待ちの件数", outcomes['waitlisted'], expected_waitlisted)
+        all_ok &= check("重複と判定された件数", outcomes['duplicate'], args.duplicates)
+        all_ok &= check("枠を持つ応募 (Pending)", statuses.get('Pending', 0), expected_applied)
+        all_ok &= check("空き枠の合計", remaining, args.capacity - expected_applied)
+        all_ok &= check("ApplicationKeys の件数", keys, args.applicants)
+
+        # 2. 枠を持つ応募の同時キャンセル (キャンセル待ちが応募順に繰り上がる)
+        cursor.execute("""
+            SELECT application_id, volunteer_id FROM Applications
+            WHERE recruitment_id = %s AND status = 'Pending' ORDER BY random() LIMIT %s
+        """, (recruitment_id, args.cancel))
+        holders = cursor.fetchall()
+        cursor.execute("""
+            SELECT application_id FROM Applications
+            WHERE recruitment_id = %s AND status = 'Waitlisted'
+            ORDER BY application_date, application_id LIMIT %s
+        """, (recruitment_id, len(holders)))
+        expected_promoted = {row[0] for row in cursor.fetchall()}
+        thread_connection().commit()
+
+        results, elapsed = run_concurrently(
+            lambda holder: in_transaction(seats.cancel, *holder), holders, args.concurrency
+        )
+        if results:
+            print_timings("キャンセル", [ms for _, ms in results], elapsed)
+        statuses, remaining, keys = fetch_state(cursor, recruitment_id)
+        cursor.execute(
+            "SELECT application_id FROM Applications WHERE application_id = ANY(%s) AND status = 'Pending'",
+            (list(expected_promoted),)
+        )
+        promoted = {row[0] for row in cursor.fetchall()}
+        thread_connection().commit()
+        cursor.close()
+        all_ok &= check("キャンセル後の枠を持つ応募", statuses.get('Pending', 0), expected_applied - len(holders) + len(expected_promoted))
+        all_ok &= check("応募順に繰り上がった件数", len(promoted), len(expected_promoted))
+        all_ok &= check("キャンセル後の空き枠の合計", remaining, max(args.capacity - args.applicants + len(holders), 0))
+    finally:
+        if not args.keep:
+            in_transaction(cleanup, recruitment_id, volunteer_ids)
+        for conn in _connections:
+            conn.close()
+
+    print("すべての確認に成功しました。" if all_ok else "確認に失敗した項目があります。")
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
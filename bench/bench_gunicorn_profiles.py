@@ -0,0 +1,135 @@
+# bench/bench_gunicorn_profiles.py
+#
+# gunicorn.conf.py の各プロファイルでサーバーを起動し、実際のエンドポイントに負荷をかけて
+# スループットと応答時間を比較します。結果はMarkdownの表で出力されます。
+# DATABASE_URL に計測用のデータベースを指定して実行してください。
+#
+# 使い方:
+#   python bench/bench_gunicorn_profiles.py
+#   python bench/bench_gunicorn_profiles.py --profiles sync gthread --concurrency 64 --duration 30
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 計測するエンドポイント (ログイン不要の公開API)
+ENDPOINTS = [
+    "/api/opportunities",
+    "/api/recruitments",
+    "/api/prefectures",
+    "/api/municipalities?prefecture_id=13",
+    "/api/categories",
+]
+
+# (表示名, 環境変数)
+PROFILES = {
+    "sync": {"SERVER_MODE": "wsgi", "GUNICORN_PROFILE": "sync"},
+    "gthread": {"SERVER_MODE": "wsgi", "GUNICORN_PROFILE": "gthread"},
+    "gevent": {"SERVER_MODE": "wsgi", "GUNICORN_PROFILE": "gevent"},
+    "asgi": {"SERVER_MODE": "asgi"},
+}
+
+
+def wait_until_ready(base_url, host, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(urllib.request.Request(base_url + ENDPOINTS[0], headers={"Host": host}), timeout=2)
+            return True
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+    return False
+
+
+def run_load(base_url, host, concurrency, duration):
+    """concurrency 本のスレッドで duration 秒間リクエストを送り続けます。"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        i = index
+        while time.monotonic() < deadline:
+            path = ENDPOINTS[i % len(ENDPOINTS)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urllib.request.Request(base_url + path, headers={"Host": host}), timeout=30) as response:
+                    response.read()
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gunicornのプロファイルごとの性能を計測します。")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--concurrency", type=int, default=32, help="同時接続数")
+    parser.add_argument("--duration", type=int, default=20, help="1プロファイルあたりの計測秒数")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", default="teamh-noilen.onrender.com", help="Hostヘッダー (app.config['SERVER_NAME'] と一致させる)")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    rows = []
+    for name in args.profiles:
+        env = dict(os.environ, PORT=str(args.port), **PROFILES[name])
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            if not wait_until_ready(base_url, args.host):
+                print(f"[{name}] サーバーが起動しませんでした。")
+                continue
+            latencies, errors = run_load(base_url, args.host, args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+
+        if not latencies:
+            rows.append((name, 0, 0, 0, 0, errors))
+            continue
+        latencies.sort()
+        rows.append((
+            name,
+            len(latencies) / args.duration,
+            statistics.median(latencies),
+            percentile(latencies, 0.95),
+            percentile(latencies, 0.99),
+            errors,
+        ))
+
+    print(f"\n同時接続数 {args.concurrency} / {args.duration}秒 / CPU {os.cpu_count()}コア\n")
+    print("| プロファイル | req/s | p50 (ms) | p95 (ms) | p99 (ms) | エラー |")
+    print("|---|---:|---:|---:|---:|---:|")
+    for name, rps, p50, p95, p99, errors in rows:
+        print(f"| {name} | {rps:.1f} | {p50:.1f} | {p95:.1f} | {p99:.1f} | {errors} |")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
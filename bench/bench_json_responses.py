@@ -0,0 +1,118 @@
+# bench/bench_json_responses.py
+#
+# 活動履歴API (/api/my_activities) と同じ形の行について、JSONレスポンスの作成時間を比較します。
+#   以前: DictCursor の行 -> dict(row) -> strftime で日付を整形 -> jsonify (標準の json)
+#   現在: タプル行 (日付は SQL の to_char で整形済み) -> fast_json.rows_response (orjson)
+# データベースは使わず、メモリ上に作成した行で計測します (クエリの実行時間は含みません)。
+#
+# 使い方:
+#   python bench/bench_json_responses.py [--rows 10000] [--runs 50]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask.json.provider import DefaultJSONProvider
+from psycopg2.extras import DictRow
+
+import server
+from fast_json import rows_response
+
+COLUMNS = [
+    'application_id', 'recruitment_id', 'title', 'description',
+    'start_date', 'end_date', 'application_date', 'application_status',
+]
+
+
+class FakeCursor:
+    """DictRow の作成に必要な属性だけを持つカーソル"""
+
+    def __init__(self, rows):
+        self.description = [(name,) for name in COLUMNS]
+        self.index = {name: i for i, name in enumerate(COLUMNS)}
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+
+def make_rows(count):
+    """日付オブジェクトのままの行と、SQLで日付を整形した場合の行を作成します。"""
+    raw, formatted = [], []
+    for i in range(count):
+        start = date(2025, 1, 1) + timedelta(days=i % 365)
+        applied = datetime(2024, 12, 1, 9, 30) + timedelta(minutes=i)
+        end = start + timedelta(days=7) if i % 3 else None
+        row = [i, i // 4, f"ボランティア募集 {i}", "地域の清掃活動です。" * 3, start, end, applied, 'Pending']
+        raw.append(row)
+        formatted.append((
+            *row[:4],
+            start.strftime('%Y年%m月%d日'),
+            end.strftime('%Y年%m月%d日') if end else None,
+            applied.strftime('%Y年%m月%d日 %H:%M'),
+            row[7],
+        ))
+    return raw, formatted
+
+
+def make_dict_rows(raw):
+    cursor = FakeCursor(None)
+    rows = []
+    for values in raw:
+        row = DictRow(cursor)
+        row[:] = values
+        rows.append(row)
+    return rows
+
+
+def run_old(rows, provider):
+    activities = []
+    for row in rows:
+        activity = dict(row)
+        if activity.get('start_date'):
+            activity['start_date'] = activity['start_date'].strftime('%Y年%m月%d日')
+        if activity.get('end_date'):
+            activity['end_date'] = activity['end_date'].strftime('%Y年%m月%d日')
+        if activity.get('application_date'):
+            activity['application_date'] = activity['application_date'].strftime('%Y年%m月%d日 %H:%M')
+        activities.append(activity)
+    return provider.response(activities).get_data()
+
+
+def run_new(rows, provider):
+    return rows_response(FakeCursor(rows)).get_data()
+
+
+def measure(label, f, rows, provider, runs):
+    body = f(rows, provider)  # ウォームアップ
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        f(rows, provider)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<28} 中央値 {statistics.median(timings):7.2f} ms / p95 {p95:7.2f} ms / {len(body) / 1024:7.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONレスポンスの作成時間を計測します。")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    raw, formatted = make_rows(args.rows)
+    dict_rows = make_dict_rows(raw)
+    with server.app.app_context():
+        measure("dict(row) + jsonify (以前)", run_old, dict_rows, DefaultJSONProvider(server.app), args.runs)
+        measure("タプル行 + orjson (現在)", run_new, formatted, None, args.runs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# bench/bench_prepared_statements.py
+#
+# prepared_queries.py に登録したクエリについて、毎回SQLを送る場合 (解析と実行計画の作成が毎回発生) と、
+# PREPARE 済みの文を EXECUTE する場合の実行時間を比較します。
+# あわせて EXPLAIN (ANALYZE) で、1回あたりの実行計画の作成時間 (Planning Time) を表示します。
+#
+# 使い方:
+#   python bench/bench_prepared_statements.py --email <ボランティアのメール> --volunteer-id 1 \
+#       --recruitment-id 1 --organization-id 1 [--runs 500]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prepared_queries
+import server
+
+
+def measure(label, f, runs):
+    f()  # ウォームアップ
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        f()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    median = statistics.median(timings)
+    print(f"  {label:<12} 中央値 {median:7.3f} ms / p95 {p95:7.3f} ms")
+    return median
+
+
+def planning_time(cursor, query, params):
+    """EXPLAIN (ANALYZE) の結果から、実行計画の作成時間 (ミリ秒) を返します。"""
+    cursor.execute("EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) " + query, params)
+    return cursor.fetchone()[0][0]["Planning Time"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プリペアドステートメントによる実行時間の差を計測します。")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--volunteer-id", type=int, required=True)
+    parser.add_argument("--recruitment-id", type=int, required=True)
+    parser.add_argument("--organization-id", type=int, required=True)
+    parser.add_argument("--runs", type=int, default=500)
+    args = parser.parse_args()
+
+    cases = [
+        ("volunteer_login", (args.email,)),
+        ("my_activities", (args.volunteer_id,)),
+        ("recruitment_detail", (args.recruitment_id,)),
+        ("recruitment_applicants_application_date_desc", (args.recruitment_id, args.organization_id)),
+    ]
+
+    os.environ["DB_PREPARED_STATEMENTS"] = "on"
+    conn = server.get_db_connection()
+    if conn is None:
+        print("データベースに接続できませんでした。")
+        return 1
+    cursor = conn.cursor()
+    try:
+        total_saved = 0.0
+        for name, params in cases:
+            query = prepared_queries.QUERIES[name]
+            print(f"{name} (実行計画の作成 {planning_time(cursor, query, params):.3f} ms/回)")
+            plain = measure("毎回送信", lambda: (cursor.execute(query, params), cursor.fetchall()), args.runs)
+            prepared = measure("PREPARE済み", lambda: (prepared_queries.execute(cursor, name, params), cursor.fetchall()), args.runs)
+            total_saved += plain - prepared
+            conn.rollback()
+        print(f"合計 (中央値の差): 1リクエストあたり {total_saved:.3f} ms の短縮")
+    finally:
+        cursor.close()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# bench/bench_staff_opportunity_detail.py
+#
+# 募集編集画面の詳細取得 (get_staff_opportunity_detail) について、
+# 以前の3回の往復 (詳細 + カテゴリーID + 全カテゴリー) と、現在の1回のクエリ + 参照キャッシュを比較します。
+# ネットワーク遅延の影響を見るため、リモートのデータベース (DATABASE_URL) に対して実行してください。
+#
+# 使い方:
+#   python bench/bench_staff_opportunity_detail.py <recruitment_id> <organization_id> [--runs 200]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2.extras
+
+import server
+
+OLD_QUERIES = [
+    """
+        SELECT r.recruitment_id AS id, r.title, r.description, r.start_date AS activity_date,
+               r.end_date AS deadline, r.contact_phone_number AS phone_number, r.contact_email AS email, r.status,
+               (SELECT COUNT(*) FROM Applications a WHERE a.recruitment_id = r.recruitment_id) AS applied_count
+        FROM Recruitments r
+        WHERE r.recruitment_id = %(rid)s AND r.organization_id = %(oid)s
+    """,
+    "SELECT category_id FROM RecruitmentCategoryMap WHERE recruitment_id = %(rid)s",
+    "SELECT category_id, category_name FROM RecruitmentCategories ORDER BY category_id",
+]
+
+NEW_QUERY = """
+    SELECT r.recruitment_id AS id, r.title, r.description, r.start_date AS activity_date,
+           r.end_date AS deadline, r.contact_phone_number AS phone_number, r.contact_email AS email, r.status,
+           (SELECT COUNT(*) FROM Applications a WHERE a.recruitment_id = r.recruitment_id) AS applied_count,
+           ARRAY(
+               SELECT rcm.category_id FROM RecruitmentCategoryMap rcm
+               WHERE rcm.recruitment_id = r.recruitment_id
+               ORDER BY rcm.category_id
+           ) AS categories
+    FROM Recruitments r
+    WHERE r.recruitment_id = %(rid)s AND r.organization_id = %(oid)s
+"""
+
+
+def run_old(cursor, params):
+    for query in OLD_QUERIES:
+        cursor.execute(query, params)
+        cursor.fetchall()
+
+
+def run_new(cursor, params):
+    cursor.execute(NEW_QUERY, params)
+    cursor.fetchall()
+    server.get_reference_data(cursor, 'categories')
+
+
+def measure(label, f, cursor, params, runs):
+    f(cursor, params)  # ウォームアップ
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        f(cursor, params)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<24} 中央値 {statistics.median(timings):7.2f} ms / p95 {p95:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="募集詳細取得のクエリ往復回数による差を計測します。")
+    parser.add_argument("recruitment_id", type=int)
+    parser.add_argument("organization_id", type=int)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    conn = server.get_db_connection()
+    if conn is None:
+        print("データベースに接続できませんでした。")
+        return 1
+    params = {'rid': args.recruitment_id, 'oid': args.organization_id}
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        measure("3回の往復 (以前)", run_old, cursor, params, args.runs)
+        measure("1回 + 参照キャッシュ", run_new, cursor, params, args.runs)
+    finally:
+        cursor.close()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# check_import_time.py
+#
+# `python -X importtime` を使って server モジュールの読み込み時間を計測し、
+# 予算（ミリ秒）を超えていないかを確認するスクリプトです。
+# gunicornは各ワーカーで server をインポートするため、この時間がそのまま
+# ワーカー1つあたりの起動時間に加算されます。
+#
+# 使い方:
+#   python check_import_time.py                  # 既定の予算で計測
+#   python check_import_time.py --budget-ms 300  # 予算を指定
+#   python check_import_time.py --runs 10 --top 15
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# 既定の予算（ミリ秒）。環境変数 IMPORT_TIME_BUDGET_MS で上書きできます。
+DEFAULT_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "400"))
+
+# 起動時に読み込まれてはいけない重いモジュール（遅延インポート対象）
+LAZY_MODULES = ("pandas", "numpy", "fpdf", "flask_mail", "smtplib", "google.cloud.language_v1")
+
+
+def measure_once(module):
+    """子プロセスでモジュールをインポートし、importtimeの出力を解析して返します。"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{module} のインポートに失敗しました:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        self_us = int(parts[0].strip())
+        cumulative_us = int(parts[1].strip())
+        raw_name = parts[2].rstrip()
+        depth = (len(raw_name) - len(raw_name.lstrip())) // 2
+        entries.append((raw_name.strip(), depth, self_us, cumulative_us))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="server モジュールのインポート時間を計測します。")
+    parser.add_argument("--module", default="server", help="計測するモジュール名 (既定: server)")
+    parser.add_argument("--budget-ms", type=int, default=DEFAULT_BUDGET_MS, help="許容するインポート時間 (ミリ秒)")
+    parser.add_argument("--runs", type=int, default=5, help="計測回数 (中央値を採用)")
+    parser.add_argument("--top", type=int, default=10, help="表示する重いモジュールの件数")
+    args = parser.parse_args()
+
+    totals = []
+    last_entries = []
+    for _ in range(args.runs):
+        entries = measure_once(args.module)
+        total = next((cum for name, _, _, cum in entries if name == args.module), None)
+        if total is None:
+            print(f"[エラー] importtime の出力に {args.module} が見つかりません。")
+            return 1
+        totals.append(total)
+        last_entries = entries
+
+    median_ms = statistics.median(totals) / 1000
+    print(f"--- {args.module} のインポート時間 ({args.runs}回の中央値) ---")
+    print(f"合計: {median_ms:.1f} ms (最小 {min(totals) / 1000:.1f} ms / 最大 {max(totals) / 1000:.1f} ms)")
+
+    # 直接インポートしているモジュールのうち重いものを表示
+    # (importtimeは子モジュールを親より先に出力するため、対象行から遡って集める)
+    index = next(i for i, e in enumerate(last_entries) if e[0] == args.module and e[1] == 0)
+    subtree = []
+    for entry in reversed(last_entries[:index]):
+        if entry[1] == 0:
+            break
+        subtree.append(entry)
+    direct = [e for e in subtree if e[1] == 1]
+    direct.sort(key=lambda e: e[3], reverse=True)
+    print(f"\n重い直接インポート (上位{args.top}件):")
+    for name, _, _, cumulative_us in direct[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    loaded = {name for name, _, _, _ in subtree}
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    if eager:
+        print(f"\n[失敗] 遅延インポートすべきモジュールが起動時に読み込まれています: {', '.join(eager)}")
+        failed = True
+
+    if median_ms > args.budget_ms:
+        print(f"\n[失敗] 予算 {args.budget_ms} ms を超えています。")
+        failed = True
+
+    if failed:
+        return 1
+    print(f"\n[成功] 予算 {args.budget_ms} ms 以内です。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+-- add_application_default_partition.sql
+-- add_application_partitions.sql を適用済みのデータベースに、年のパーティションがない日時の応募が入る
+-- applications_default を追加します (maintain_application_partitions が止まっていても応募が失敗しないようにする)。
+-- あわせて、Applications のインデックスを db/table.sql と揃えます。
+
+CREATE TABLE IF NOT EXISTS applications_default PARTITION OF Applications DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_applications_application_date ON Applications (application_date);
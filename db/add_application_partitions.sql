@@ -0,0 +1,77 @@
+-- add_application_partitions.sql
+-- 既存のデータベースの Applications を、application_date の年ごとのパーティションに分割した表に移し替えます。
+-- 既存の応募がある年から来年までのパーティションと、年のパーティションがない日時の応募が入る
+-- applications_default を作成し、全行をコピーします (応募IDは変わりません)。
+-- 実行中は Applications への読み書きが止まるため、アクセスの少ない時間帯に実行してください。
+--
+-- 移行後は次のジョブを定期実行します (scheduler.py の既定のスケジュールに含まれています)。
+--   python jobs.py maintain_application_partitions   # 来年以降のパーティションを作成
+--   python jobs.py archive_application_partitions    # 古い年のパーティションを ApplicationArchive に移す
+
+BEGIN;
+
+LOCK TABLE Applications IN ACCESS EXCLUSIVE MODE;
+
+CREATE TABLE Applications_partitioned (
+    application_id INTEGER NOT NULL DEFAULT nextval('applications_application_id_seq'),
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id),
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id),
+    application_date TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status application_status DEFAULT 'Pending',
+    PRIMARY KEY (application_id, application_date)
+) PARTITION BY RANGE (application_date);
+
+-- 既存の応募がある最初の年から来年までのパーティション
+DO $$
+DECLARE
+    first_year INTEGER;
+BEGIN
+    SELECT COALESCE(extract(year FROM min(application_date))::int, extract(year FROM CURRENT_DATE)::int)
+    INTO first_year FROM Applications;
+    FOR y IN first_year .. extract(year FROM CURRENT_DATE)::int + 1 LOOP
+        EXECUTE format(
+            'CREATE TABLE applications_y%s PARTITION OF Applications_partitioned FOR VALUES FROM (%L) TO (%L)',
+            y, make_date(y, 1, 1), make_date(y + 1, 1, 1)
+        );
+    END LOOP;
+END $$;
+CREATE TABLE applications_default PARTITION OF Applications_partitioned DEFAULT;
+
+INSERT INTO Applications_partitioned (application_id, recruitment_id, volunteer_id, application_date, status)
+SELECT application_id, recruitment_id, volunteer_id, COALESCE(application_date, CURRENT_TIMESTAMP), status
+FROM Applications;
+
+-- 1人1募集1件の応募 (パーティションをまたいだ一意性をここで保証する)
+CREATE TABLE IF NOT EXISTS ApplicationKeys (
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
+    application_id INTEGER NOT NULL,
+    application_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (recruitment_id, volunteer_id)
+);
+INSERT INTO ApplicationKeys (recruitment_id, volunteer_id, application_id, application_date)
+SELECT recruitment_id, volunteer_id, application_id, application_date FROM Applications_partitioned
+ON CONFLICT (recruitment_id, volunteer_id) DO NOTHING;
+
+-- 古い表を削除しても応募IDの連番が消えないよう、所有者を付け替える
+ALTER SEQUENCE applications_application_id_seq OWNED BY NONE;
+DROP TABLE Applications;
+ALTER TABLE Applications_partitioned RENAME TO Applications;
+ALTER INDEX applications_partitioned_pkey RENAME TO applications_pkey;
+ALTER SEQUENCE applications_application_id_seq OWNED BY Applications.application_id;
+
+-- db/table.sql の Applications と同じインデックス
+CREATE INDEX idx_applications_recruitment_volunteer ON Applications (recruitment_id, volunteer_id);
+CREATE INDEX idx_applications_volunteer ON Applications (volunteer_id);
+CREATE INDEX idx_applications_application_date ON Applications (application_date);
+
+-- アーカイブ済みの応募 (切り離したパーティションの行を、ボランティアごとに1つの JSONB にまとめて圧縮保存する)
+CREATE TABLE IF NOT EXISTS ApplicationArchive (
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
+    partition_name VARCHAR(63) NOT NULL,
+    applications JSONB NOT NULL,
+    archived_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (volunteer_id, partition_name)
+) WITH (toast_tuple_target = 128);
+
+COMMIT;
@@ -0,0 +1,44 @@
+-- add_daily_stats.sql
+-- 既存のデータベースに日次集計テーブルを追加します。
+-- 追加後、`python jobs.py refresh_daily_stats` を定期実行すると集計が増分更新されます (scheduler.py の既定のスケジュールに含まれています)。
+
+-- 新規募集数を集計するため、募集の作成日時を記録する
+ALTER TABLE Recruitments ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITHOUT TIME ZONE;
+UPDATE Recruitments SET created_at = start_date WHERE created_at IS NULL;
+ALTER TABLE Recruitments ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
+
+-- category_id = 0 の行はカテゴリを問わない合計値を表す
+CREATE TABLE IF NOT EXISTS DailyApplicationStats (
+    stat_date DATE NOT NULL,
+    organization_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL DEFAULT 0,
+    applications INTEGER NOT NULL DEFAULT 0,
+    approvals INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, organization_id, category_id)
+);
+
+CREATE TABLE IF NOT EXISTS DailyRecruitmentStats (
+    stat_date DATE NOT NULL,
+    organization_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL DEFAULT 0,
+    new_recruitments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, organization_id, category_id)
+);
+
+CREATE TABLE IF NOT EXISTS DailyVolunteerStats (
+    stat_date DATE NOT NULL,
+    organization_id INTEGER NOT NULL,
+    new_volunteers INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, organization_id)
+);
+
+CREATE TABLE IF NOT EXISTS RollupWatermarks (
+    rollup_name VARCHAR(100) PRIMARY KEY,
+    watermark TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 増分集計で日時の範囲検索を行うためのインデックス
+CREATE INDEX IF NOT EXISTS idx_applications_application_date ON Applications (application_date);
+CREATE INDEX IF NOT EXISTS idx_volunteers_registration_date ON Volunteers (registration_date);
+CREATE INDEX IF NOT EXISTS idx_recruitments_created_at ON Recruitments (created_at);
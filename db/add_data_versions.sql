@@ -0,0 +1,9 @@
+-- add_data_versions.sql
+-- 既存のデータベースに、フラグメントキャッシュ (template_cache.py) のデータのバージョンを置くテーブルを追加します。
+-- 地域やカテゴリーを変更したトランザクションでバージョンを進めるため (server.py の bump_data_version)、
+-- どのワーカーでも変更の直後から新しい一覧を表示します。
+
+CREATE TABLE IF NOT EXISTS DataVersions (
+    name VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
@@ -0,0 +1,9 @@
+-- add_notification_digest.sql
+-- 既存のデータベースに、まとめて通知する新着募集の待ち行列を追加します。
+-- 追加後、`python jobs.py send_notification_digests` を定期実行 (scheduler.py の既定のスケジュールでは1日1回) すると、
+-- 溜まった募集が興味のあるボランティアへ1人1通にまとめて送られます。
+
+CREATE TABLE IF NOT EXISTS PendingRecruitmentNotifications (
+    recruitment_id INTEGER PRIMARY KEY REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    queued_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
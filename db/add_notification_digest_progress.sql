@@ -0,0 +1,12 @@
+-- add_notification_digest_progress.sql
+-- 既存のデータベース (add_notification_digest.sql を実行済み) に、まとめ通知を送り終えた
+-- (ボランティア, 募集) の記録を追加します。jobs.py の send_notification_digests は1人送るごとにここへ記録し、
+-- 送信が途中で失敗しても、次回は残りのボランティアにだけ送ります。
+
+CREATE TABLE IF NOT EXISTS SentRecruitmentNotifications (
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    sent_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (volunteer_id, recruitment_id)
+);
+CREATE INDEX IF NOT EXISTS idx_sent_recruitment_notifications_recruitment ON SentRecruitmentNotifications (recruitment_id);
@@ -0,0 +1,21 @@
+-- add_proximity_search.sql
+-- 既存のデータベースに、郵便番号による近くの募集の検索に使うテーブルと列を追加します (geo.py を参照)。
+-- 追加後、`python geo.py load <CSVファイル>` で郵便番号ごとの緯度・経度を読み込んでください。
+
+-- 郵便番号ごとの代表地点 (geohash は geo.py で計算した7桁)
+CREATE TABLE IF NOT EXISTS PostalCodes (
+    postal_code CHAR(7) PRIMARY KEY,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    geohash VARCHAR(12) NOT NULL
+);
+
+-- 募集の活動場所の郵便番号と、その位置 (PostalCodes からコピーする)
+ALTER TABLE Recruitments ADD COLUMN IF NOT EXISTS postal_code CHAR(7);
+ALTER TABLE Recruitments ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION;
+ALTER TABLE Recruitments ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+ALTER TABLE Recruitments ADD COLUMN IF NOT EXISTS geohash VARCHAR(12);
+
+-- 募集中の案件だけを対象にした、geohash の先頭4文字・5文字の部分インデックス (半径に応じて使い分ける)
+CREATE INDEX IF NOT EXISTS idx_recruitments_open_geohash5 ON Recruitments (left(geohash, 5)) WHERE status = 'Open';
+CREATE INDEX IF NOT EXISTS idx_recruitments_open_geohash4 ON Recruitments (left(geohash, 4)) WHERE status = 'Open';
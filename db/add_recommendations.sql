@@ -0,0 +1,29 @@
+-- add_recommendations.sql
+-- 既存のデータベースに、ボランティアごとのおすすめ募集のテーブルを追加します。
+-- 追加後、`python jobs.py refresh_recommendations` を定期実行するとおすすめが再計算されます (scheduler.py の既定のスケジュールに含まれています)。
+
+-- ボランティアごとの上位N件 (jobs.py の refresh_recommendations で作成。/api/recommendations が参照)
+CREATE TABLE IF NOT EXISTS VolunteerRecommendations (
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
+    rank SMALLINT NOT NULL,
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    score REAL NOT NULL,
+    computed_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (volunteer_id, rank)
+);
+-- 募集の削除時 (ON DELETE CASCADE) に使う
+CREATE INDEX IF NOT EXISTS idx_volunteer_recommendations_recruitment ON VolunteerRecommendations (recruitment_id);
+
+-- おすすめの計算に使う共起の表 (refresh_recommendations が実行のたびに作り直す作業用の表。WALは書かない)
+CREATE UNLOGGED TABLE IF NOT EXISTS CategoryCooccurrence (
+    category_a INTEGER NOT NULL,
+    category_b INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (category_a, category_b)
+);
+CREATE UNLOGGED TABLE IF NOT EXISTS OrganizationCooccurrence (
+    organization_a INTEGER NOT NULL,
+    organization_b INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (organization_a, organization_b)
+);
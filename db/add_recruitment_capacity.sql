@@ -0,0 +1,20 @@
+-- add_recruitment_capacity.sql
+-- 既存のデータベースに、募集人数・空き枠のカウンター・キャンセル待ちを追加します (seats.py を参照)。
+-- 既存の募集は人数制限なし (capacity が NULL) のままです。募集人数は職員の募集編集画面から設定します。
+-- キャンセル待ちの繰り上げの取りこぼしは `python jobs.py promote_waitlists` (scheduler.py で5分ごと) で確認します。
+
+-- 追加した列挙型の値は、追加したトランザクションがコミットされるまで使えません。
+-- SQLエディタなどでファイル全体が1つのトランザクションになる場合は、次の ALTER TYPE だけを先に実行してください。
+ALTER TYPE application_status ADD VALUE IF NOT EXISTS 'Waitlisted';
+
+ALTER TABLE Recruitments ADD COLUMN IF NOT EXISTS capacity INTEGER CHECK (capacity IS NULL OR capacity > 0);
+
+CREATE TABLE IF NOT EXISTS RecruitmentSeatShards (
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    shard SMALLINT NOT NULL,
+    remaining INTEGER NOT NULL CHECK (remaining >= 0),
+    PRIMARY KEY (recruitment_id, shard)
+);
+
+CREATE INDEX IF NOT EXISTS idx_applications_waitlist
+    ON Applications (recruitment_id, application_date, application_id) WHERE status = 'Waitlisted';
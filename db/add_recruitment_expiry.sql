@@ -0,0 +1,9 @@
+-- add_recruitment_expiry.sql
+-- 既存のデータベースに、公開中の募集だけを対象にした部分インデックスを追加します。
+-- 終了日を過ぎた募集は scheduler.py (Procfile の worker) が close_expired_recruitments で Closed にするため、
+-- これらのインデックスの大きさは募集の総数ではなく、公開中の募集の数に比例します。
+
+-- 一覧 (/api/recruitments, /api/opportunities) の status = 'Open' と並び順 (start_date DESC) に使う
+CREATE INDEX IF NOT EXISTS idx_recruitments_open_start_date ON Recruitments (start_date DESC) WHERE status = 'Open';
+-- 終了日を過ぎた募集の検索 (jobs.py の close_expired_recruitments) に使う
+CREATE INDEX IF NOT EXISTS idx_recruitments_open_end_date ON Recruitments (end_date) WHERE status = 'Open';
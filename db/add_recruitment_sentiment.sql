@@ -0,0 +1,13 @@
+-- add_recruitment_sentiment.sql
+-- 既存のデータベースにAI分析結果のテーブルを追加します。
+-- 追加後、`python jobs.py analyze_recruitments` を実行すると分析結果が保存されます。
+
+CREATE TABLE IF NOT EXISTS RecruitmentSentiment (
+    recruitment_id INTEGER PRIMARY KEY REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    content_hash CHAR(32) NOT NULL,
+    analyzer VARCHAR(50) NOT NULL,
+    sentiment_score REAL NOT NULL,
+    sentiment_magnitude REAL NOT NULL,
+    applicants INTEGER NOT NULL DEFAULT 0,
+    analyzed_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
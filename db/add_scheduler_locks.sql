@@ -0,0 +1,10 @@
+-- add_scheduler_locks.sql
+-- 既存のデータベースに、scheduler.py がジョブの同時実行を防ぐためのロックの表を追加します。
+-- scheduler.py (Procfile の worker) を起動する前に実行してください。
+
+-- scheduler.py のジョブのロック (同じジョブを複数の worker で同時に実行しないために使う)
+CREATE TABLE IF NOT EXISTS SchedulerLocks (
+    job_name VARCHAR(100) PRIMARY KEY,
+    locked_until TIMESTAMP WITH TIME ZONE NOT NULL,
+    locked_by VARCHAR(255) NOT NULL
+);
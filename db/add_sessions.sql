@@ -0,0 +1,11 @@
+-- add_sessions.sql
+-- 既存のデータベースにサーバー側セッション用のテーブルを追加します。
+-- 期限切れのセッションは `python jobs.py purge_expired_sessions` で削除されます (scheduler.py の既定のスケジュールで1時間ごとに実行)。
+
+-- セッションは失われても再ログインで復旧できるため、WALを書かない UNLOGGED テーブルにする
+CREATE UNLOGGED TABLE IF NOT EXISTS Sessions (
+    session_id VARCHAR(128) PRIMARY KEY,
+    data BYTEA NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON Sessions (expires_at);
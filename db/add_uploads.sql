@@ -0,0 +1,19 @@
+-- add_uploads.sql
+-- 既存のデータベースにアップロード画像のテーブルと、募集案件の画像列を追加します。
+-- リサイズ版は `python jobs.py generate_upload_variants` で作成されます。
+
+CREATE TABLE IF NOT EXISTS Uploads (
+    content_hash CHAR(64) PRIMARY KEY,
+    extension VARCHAR(10) NOT NULL,
+    content_type VARCHAR(50) NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    original_name VARCHAR(255),
+    width INTEGER,
+    height INTEGER,
+    variants_ready BOOLEAN NOT NULL DEFAULT FALSE,
+    variant_error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_pending ON Uploads (created_at) WHERE variants_ready = FALSE AND variant_error IS NULL;
+
+ALTER TABLE Recruitments ADD COLUMN IF NOT EXISTS image_hash CHAR(64) REFERENCES Uploads(content_hash);
@@ -8,7 +8,7 @@ CREATE TYPE volunteer_gender AS ENUM ('Male', 'Female', 'Other', 'Unspecified');
 CREATE TYPE recruitment_status AS ENUM ('Draft', 'Open', 'Closed');
 
 -- 応募ステータス
-CREATE TYPE application_status AS ENUM ('Pending', 'Approved', 'Rejected');
+CREATE TYPE application_status AS ENUM ('Pending', 'Approved', 'Rejected', 'Waitlisted');
 
 -- 1. SuperAdmins (システム自体の管理人)
 CREATE TABLE SuperAdmins (
@@ -69,20 +69,59 @@ CREATE TABLE Recruitments (
     end_date DATE,
     status recruitment_status DEFAULT 'Draft',
     contact_phone_number VARCHAR(20),
-    contact_email VARCHAR(255) NOT NULL DEFAULT ''
+    contact_email VARCHAR(255) NOT NULL DEFAULT '',
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 CREATE INDEX idx_recruitments_status ON Recruitments (status);
 
 -- 7. Applications (応募情報)
+-- application_date の年ごとにパーティション分割する。翌年以降のパーティションは jobs.py の
+-- maintain_application_partitions が作成し、古い年は archive_application_partitions が ApplicationArchive に移す。
+-- 年のパーティションがない日時の応募は applications_default に入る (ジョブが止まっていても応募は失敗しない)。
+-- インデックスは db/add_application_partitions.sql と同じものにすること。
 CREATE TABLE Applications (
-    application_id SERIAL PRIMARY KEY,
+    application_id SERIAL,
     recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id),
     volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id),
-    application_date TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    application_date TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     status application_status DEFAULT 'Pending',
-    UNIQUE (recruitment_id, volunteer_id) 
+    PRIMARY KEY (application_id, application_date)
+) PARTITION BY RANGE (application_date);
+CREATE INDEX idx_applications_recruitment_volunteer ON Applications (recruitment_id, volunteer_id);
+CREATE INDEX idx_applications_volunteer ON Applications (volunteer_id);
+CREATE INDEX idx_applications_application_date ON Applications (application_date);
+
+-- 今年と来年のパーティション
+DO $$
+BEGIN
+    FOR y IN extract(year FROM CURRENT_DATE)::int .. extract(year FROM CURRENT_DATE)::int + 1 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS applications_y%s PARTITION OF Applications FOR VALUES FROM (%L) TO (%L)',
+            y, make_date(y, 1, 1), make_date(y + 1, 1, 1)
+        );
+    END LOOP;
+END $$;
+CREATE TABLE applications_default PARTITION OF Applications DEFAULT;
+
+-- 1人1募集1件の応募 (パーティションをまたいだ一意性は Applications では保証できないため、ここで保証する)。
+-- アーカイブ後も残し、重複応募の防止と応募数の集計に使う。
+CREATE TABLE ApplicationKeys (
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
+    application_id INTEGER NOT NULL,
+    application_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (recruitment_id, volunteer_id)
 );
 
+-- アーカイブ済みの応募 (切り離したパーティションの行を、ボランティアごとに1つの JSONB にまとめて圧縮保存する)
+CREATE TABLE ApplicationArchive (
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
+    partition_name VARCHAR(63) NOT NULL,
+    applications JSONB NOT NULL,
+    archived_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (volunteer_id, partition_name)
+) WITH (toast_tuple_target = 128);
+
 -- 8. RecruitmentCategories (カテゴリテーブル)
 CREATE TABLE RecruitmentCategories (
     category_id SERIAL PRIMARY KEY,
@@ -102,4 +141,160 @@ CREATE TABLE VolunteerCategoryInterests (
     volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
     category_id INTEGER NOT NULL REFERENCES RecruitmentCategories(category_id) ON DELETE CASCADE,
     PRIMARY KEY (volunteer_id, category_id)
-);
\ No newline at end of file
+);
+
+-- 11. RecruitmentSentiment (募集テキストのAI分析結果。jobs.py の analyze_recruitments で更新)
+CREATE TABLE RecruitmentSentiment (
+    recruitment_id INTEGER PRIMARY KEY REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    content_hash CHAR(32) NOT NULL,           -- 分析時のタイトル+本文のmd5 (変更検知用)
+    analyzer VARCHAR(50) NOT NULL,            -- 使用したアナライザー (local / google)
+    sentiment_score REAL NOT NULL,
+    sentiment_magnitude REAL NOT NULL,
+    applicants INTEGER NOT NULL DEFAULT 0,    -- 応募者数のスナップショット
+    analyzed_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+
+-- 12. 日次集計テーブル (jobs.py の refresh_daily_stats で増分更新)
+-- category_id = 0 の行はカテゴリを問わない合計値を表す
+CREATE TABLE DailyApplicationStats (
+    stat_date DATE NOT NULL,
+    organization_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL DEFAULT 0,
+    applications INTEGER NOT NULL DEFAULT 0,
+    approvals INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, organization_id, category_id)
+);
+
+CREATE TABLE DailyRecruitmentStats (
+    stat_date DATE NOT NULL,
+    organization_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL DEFAULT 0,
+    new_recruitments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, organization_id, category_id)
+);
+
+CREATE TABLE DailyVolunteerStats (
+    stat_date DATE NOT NULL,
+    organization_id INTEGER NOT NULL,
+    new_volunteers INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, organization_id)
+);
+
+-- 集計ジョブがどこまで処理したかを記録する
+CREATE TABLE RollupWatermarks (
+    rollup_name VARCHAR(100) PRIMARY KEY,
+    watermark TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_volunteers_registration_date ON Volunteers (registration_date);
+CREATE INDEX idx_recruitments_created_at ON Recruitments (created_at);
+
+-- scheduler.py のジョブのロック (同じジョブを複数の worker で同時に実行しないために使う)
+CREATE TABLE SchedulerLocks (
+    job_name VARCHAR(100) PRIMARY KEY,
+    locked_until TIMESTAMP WITH TIME ZONE NOT NULL,
+    locked_by VARCHAR(255) NOT NULL
+);
+
+-- サーバー側セッション (session_store.py の PostgresSessionStore が使用)
+CREATE UNLOGGED TABLE Sessions (
+    session_id VARCHAR(128) PRIMARY KEY,
+    data BYTEA NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+CREATE INDEX idx_sessions_expires_at ON Sessions (expires_at);
+
+-- アップロード画像 (内容のSHA-256で重複を排除する。uploads.py を参照)
+CREATE TABLE Uploads (
+    content_hash CHAR(64) PRIMARY KEY,
+    extension VARCHAR(10) NOT NULL,
+    content_type VARCHAR(50) NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    original_name VARCHAR(255),
+    width INTEGER,
+    height INTEGER,
+    variants_ready BOOLEAN NOT NULL DEFAULT FALSE,
+    variant_error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+-- リサイズ待ちの画像だけを対象にする部分インデックス
+CREATE INDEX idx_uploads_pending ON Uploads (created_at) WHERE variants_ready = FALSE AND variant_error IS NULL;
+
+ALTER TABLE Recruitments ADD COLUMN image_hash CHAR(64) REFERENCES Uploads(content_hash);
+
+-- ボランティアごとのおすすめ募集の上位N件 (jobs.py の refresh_recommendations で作成。/api/recommendations が参照)
+CREATE TABLE VolunteerRecommendations (
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
+    rank SMALLINT NOT NULL,
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    score REAL NOT NULL,
+    computed_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (volunteer_id, rank)
+);
+CREATE INDEX idx_volunteer_recommendations_recruitment ON VolunteerRecommendations (recruitment_id);
+-- おすすめの計算に使う共起の表 (refresh_recommendations が実行のたびに作り直す作業用の表。WALは書かない)
+CREATE UNLOGGED TABLE CategoryCooccurrence (
+    category_a INTEGER NOT NULL,
+    category_b INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (category_a, category_b)
+);
+CREATE UNLOGGED TABLE OrganizationCooccurrence (
+    organization_a INTEGER NOT NULL,
+    organization_b INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (organization_a, organization_b)
+);
+
+-- まとめて通知する新着募集の待ち行列 (server.py の NOTIFICATION_MODE、jobs.py の send_notification_digests を参照)
+CREATE TABLE PendingRecruitmentNotifications (
+    recruitment_id INTEGER PRIMARY KEY REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    queued_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+-- まとめ通知を送り終えた (ボランティア, 募集)。送信が途中で失敗した時に、送った人へ再送しないために使う
+CREATE TABLE SentRecruitmentNotifications (
+    volunteer_id INTEGER NOT NULL REFERENCES Volunteers(volunteer_id) ON DELETE CASCADE,
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    sent_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (volunteer_id, recruitment_id)
+);
+CREATE INDEX idx_sent_recruitment_notifications_recruitment ON SentRecruitmentNotifications (recruitment_id);
+
+-- 郵便番号ごとの代表地点 (geo.py の `python geo.py load` で読み込む。geohash は7桁)
+CREATE TABLE PostalCodes (
+    postal_code CHAR(7) PRIMARY KEY,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    geohash VARCHAR(12) NOT NULL
+);
+
+-- 募集の活動場所 (郵便番号から PostalCodes の位置をコピーする)
+ALTER TABLE Recruitments ADD COLUMN postal_code CHAR(7);
+ALTER TABLE Recruitments ADD COLUMN latitude DOUBLE PRECISION;
+ALTER TABLE Recruitments ADD COLUMN longitude DOUBLE PRECISION;
+ALTER TABLE Recruitments ADD COLUMN geohash VARCHAR(12);
+CREATE INDEX idx_recruitments_open_geohash5 ON Recruitments (left(geohash, 5)) WHERE status = 'Open';
+CREATE INDEX idx_recruitments_open_geohash4 ON Recruitments (left(geohash, 4)) WHERE status = 'Open';
+
+-- 公開中の募集だけの部分インデックス (終了日を過ぎた募集は scheduler.py が Closed にする)
+CREATE INDEX idx_recruitments_open_start_date ON Recruitments (start_date DESC) WHERE status = 'Open';
+CREATE INDEX idx_recruitments_open_end_date ON Recruitments (end_date) WHERE status = 'Open';
+
+-- 募集人数 (NULL は人数制限なし) と空き枠のカウンター (seats.py を参照)。
+-- 空き枠は SEAT_COUNTER_SHARDS 行に分けて持ち、応募が集中しても1行のロックを奪い合わないようにする
+ALTER TABLE Recruitments ADD COLUMN capacity INTEGER CHECK (capacity IS NULL OR capacity > 0);
+CREATE TABLE RecruitmentSeatShards (
+    recruitment_id INTEGER NOT NULL REFERENCES Recruitments(recruitment_id) ON DELETE CASCADE,
+    shard SMALLINT NOT NULL,
+    remaining INTEGER NOT NULL CHECK (remaining >= 0),
+    PRIMARY KEY (recruitment_id, shard)
+);
+-- キャンセル待ちを応募順に繰り上げるためのインデックス
+CREATE INDEX idx_applications_waitlist ON Applications (recruitment_id, application_date, application_id) WHERE status = 'Waitlisted';
+
+-- フラグメントキャッシュのデータのバージョン (template_cache.py と server.py の bump_data_version を参照)
+CREATE TABLE DataVersions (
+    name VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
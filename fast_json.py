@@ -0,0 +1,78 @@
+# fast_json.py
+#
+# APIのJSONレスポンスを高速に作成するモジュールです。
+#
+# 1. OrjsonProvider
+#    app.json を orjson を使うものに置き換え、jsonify を高速にします。
+#    出力の形式 (キーの並び順、日付をHTTP日付の文字列にする等) は Flask の既定と同じです。
+#
+# 2. rows_response(cursor)
+#    DictCursor と dict(row) を使わず、実行済みのカーソルのタプル行から直接JSONの配列を作成します。
+#    表示用の日付は Python の strftime ではなく、SQL の to_char で整形してから取得してください。
+#    例: to_char(r.start_date, 'YYYY"年"MM"月"DD"日"') AS start_date
+#
+# 計測は bench/bench_json_responses.py で行えます。
+
+import decimal
+from datetime import date
+
+import orjson
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+# 日付は orjson に任せず _default で変換する (Flask の既定と同じ形式にするため)
+RESPONSE_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+ROW_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_APPEND_NEWLINE
+
+
+def _default(obj):
+    """orjson が直接扱えない値を変換します (Flask の DefaultJSONProvider と同じ変換)。"""
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """orjson でJSONを作成する Flask の JSON プロバイダー"""
+
+    def dumps(self, obj, **kwargs):
+        # indent などの引数が指定された場合 (セッションのシリアライザー等) は標準の json を使う
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        option = RESPONSE_OPTIONS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        return orjson.dumps(obj, default=_default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            # デバッグ時は読みやすいようにインデント付きで出力する
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        option = RESPONSE_OPTIONS | orjson.OPT_APPEND_NEWLINE | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        return self._app.response_class(orjson.dumps(obj, default=_default, option=option), mimetype=self.mimetype)
+
+
+def rows_to_json(columns, rows):
+    """列名のリストとタプル行から、JSONの配列 (bytes) を作成します。"""
+    return orjson.dumps([dict(zip(columns, row)) for row in rows], default=_default, option=ROW_OPTIONS)
+
+
+def rows_response(cursor, status=200):
+    """実行済みのカーソルの全行を、列名をキーにしたJSON配列のレスポンスとして返します。"""
+    columns = [column[0] for column in cursor.description]
+    body = rows_to_json(columns, cursor.fetchall())
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+
+def init_app(app):
+    """Flaskアプリの jsonify を orjson で行うようにします。"""
+    app.json = OrjsonProvider(app)
@@ -0,0 +1,203 @@
+# geo.py
+#
+# 郵便番号による近くの募集の検索 (/api/recruitments?postal_code=...&radius_km=10) に使う位置情報の処理です。
+#
+# 郵便番号の位置:
+#   郵便番号ごとの緯度・経度は PostalCodes テーブルに読み込んでおきます (外部APIは使いません)。
+#   データは「郵便番号,緯度,経度」のCSV (1行目が見出しでも可) を用意し、次のコマンドで読み込みます。
+#     python geo.py load <CSVファイル>
+#   読み込み後、郵便番号が登録されている募集の位置もまとめて更新します。
+#
+# 検索:
+#   募集の位置は geohash (地図を格子に区切った文字列) でも保存し、先頭4文字・5文字の部分インデックスを作成します。
+#   検索時は半径を覆う格子の一覧を求めてインデックスで候補を絞り、正確な距離 (haversine) で並べ替えます。
+#   そのため、募集が100万件あっても、読み込むのは検索地点の周辺の行だけです。
+
+import csv
+import math
+import re
+import sys
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 7
+# インデックスを作成している geohash の桁数 (db/add_proximity_search.sql を参照)
+INDEXED_PRECISIONS = (5, 4)
+MAX_COVERING_CELLS = 64
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+DEFAULT_RADIUS_KM = 10
+MAX_RADIUS_KM = 50
+
+
+def normalize_postal_code(value):
+    """'123-4567' や全角数字の郵便番号を 7桁の数字に揃えます。不正な場合は None を返します。"""
+    if not value:
+        return None
+    digits = re.sub(r"\D", "", str(value).translate(str.maketrans("０１２３４５６７８９", "0123456789")))
+    return digits if len(digits) == 7 else None
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """緯度・経度を geohash の文字列に変換します。"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        target, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (target[0] + target[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            target[0] = mid
+        else:
+            target[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """geohash の1つの格子の大きさ (緯度の度数, 経度の度数) を返します。"""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def _steps(start, end, step):
+    """start から end まで step ごとの値 (end を必ず含む) を返します。"""
+    values = []
+    value = start
+    while value < end:
+        values.append(value)
+        value += step
+    values.append(end)
+    return values
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    中心から半径 radius_km の範囲を覆う geohash の格子を返します: (桁数, 格子の一覧)。
+    格子が MAX_COVERING_CELLS 個以内に収まる、最も細かい桁数を選びます。
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    south, north = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    west, east = max(longitude - dlon, -180.0), min(longitude + dlon, 180.0)
+
+    for precision in INDEXED_PRECISIONS:
+        cell_lat, cell_lon = cell_size(precision)
+        lats = _steps(south, north, cell_lat)
+        lons = _steps(west, east, cell_lon)
+        if len(lats) * len(lons) <= MAX_COVERING_CELLS or precision == INDEXED_PRECISIONS[-1]:
+            cells = {geohash_encode(lat, lon, precision) for lat in lats for lon in lons}
+            return precision, sorted(cells)
+
+
+def distance_sql(alias, lat_param, lon_param):
+    """中心 (lat_param, lon_param) から募集 alias までの距離 (km) を求めるSQLの式を返します。"""
+    return f"""(
+        {EARTH_RADIUS_KM} * 2 * asin(sqrt(
+            power(sin(radians({alias}.latitude - {lat_param}) / 2), 2)
+            + cos(radians({lat_param})) * cos(radians({alias}.latitude))
+            * power(sin(radians({alias}.longitude - {lon_param}) / 2), 2)
+        ))
+    )"""
+
+
+def distance_params(latitude, longitude):
+    """distance_sql("r", "%s", "%s") の式に渡すパラメータを、プレースホルダーの順に返します。"""
+    return [latitude, latitude, longitude]
+
+
+def find_postal_location(cursor, postal_code):
+    """郵便番号の (緯度, 経度) を返します。見つからない場合は None を返します。"""
+    cursor.execute("SELECT latitude, longitude FROM PostalCodes WHERE postal_code = %s", (postal_code,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else None
+
+# ------------------------------
+# 郵便番号データの読み込み
+# ------------------------------
+
+def read_postal_csv(path):
+    """「郵便番号,緯度,経度」のCSVを読み込み、(郵便番号, 緯度, 経度, geohash) を順に返します。"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            postal_code = normalize_postal_code(row[0])
+            try:
+                latitude, longitude = float(row[1]), float(row[2])
+            except ValueError:
+                # 見出し行など
+                continue
+            if postal_code:
+                yield postal_code, latitude, longitude, geohash_encode(latitude, longitude)
+
+
+def load_postal_codes(conn, path, batch_size=5000):
+    """郵便番号の位置を PostalCodes に読み込み、募集の位置を更新します。(読み込んだ件数, 更新した募集の件数) を返します。"""
+    from psycopg2.extras import execute_values
+
+    cursor = conn.cursor()
+    loaded = 0
+    try:
+        batch = []
+        for values in read_postal_csv(path):
+            batch.append(values)
+            if len(batch) >= batch_size:
+                loaded += _upsert_postal_codes(cursor, batch, execute_values)
+                batch = []
+        if batch:
+            loaded += _upsert_postal_codes(cursor, batch, execute_values)
+
+        cursor.execute("""
+            UPDATE Recruitments r
+            SET latitude = p.latitude, longitude = p.longitude, geohash = p.geohash
+            FROM PostalCodes p
+            WHERE p.postal_code = r.postal_code AND r.geohash IS DISTINCT FROM p.geohash
+        """)
+        updated = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return loaded, updated
+
+
+def _upsert_postal_codes(cursor, batch, execute_values):
+    execute_values(cursor, """
+        INSERT INTO PostalCodes (postal_code, latitude, longitude, geohash) VALUES %s
+        ON CONFLICT (postal_code) DO UPDATE
+        SET latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude, geohash = EXCLUDED.geohash
+    """, batch)
+    return len(batch)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "load":
+        print("使い方: python geo.py load <郵便番号,緯度,経度 のCSVファイル>")
+        sys.exit(1)
+
+    from server import get_db_connection
+
+    conn = get_db_connection()
+    if conn is None:
+        print("データベースに接続できませんでした。")
+        sys.exit(1)
+    try:
+        loaded, updated = load_postal_codes(conn, sys.argv[2])
+    finally:
+        conn.close()
+    print(f"{loaded}件の郵便番号を読み込み、{updated}件の募集の位置を更新しました。")
+    sys.exit(0)
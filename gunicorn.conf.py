@@ -0,0 +1,99 @@
+# gunicorn.conf.py
+#
+# gunicornの設定ファイルです。Procfile から `gunicorn -c gunicorn.conf.py` で読み込まれます。
+#
+# 環境変数 SERVER_MODE でアプリケーションを切り替えます。
+#   wsgi : 既存のFlaskアプリ (server:app) を GUNICORN_PROFILE のワーカーで実行 (既定)
+#   asgi : 公開APIを非同期で処理する asgi:application を uvicorn ワーカーで実行
+#
+# 環境変数 GUNICORN_PROFILE でワーカーの種類と並列数を切り替えます (SERVER_MODE=wsgi の時)。
+#   sync   : 1ワーカー1リクエスト。CPU数から 2*コア+1 のワーカー (既定。以前の `gunicorn server:app` と同じワーカーの種類)
+#   gthread: 1ワーカーあたり GUNICORN_THREADS スレッド
+#   gevent : 1ワーカーあたり多数のグリーンスレッド (gevent と psycogreen が必要)
+#
+# どのプロファイルでも、ワーカー数 × ワーカーあたりの接続プール (DB_POOL_SIZE) が
+# DB_MAX_CONNECTIONS を超えないようにワーカー数を決めます。
+# 各プロファイルの計測は bench/bench_gunicorn_profiles.py で行えます。
+# 既定のプロファイルは、本番と同じ環境で計測した結果を記録してから変更してください。
+# 各値は同名の環境変数 (GUNICORN_WORKERS など) で個別に上書きできます。
+
+import multiprocessing
+import os
+
+SERVER_MODE = os.getenv("SERVER_MODE", "wsgi").lower()
+PROFILE = os.getenv("GUNICORN_PROFILE", "sync").lower()
+
+CORES = multiprocessing.cpu_count()
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+
+
+def workers_for(connections_per_worker, preferred):
+    """DBの最大接続数に収まる範囲で、ワーカー数を決めます。"""
+    by_db = max(1, DB_MAX_CONNECTIONS // max(1, connections_per_worker))
+    return int(os.getenv("GUNICORN_WORKERS", str(min(preferred, by_db))))
+
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    # 非同期APIのプール + 他のURLを処理するスレッド用のプール
+    os.environ.setdefault("ASYNC_DB_POOL_SIZE", "10")
+    os.environ.setdefault("DB_POOL_SIZE", "5")
+    workers = workers_for(int(os.environ["ASYNC_DB_POOL_SIZE"]) + int(os.environ["DB_POOL_SIZE"]), CORES)
+elif SERVER_MODE == "wsgi":
+    wsgi_app = "server:app"
+    if PROFILE == "sync":
+        worker_class = "sync"
+        # 1ワーカーが同時に使う接続は1本だけ
+        os.environ.setdefault("DB_POOL_SIZE", "1")
+        workers = workers_for(1, 2 * CORES + 1)
+    elif PROFILE == "gthread":
+        worker_class = "gthread"
+        threads = int(os.getenv("GUNICORN_THREADS", "4"))
+        # スレッドごとに1本の接続を使えるようにする
+        os.environ.setdefault("DB_POOL_SIZE", str(threads))
+        workers = workers_for(int(os.environ["DB_POOL_SIZE"]), CORES + 1)
+    elif PROFILE == "gevent":
+        worker_class = "gevent"
+        worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+        # 接続はグリーンスレッド間で共有し、空きがない場合はプールで待たせる
+        os.environ.setdefault("DB_POOL_SIZE", "10")
+        workers = workers_for(int(os.environ["DB_POOL_SIZE"]), CORES)
+    else:
+        raise ValueError(f"未知の GUNICORN_PROFILE です: {PROFILE} (使用可能: sync, gthread, gevent)")
+else:
+    raise ValueError(f"未知の SERVER_MODE です: {SERVER_MODE} (使用可能: wsgi, asgi)")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# リバースプロキシからの接続を再利用できるよう、keep-aliveを既定 (2秒) より長めにする (syncワーカーでは無視される)
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# PDF生成やメール送信を含むため、応答のないワーカーは30秒で再起動する
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# メモリの増加を防ぐため、一定数のリクエストごとにワーカーを入れ替える (同時に再起動しないようにずらす)
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+
+def post_fork(server, worker):
+    if SERVER_MODE == "wsgi" and PROFILE == "gevent":
+        # psycopg2の通信中に他のグリーンスレッドへ処理を譲るようにする
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def on_starting(server):
+    # ワーカーを起動する前に、静的ファイルのハッシュ付きコピーと事前圧縮を作成する
+    import static_assets
+    manifest, _ = static_assets.build()
+    server.log.info("静的ファイルをビルドしました: %s件", len(manifest))
+    # 全テンプレートを事前にコンパイルし、バイトコードをワーカー間で共有する
+    # (server をマスタープロセスに読み込まないよう、別プロセスで実行する)
+    import subprocess
+    import sys
+    subprocess.run([sys.executable, "template_cache.py"], cwd=os.path.dirname(os.path.abspath(__file__)), check=False)
+    server.log.info(
+        "SERVER_MODE=%s GUNICORN_PROFILE=%s workers=%s DB_POOL_SIZE=%s",
+        SERVER_MODE, PROFILE, workers, os.environ.get("DB_POOL_SIZE"),
+    )
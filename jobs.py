@@ -0,0 +1,859 @@
+# jobs.py
+#
+# 定期実行するバックグラウンドジョブをまとめたモジュールです。
+# Webリクエストの中では重すぎる処理 (外部APIの呼び出しや集計) をここで事前に計算し、
+# 結果をテーブルに保存しておきます。
+#
+# 定期実行は scheduler.py (Procfile の worker) が行います。既定のスケジュールは scheduler.py を参照してください。
+# 手動で1回だけ実行する場合:
+#   python jobs.py                        # 登録されているジョブを一覧表示
+#   python jobs.py analyze_recruitments   # 指定したジョブを実行
+
+import datetime
+import os
+import re
+import sys
+import time
+
+import psycopg2
+import psycopg2.extras
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOBS = {}
+
+
+def job(name):
+    """ジョブを名前付きで登録するデコレータ"""
+    def register(f):
+        JOBS[name] = f
+        return f
+    return register
+
+
+def get_db_connection():
+    """ジョブ用のデータベース接続を取得します。"""
+    from server import get_db_connection as server_get_db_connection
+    return server_get_db_connection()
+
+# ------------------------------
+# AI分析 (募集テキストの感情分析)
+# ------------------------------
+
+# 募集のタイトルと本文から計算するハッシュ。変更検知に使用する。
+RECRUITMENT_CONTENT_HASH = "md5(coalesce(r.title, '') || E'\\n' || coalesce(r.description, ''))"
+
+
+@job('analyze_recruitments')
+def analyze_recruitments(conn, analyzer=None, batch_size=None):
+    """
+    新規または内容が変更された募集だけを感情分析し、RecruitmentSentimentに保存します。
+    分析はアナライザーにまとめて渡し (バッチ処理)、最後に応募者数のスナップショットを更新します。
+    """
+    from sentiment import get_analyzer
+
+    analyzer = analyzer or get_analyzer()
+    batch_size = batch_size or int(os.getenv("SENTIMENT_BATCH_SIZE", "50"))
+
+    analyzed_count = 0
+    failed_count = 0
+    last_id = 0
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        while True:
+            # キーセット方式で未分析・変更済みの募集を取得する
+            cursor.execute(f"""
+                SELECT r.recruitment_id, r.title, r.description, {RECRUITMENT_CONTENT_HASH} AS content_hash
+                FROM Recruitments r
+                LEFT JOIN RecruitmentSentiment s ON s.recruitment_id = r.recruitment_id
+                WHERE r.recruitment_id > %s
+                  AND (s.recruitment_id IS NULL OR s.content_hash <> {RECRUITMENT_CONTENT_HASH})
+                ORDER BY r.recruitment_id
+                LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['recruitment_id']
+
+            texts = [f"{row['title']} {row['description'] or ''}" for row in rows]
+            results = analyzer.analyze_batch(texts)
+
+            values = []
+            for row, result in zip(rows, results):
+                if result is None:
+                    # 失敗したものは保存せず、次回の実行で再分析する
+                    failed_count += 1
+                    continue
+                values.append((
+                    row['recruitment_id'], row['content_hash'], analyzer.name,
+                    result['sentiment_score'], result['sentiment_magnitude']
+                ))
+
+            if values:
+                psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO RecruitmentSentiment
+                        (recruitment_id, content_hash, analyzer, sentiment_score, sentiment_magnitude, analyzed_at)
+                    VALUES %s
+                    ON CONFLICT (recruitment_id) DO UPDATE SET
+                        content_hash = EXCLUDED.content_hash,
+                        analyzer = EXCLUDED.analyzer,
+                        sentiment_score = EXCLUDED.sentiment_score,
+                        sentiment_magnitude = EXCLUDED.sentiment_magnitude,
+                        analyzed_at = EXCLUDED.analyzed_at
+                """, values, template="(%s, %s, %s, %s, %s, NOW())")
+            conn.commit()
+            analyzed_count += len(values)
+
+        # 応募者数はテキストと無関係に変わるため、分析済みの全件をまとめて更新する
+        cursor.execute("""
+            UPDATE RecruitmentSentiment s
+            SET applicants = c.applicants
+            FROM (
+                SELECT s2.recruitment_id, COUNT(k.application_id) AS applicants
+                FROM RecruitmentSentiment s2
+                LEFT JOIN ApplicationKeys k ON k.recruitment_id = s2.recruitment_id
+                GROUP BY s2.recruitment_id
+            ) c
+            WHERE s.recruitment_id = c.recruitment_id
+              AND s.applicants IS DISTINCT FROM c.applicants
+        """)
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return f"{analyzed_count}件を分析しました。(失敗: {failed_count}件, アナライザー: {analyzer.name})"
+
+# ------------------------------
+# 日次集計 (ロールアップ)
+# ------------------------------
+
+# 各集計の定義。watermark_column の値をもとに、前回の処理位置から増分で再集計する。
+# 応募は後から承認されることがあるため、lookback_days 日分さかのぼって集計し直す。
+DAILY_ROLLUPS = [
+    {
+        'name': 'daily_applications',
+        'table': 'DailyApplicationStats',
+        'source': 'Applications',
+        'watermark_column': 'application_date',
+        'lookback_days': int(os.getenv("ROLLUP_LOOKBACK_DAYS", "7")),
+        'insert': """
+            INSERT INTO DailyApplicationStats (stat_date, organization_id, category_id, applications, approvals)
+            SELECT a.application_date::date, r.organization_id, 0,
+                   COUNT(*), COUNT(*) FILTER (WHERE a.status = 'Approved')
+            FROM Applications a
+            JOIN Recruitments r ON r.recruitment_id = a.recruitment_id
+            WHERE a.application_date >= %(start)s
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT a.application_date::date, r.organization_id, rcm.category_id,
+                   COUNT(*), COUNT(*) FILTER (WHERE a.status = 'Approved')
+            FROM Applications a
+            JOIN Recruitments r ON r.recruitment_id = a.recruitment_id
+            JOIN RecruitmentCategoryMap rcm ON rcm.recruitment_id = r.recruitment_id
+            WHERE a.application_date >= %(start)s
+            GROUP BY 1, 2, 3
+        """,
+    },
+    {
+        'name': 'daily_recruitments',
+        'table': 'DailyRecruitmentStats',
+        'source': 'Recruitments',
+        'watermark_column': 'created_at',
+        'lookback_days': 1,
+        'insert': """
+            INSERT INTO DailyRecruitmentStats (stat_date, organization_id, category_id, new_recruitments)
+            SELECT r.created_at::date, r.organization_id, 0, COUNT(*)
+            FROM Recruitments r
+            WHERE r.created_at >= %(start)s
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT r.created_at::date, r.organization_id, rcm.category_id, COUNT(*)
+            FROM Recruitments r
+            JOIN RecruitmentCategoryMap rcm ON rcm.recruitment_id = r.recruitment_id
+            WHERE r.created_at >= %(start)s
+            GROUP BY 1, 2, 3
+        """,
+    },
+    {
+        'name': 'daily_volunteers',
+        'table': 'DailyVolunteerStats',
+        'source': 'Volunteers',
+        'watermark_column': 'registration_date',
+        'lookback_days': 1,
+        'insert': """
+            INSERT INTO DailyVolunteerStats (stat_date, organization_id, new_volunteers)
+            SELECT v.registration_date::date, v.organization_id, COUNT(*)
+            FROM Volunteers v
+            WHERE v.registration_date >= %(start)s
+            GROUP BY 1, 2
+        """,
+    },
+]
+
+
+def refresh_rollup(conn, rollup):
+    """1つの日次集計を、前回のウォーターマークから増分で更新します。"""
+    cursor = conn.cursor()
+    try:
+        # 同じ集計が並行して実行されないようにロックする (トランザクション終了時に解放)
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (rollup['name'],))
+        cursor.execute("SELECT watermark FROM RollupWatermarks WHERE rollup_name = %s", (rollup['name'],))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute(
+                "SELECT (%s::timestamp - make_interval(days => %s))::date",
+                (row[0], rollup['lookback_days'])
+            )
+            start = cursor.fetchone()[0]
+        else:
+            # 初回は全期間を集計する
+            start = datetime.date(1900, 1, 1)
+
+        cursor.execute(f"DELETE FROM {rollup['table']} WHERE stat_date >= %s", (start,))
+        cursor.execute(rollup['insert'], {'start': start})
+        inserted = cursor.rowcount
+
+        column = rollup['watermark_column']
+        cursor.execute(f"SELECT max({column}) FROM {rollup['source']} WHERE {column} >= %s", (start,))
+        new_watermark = cursor.fetchone()[0]
+        if new_watermark is not None:
+            cursor.execute("""
+                INSERT INTO RollupWatermarks (rollup_name, watermark, updated_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (rollup_name) DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = NOW()
+            """, (rollup['name'], new_watermark))
+        conn.commit()
+        return start, inserted
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+@job('refresh_daily_stats')
+def refresh_daily_stats(conn):
+    """応募・承認・新規ボランティア・新規募集の日次集計を増分更新します。"""
+    results = []
+    for rollup in DAILY_ROLLUPS:
+        start, inserted = refresh_rollup(conn, rollup)
+        results.append(f"{rollup['table']}: {start}以降を再集計 ({inserted}行)")
+    return " / ".join(results)
+
+# ------------------------------
+# アップロード画像のリサイズ
+# ------------------------------
+
+@job('generate_upload_variants')
+def generate_upload_variants(conn, batch_size=None):
+    """
+    リサイズ版がまだない画像について、サムネイルなどのリサイズ版 (WebP / JPEG) を作成します。
+    元画像のあるWebサービスで実行します (通常は画像の登録後に server.start_upload_variants が呼び出す)。
+    """
+    import uploads
+
+    batch_size = batch_size or int(os.getenv("UPLOAD_VARIANT_BATCH_SIZE", "20"))
+    generated_count = 0
+    failed_count = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            # 複数のジョブが同時に動いても同じ画像を処理しないよう、行をロックして取得する
+            cursor.execute("""
+                SELECT content_hash, extension FROM Uploads
+                WHERE variants_ready = FALSE AND variant_error IS NULL
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (batch_size,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for content_hash, extension in rows:
+                try:
+                    width, height = uploads.generate_variants(content_hash, extension)
+                    cursor.execute(
+                        "UPDATE Uploads SET variants_ready = TRUE, width = %s, height = %s WHERE content_hash = %s",
+                        (width, height, content_hash)
+                    )
+                    generated_count += 1
+                except Exception as e:
+                    # 壊れた画像などは記録して、次回以降は処理しない
+                    cursor.execute(
+                        "UPDATE Uploads SET variant_error = %s WHERE content_hash = %s",
+                        (str(e)[:500], content_hash)
+                    )
+                    failed_count += 1
+            conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return f"{generated_count}件の画像のリサイズ版を作成しました。(失敗: {failed_count}件)"
+
+# ------------------------------
+# セッションの掃除
+# ------------------------------
+
+@job('purge_expired_sessions')
+def purge_expired_sessions(conn):
+    """期限切れのサーバー側セッションを削除します。"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM Sessions WHERE expires_at < NOW()")
+        removed = cursor.rowcount
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return f"期限切れのセッションを{removed}件削除しました。"
+
+# ------------------------------
+# 募集期限の過ぎた募集の終了
+# ------------------------------
+
+# 終了日を過ぎた公開中の募集を Closed にします。一覧のクエリ (status = 'Open') と
+# 部分インデックス (db/add_recruitment_expiry.sql) の対象から外れ、読み込む行が増え続けないようにします。
+# 1回の UPDATE はロックを短く保つため batch_size 件までとし、バッチごとにコミットします。
+# 編集中などでロックされている行は飛ばし (SKIP LOCKED)、次回の実行で終了させます。
+CLOSE_EXPIRED_RECRUITMENTS_QUERY = """
+    UPDATE Recruitments SET status = 'Closed'
+    WHERE recruitment_id IN (
+        SELECT recruitment_id FROM Recruitments
+        WHERE status = 'Open' AND end_date < CURRENT_DATE
+        ORDER BY end_date
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+"""
+
+
+@job('close_expired_recruitments')
+def close_expired_recruitments(conn, batch_size=None, max_batches=None):
+    """終了日 (end_date) を過ぎた公開中の募集を、バッチに分けて Closed にします。"""
+    batch_size = batch_size or int(os.getenv("CLOSE_EXPIRED_BATCH_SIZE", "500"))
+    max_batches = max_batches or int(os.getenv("CLOSE_EXPIRED_MAX_BATCHES", "100"))
+
+    closed_count = 0
+    cursor = conn.cursor()
+    try:
+        for _ in range(max_batches):
+            cursor.execute(CLOSE_EXPIRED_RECRUITMENTS_QUERY, (batch_size,))
+            closed = cursor.rowcount
+            conn.commit()
+            closed_count += closed
+            if closed < batch_size:
+                break
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return f"終了日を過ぎた募集を{closed_count}件終了しました。"
+
+# ------------------------------
+# キャンセル待ちの繰り上げ
+# ------------------------------
+
+@job('promote_waitlists')
+def promote_waitlists(conn):
+    """
+    空き枠があるのにキャンセル待ちが残っている募集について、キャンセル待ちを繰り上げます。
+    通常はキャンセル時に繰り上がるため、応募とキャンセルが同時に行われた場合の取りこぼしを拾うためのジョブです。
+    """
+    from seats import promote_waitlist
+
+    promoted_count = 0
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT DISTINCT a.recruitment_id FROM Applications a
+            WHERE a.status = 'Waitlisted'
+              AND EXISTS (
+                  SELECT 1 FROM RecruitmentSeatShards s
+                  WHERE s.recruitment_id = a.recruitment_id AND s.remaining > 0
+              )
+        """)
+        for (recruitment_id,) in cursor.fetchall():
+            promoted_count += len(promote_waitlist(cursor, recruitment_id))
+            conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return f"キャンセル待ちの応募を{promoted_count}件繰り上げました。"
+
+# ------------------------------
+# 応募のパーティション管理
+# ------------------------------
+
+# Applications は application_date の年ごとのパーティション (applications_y2025 など) に分かれています。
+# 年のパーティションがない日時の応募は applications_default に入ります。
+#   maintain_application_partitions: 今年から APPLICATION_PARTITIONS_AHEAD 年先までのパーティションを作成する
+#     (applications_default に入っていたその年の応募は、作成したパーティションに移す)
+#   archive_application_partitions: APPLICATION_ARCHIVE_AFTER_YEARS 年より前のパーティションを
+#     ApplicationArchive (ボランティアごとの JSONB) に移して切り離し、削除する
+# アーカイブ済みの応募も活動履歴と証明書の発行には表示されます (server.py の VOLUNTEER_APPLICATIONS)。
+# 応募の重複防止と応募数の集計は ApplicationKeys で行うため、アーカイブの影響を受けません。
+APPLICATION_PARTITION_PATTERN = re.compile(r"applications_y(\d{4})")
+APPLICATION_DEFAULT_PARTITION = "applications_default"
+
+
+def application_partition_name(year):
+    return f"applications_y{year}"
+
+
+def list_application_partitions(cursor):
+    """Applications のパーティションを (年, テーブル名) の一覧で返します。"""
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'applications'::regclass
+    """)
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = APPLICATION_PARTITION_PATTERN.fullmatch(name)
+        if match:
+            partitions.append((int(match.group(1)), name))
+    return sorted(partitions)
+
+
+@job('maintain_application_partitions')
+def maintain_application_partitions(conn, years_ahead=None):
+    """
+    今年から years_ahead 年先までの、まだない応募のパーティションを作成します。
+    applications_default にその年の応募がある場合は、作成したパーティションに移します
+    (そのままでは既定のパーティションと範囲が重なり、作成できないため)。
+    """
+    years_ahead = years_ahead if years_ahead is not None else int(os.getenv("APPLICATION_PARTITIONS_AHEAD", "1"))
+    this_year = datetime.date.today().year
+
+    created = []
+    moved_rows = 0
+    cursor = conn.cursor()
+    try:
+        existing = {year for year, _ in list_application_partitions(cursor)}
+        for year in range(this_year, this_year + years_ahead + 1):
+            if year in existing:
+                continue
+            bounds = (f"{year}-01-01", f"{year + 1}-01-01")
+            # 作成が終わるまで、既定のパーティションへの応募を待たせる
+            cursor.execute(f"LOCK TABLE {APPLICATION_DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {APPLICATION_DEFAULT_PARTITION} WHERE application_date >= %s AND application_date < %s",
+                bounds
+            )
+            misplaced = cursor.fetchone()[0]
+            if misplaced:
+                cursor.execute(
+                    f"CREATE TEMP TABLE misplaced_applications (LIKE {APPLICATION_DEFAULT_PARTITION}) ON COMMIT DROP"
+                )
+                cursor.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM {APPLICATION_DEFAULT_PARTITION}
+                        WHERE application_date >= %s AND application_date < %s
+                        RETURNING *
+                    )
+                    INSERT INTO misplaced_applications SELECT * FROM moved
+                """, bounds)
+            cursor.execute(
+                f"CREATE TABLE {application_partition_name(year)} PARTITION OF Applications FOR VALUES FROM (%s) TO (%s)",
+                bounds
+            )
+            if misplaced:
+                cursor.execute("INSERT INTO Applications SELECT * FROM misplaced_applications")
+                cursor.execute("DROP TABLE misplaced_applications")
+                moved_rows += misplaced
+            created.append(application_partition_name(year))
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    message = f"応募のパーティションを{len(created)}件作成しました。" + (f" ({', '.join(created)})" if created else "")
+    if moved_rows:
+        message += f" 既定のパーティションから{moved_rows}件の応募を移しました。"
+    return message
+
+
+@job('archive_application_partitions')
+def archive_application_partitions(conn, keep_years=None):
+    """
+    keep_years 年より前の応募のパーティションを、ボランティアごとの JSONB にまとめて ApplicationArchive に移し、
+    Applications から切り離して削除します。パーティションごとに1つのトランザクションで行います。
+    """
+    keep_years = keep_years or int(os.getenv("APPLICATION_ARCHIVE_AFTER_YEARS", "3"))
+    if keep_years < 1:
+        raise ValueError("APPLICATION_ARCHIVE_AFTER_YEARS は1以上にしてください。")
+    cutoff_year = datetime.date.today().year - keep_years
+
+    archived = []
+    archived_rows = 0
+    cursor = conn.cursor()
+    try:
+        for year, name in list_application_partitions(cursor):
+            if year >= cutoff_year:
+                continue
+            # コピー中にこのパーティションの行が変わらないようにする (他の年の応募には影響しない)
+            cursor.execute(f"LOCK TABLE {name} IN SHARE MODE")
+            cursor.execute(f"SELECT COUNT(*) FROM {name}")
+            archived_rows += cursor.fetchone()[0]
+            cursor.execute(f"""
+                INSERT INTO ApplicationArchive (volunteer_id, partition_name, applications)
+                SELECT volunteer_id, %s, jsonb_agg(jsonb_build_object(
+                    'application_id', application_id,
+                    'recruitment_id', recruitment_id,
+                    'application_date', application_date,
+                    'status', status
+                ) ORDER BY application_date, application_id)
+                FROM {name}
+                GROUP BY volunteer_id
+                ON CONFLICT (volunteer_id, partition_name) DO UPDATE
+                SET applications = EXCLUDED.applications, archived_at = CURRENT_TIMESTAMP
+            """, (name,))
+            # 親テーブルの排他ロックはここからコミットまでの短い間だけ
+            cursor.execute(f"ALTER TABLE Applications DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+            conn.commit()
+            archived.append(name)
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return f"応募のパーティションを{len(archived)}件 ({archived_rows}件の応募) アーカイブしました。" + (f" ({', '.join(archived)})" if archived else "")
+
+# ------------------------------
+# おすすめ募集
+# ------------------------------
+
+# 募集1件のスコアは次の合計です (値は重み)。
+#   興味カテゴリと一致するカテゴリ: 3 / 過去に応募した募集のカテゴリ: 2 (応募1件ごと)
+#   過去の応募と同じ市町村の募集: 1 (応募1件ごと)
+#   似た応募履歴を持つボランティアの傾向: 過去に応募したカテゴリ・市町村と一緒に応募されやすい
+#     カテゴリ・市町村 (共起の条件付き確率) × 1
+#   地域: 住んでいる市町村の募集は +1.5、同じ都道府県の募集は +0.5
+# 共起の表はバッチをまたいで使うため、TEMP テーブルではなく作業用の表 (CategoryCooccurrence など) に保存します
+# (トランザクション単位で接続を切り替えるプーラーでは、TEMP テーブルが次のトランザクションから見えないため)。
+RECOMMENDATION_COOCCURRENCE_QUERIES = (
+    # カテゴリの共起: category_a に応募した人のうち、category_b にも応募した人の割合
+    """
+    INSERT INTO CategoryCooccurrence (category_a, category_b, weight)
+    WITH vc AS (
+        SELECT DISTINCT a.volunteer_id, rcm.category_id
+        FROM Applications a
+        JOIN RecruitmentCategoryMap rcm ON rcm.recruitment_id = a.recruitment_id
+    ), totals AS (
+        SELECT category_id, COUNT(*) AS volunteers FROM vc GROUP BY category_id
+    )
+    SELECT x.category_id AS category_a, y.category_id AS category_b,
+           COUNT(*)::real / MAX(t.volunteers) AS weight
+    FROM vc x
+    JOIN vc y ON y.volunteer_id = x.volunteer_id AND y.category_id <> x.category_id
+    JOIN totals t ON t.category_id = x.category_id
+    GROUP BY x.category_id, y.category_id
+    """,
+    # 市町村の共起: organization_a の募集に応募した人のうち、organization_b の募集にも応募した人の割合
+    """
+    INSERT INTO OrganizationCooccurrence (organization_a, organization_b, weight)
+    WITH vo AS (
+        SELECT DISTINCT a.volunteer_id, r.organization_id
+        FROM Applications a
+        JOIN Recruitments r ON r.recruitment_id = a.recruitment_id
+    ), totals AS (
+        SELECT organization_id, COUNT(*) AS volunteers FROM vo GROUP BY organization_id
+    )
+    SELECT x.organization_id AS organization_a, y.organization_id AS organization_b,
+           COUNT(*)::real / MAX(t.volunteers) AS weight
+    FROM vo x
+    JOIN vo y ON y.volunteer_id = x.volunteer_id AND y.organization_id <> x.organization_id
+    JOIN totals t ON t.organization_id = x.organization_id
+    GROUP BY x.organization_id, y.organization_id
+    """,
+)
+
+RECOMMENDATION_INSERT_QUERY = """
+    WITH vols AS (
+        SELECT v.volunteer_id, v.organization_id, o.prefecture_id
+        FROM Volunteers v
+        JOIN Organizations o ON o.organization_id = v.organization_id
+        WHERE v.volunteer_id > %(after)s AND v.volunteer_id <= %(last)s
+    ), open_recruitments AS (
+        SELECT r.recruitment_id, r.organization_id, o.prefecture_id, r.created_at
+        FROM Recruitments r
+        JOIN Organizations o ON o.organization_id = r.organization_id
+        WHERE r.status = 'Open' AND (r.end_date IS NULL OR r.end_date >= CURRENT_DATE)
+    ), history AS (
+        SELECT a.volunteer_id, a.recruitment_id, r.organization_id
+        FROM Applications a
+        JOIN vols USING (volunteer_id)
+        JOIN Recruitments r ON r.recruitment_id = a.recruitment_id
+    ), category_weights AS (
+        SELECT volunteer_id, category_id, SUM(weight) AS weight
+        FROM (
+            SELECT vci.volunteer_id, vci.category_id, 3.0 AS weight
+            FROM VolunteerCategoryInterests vci JOIN vols USING (volunteer_id)
+            UNION ALL
+            SELECT h.volunteer_id, rcm.category_id, 2.0
+            FROM history h JOIN RecruitmentCategoryMap rcm ON rcm.recruitment_id = h.recruitment_id
+            UNION ALL
+            SELECT h.volunteer_id, cc.category_b, cc.weight
+            FROM history h
+            JOIN RecruitmentCategoryMap rcm ON rcm.recruitment_id = h.recruitment_id
+            JOIN CategoryCooccurrence cc ON cc.category_a = rcm.category_id
+        ) w
+        GROUP BY volunteer_id, category_id
+    ), organization_weights AS (
+        SELECT volunteer_id, organization_id, SUM(weight) AS weight
+        FROM (
+            SELECT h.volunteer_id, h.organization_id, 1.0 AS weight FROM history h
+            UNION ALL
+            SELECT h.volunteer_id, oc.organization_b, oc.weight
+            FROM history h JOIN OrganizationCooccurrence oc ON oc.organization_a = h.organization_id
+            UNION ALL
+            SELECT volunteer_id, organization_id, 1.5 FROM vols
+        ) w
+        GROUP BY volunteer_id, organization_id
+    ), candidates AS (
+        SELECT cw.volunteer_id, r.recruitment_id, cw.weight AS score
+        FROM category_weights cw
+        JOIN RecruitmentCategoryMap rcm ON rcm.category_id = cw.category_id
+        JOIN open_recruitments r ON r.recruitment_id = rcm.recruitment_id
+        UNION ALL
+        SELECT ow.volunteer_id, r.recruitment_id, ow.weight
+        FROM organization_weights ow
+        JOIN open_recruitments r ON r.organization_id = ow.organization_id
+    ), scored AS (
+        SELECT c.volunteer_id, c.recruitment_id,
+               SUM(c.score) + CASE WHEN r.prefecture_id = v.prefecture_id THEN 0.5 ELSE 0 END AS score,
+               r.created_at
+        FROM candidates c
+        JOIN vols v ON v.volunteer_id = c.volunteer_id
+        JOIN open_recruitments r ON r.recruitment_id = c.recruitment_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM Applications a
+            WHERE a.volunteer_id = c.volunteer_id AND a.recruitment_id = c.recruitment_id
+        )
+        GROUP BY c.volunteer_id, c.recruitment_id, r.prefecture_id, v.prefecture_id, r.created_at
+    ), ranked AS (
+        SELECT volunteer_id, recruitment_id, score,
+               ROW_NUMBER() OVER (
+                   PARTITION BY volunteer_id ORDER BY score DESC, created_at DESC, recruitment_id DESC
+               ) AS rank
+        FROM scored
+    )
+    INSERT INTO VolunteerRecommendations (volunteer_id, rank, recruitment_id, score)
+    SELECT volunteer_id, rank, recruitment_id, score FROM ranked WHERE rank <= %(top_n)s
+"""
+
+
+@job('refresh_recommendations')
+def refresh_recommendations(conn, batch_size=None, top_n=None):
+    """
+    ボランティアごとに、募集中の案件をスコア順に並べた上位N件を VolunteerRecommendations に作成します。
+    ボランティアを batch_size 人ずつ処理し、バッチごとに古い結果と入れ替えます。
+    """
+    batch_size = batch_size or int(os.getenv("RECOMMENDATION_BATCH_SIZE", "1000"))
+    top_n = top_n or int(os.getenv("RECOMMENDATION_TOP_N", "50"))
+
+    volunteer_count = 0
+    row_count = 0
+    last_id = 0
+    cursor = conn.cursor()
+    try:
+        # 共起の表は全ボランティアの応募履歴から1回だけ計算する
+        cursor.execute("TRUNCATE CategoryCooccurrence, OrganizationCooccurrence")
+        for query in RECOMMENDATION_COOCCURRENCE_QUERIES:
+            cursor.execute(query)
+        cursor.execute("ANALYZE CategoryCooccurrence")
+        cursor.execute("ANALYZE OrganizationCooccurrence")
+        conn.commit()
+
+        while True:
+            cursor.execute("""
+                SELECT MAX(volunteer_id), COUNT(*) FROM (
+                    SELECT volunteer_id FROM Volunteers WHERE volunteer_id > %s ORDER BY volunteer_id LIMIT %s
+                ) batch
+            """, (last_id, batch_size))
+            batch_last_id, batch_count = cursor.fetchone()
+            if not batch_count:
+                break
+            params = {'after': last_id, 'last': batch_last_id, 'top_n': top_n}
+            cursor.execute(
+                "DELETE FROM VolunteerRecommendations WHERE volunteer_id > %(after)s AND volunteer_id <= %(last)s",
+                params
+            )
+            cursor.execute(RECOMMENDATION_INSERT_QUERY, params)
+            row_count += cursor.rowcount
+            conn.commit()
+            volunteer_count += batch_count
+            last_id = batch_last_id
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return f"{volunteer_count}人のおすすめを再計算しました。({row_count}件)"
+
+# ------------------------------
+# 新着募集のまとめ通知
+# ------------------------------
+
+# 通知待ちの募集と、そのカテゴリに興味のあるボランティアを1回の結合で求め、ボランティアごとにまとめる
+# (前回の実行が途中で失敗した場合に備え、既に送った組み合わせ (SentRecruitmentNotifications) は除く)
+DIGEST_RECIPIENTS_QUERY = """
+    WITH matches AS (
+        SELECT DISTINCT vci.volunteer_id, r.recruitment_id
+        FROM Recruitments r
+        JOIN RecruitmentCategoryMap rcm ON rcm.recruitment_id = r.recruitment_id
+        JOIN VolunteerCategoryInterests vci ON vci.category_id = rcm.category_id
+        WHERE r.recruitment_id = ANY(%s) AND r.status = 'Open'
+          AND NOT EXISTS (
+              SELECT 1 FROM SentRecruitmentNotifications s
+              WHERE s.volunteer_id = vci.volunteer_id AND s.recruitment_id = r.recruitment_id
+          )
+    )
+    SELECT v.volunteer_id, v.full_name, v.email,
+           json_agg(
+               json_build_object('recruitment_id', r.recruitment_id, 'title', r.title, 'organization_name', o.name)
+               ORDER BY r.start_date, r.recruitment_id
+           ) AS recruitments
+    FROM matches m
+    JOIN Volunteers v ON v.volunteer_id = m.volunteer_id
+    JOIN Recruitments r ON r.recruitment_id = m.recruitment_id
+    JOIN Organizations o ON o.organization_id = r.organization_id
+    WHERE v.email IS NOT NULL AND v.email <> ''
+    GROUP BY v.volunteer_id, v.full_name, v.email
+    ORDER BY v.volunteer_id
+"""
+
+
+def build_digest_body(full_name, recruitments):
+    """まとめ通知のメール本文を作成します (URLの生成にリクエストコンテキストが必要です)。"""
+    from flask import url_for
+
+    lines = []
+    for recruitment in recruitments:
+        # ログインページへのリンクに、リダイレクト先として募集詳細ページのパスを付与する
+        opportunity_path = url_for('opportunity_detail', recruitment_id=recruitment['recruitment_id'])
+        lines.append(
+            f"■ {recruitment['title']} ({recruitment['organization_name']})\n"
+            f"  {url_for('user_login_page', next=opportunity_path, _external=True)}"
+        )
+    listing = "\n\n".join(lines)
+    return f"""
+{full_name}様
+
+ご登録いただいた興味のあるカテゴリに、新しいボランティア募集が{len(recruitments)}件追加されましたのでお知らせします。
+
+--------------------------------
+{listing}
+--------------------------------
+
+※ログインしていない場合は、ログイン後に募集ページへ自動的に移動します。
+
+今後とも地域支援Hubをよろしくお願いいたします。
+"""
+
+
+@job('send_notification_digests')
+def send_notification_digests(conn):
+    """
+    通知待ちの新着募集を、興味のあるボランティアへ1人1通にまとめてメールで送ります。
+    送った (ボランティア, 募集) の組み合わせは1人送るごとにコミットするため、送信中にエラーが発生しても、
+    次回は残りのボランティアにだけ送ります。全員に送り終えた募集を通知待ちから削除します。
+    """
+    import smtplib
+    from flask_mail import Message
+    from server import app, get_mail
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    sent_count = 0
+    refused_count = 0
+    try:
+        cursor.execute("SELECT recruitment_id FROM PendingRecruitmentNotifications ORDER BY recruitment_id")
+        recruitment_ids = [row[0] for row in cursor.fetchall()]
+        if not recruitment_ids:
+            conn.rollback()
+            return "通知待ちの募集はありません。"
+
+        cursor.execute(DIGEST_RECIPIENTS_QUERY, (recruitment_ids,))
+        recipients = cursor.fetchall()
+        conn.commit()
+
+        subject = "[地域支援Hub] 興味のあるカテゴリに新しい募集が追加されました"
+        if recipients:
+            with app.test_request_context(), get_mail().connect() as mail_connection:
+                # SMTPの接続は全員分で1回だけ確立する
+                for recipient in recipients:
+                    body = build_digest_body(recipient['full_name'], recipient['recruitments'])
+                    msg = Message(subject, sender=app.config['MAIL_USERNAME'], recipients=[recipient['email']], body=body)
+                    try:
+                        mail_connection.send(msg)
+                        sent_count += 1
+                    except smtplib.SMTPRecipientsRefused as e:
+                        # 宛先が受け付けられない場合は、次回も送り直さないよう送信済みとして記録する
+                        print(f"まとめ通知を送れませんでした ({recipient['email']}): {e}")
+                        refused_count += 1
+                    cursor.execute("""
+                        INSERT INTO SentRecruitmentNotifications (volunteer_id, recruitment_id)
+                        SELECT %s, unnest(%s::int[])
+                        ON CONFLICT (volunteer_id, recruitment_id) DO NOTHING
+                    """, (recipient['volunteer_id'], [r['recruitment_id'] for r in recipient['recruitments']]))
+                    conn.commit()
+
+        # 全員に送り終えた募集を通知待ちから外す (送信済みの記録も不要になる)
+        cursor.execute("DELETE FROM PendingRecruitmentNotifications WHERE recruitment_id = ANY(%s)", (recruitment_ids,))
+        cursor.execute("DELETE FROM SentRecruitmentNotifications WHERE recruitment_id = ANY(%s)", (recruitment_ids,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return f"{len(recruitment_ids)}件の新着募集を、{sent_count}人にまとめて通知しました。(宛先エラー: {refused_count}件)"
+
+# ------------------------------
+# メイン実行ブロック
+# ------------------------------
+
+def run_job(name):
+    """名前を指定してジョブを1回実行します。"""
+    conn = get_db_connection()
+    if conn is None:
+        raise RuntimeError("データベースに接続できませんでした。")
+    started = time.monotonic()
+    try:
+        result = JOBS[name](conn)
+    finally:
+        conn.close()
+    print(f"[{name}] {result} ({time.monotonic() - started:.1f}秒)")
+    return result
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in JOBS:
+        print("使い方: python jobs.py <ジョブ名>")
+        print("登録されているジョブ:")
+        for name in JOBS:
+            print(f"  {name}")
+        return 1
+    run_job(argv[1])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
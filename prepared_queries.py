@@ -0,0 +1,94 @@
+# prepared_queries.py
+#
+# 頻繁に実行するクエリ (ログイン時の検索、活動履歴、募集詳細、応募者一覧など) の登録簿です。
+# 登録したクエリは接続ごとに1回だけ PREPARE し、以後は EXECUTE で実行するため、
+# 毎回のSQLの解析と実行計画の作成を省けます。
+#
+# 使い方:
+#   prepared_queries.register('volunteer_by_email', "SELECT ... WHERE email = %s")
+#   prepared_queries.execute(cursor, 'volunteer_by_email', (email,))
+#
+# PREPARE した文は接続 (セッション) に残るため、トランザクション単位で接続を切り替えるプーラー
+# (Supabase の 6543番ポートなど) では使えません。環境変数 DB_PREPARED_STATEMENTS で切り替えます。
+#   auto: 6543番ポートへの接続では使わず、それ以外では使う (既定)
+#   on / off: 常に使う / 使わない (使わない場合は通常の cursor.execute で実行)
+# asgi.py の asyncpg も同じ設定に従い、使わない場合は文のキャッシュ (statement_cache_size) を無効にします。
+# 計測は bench/bench_prepared_statements.py で行えます。
+
+import itertools
+import os
+import re
+
+import psycopg2.errors
+import psycopg2.extensions
+
+TRANSACTION_POOLER_PORTS = {"6543"}
+
+QUERIES = {}
+_disabled = False
+
+
+def register(name, query):
+    """クエリを名前を付けて登録します。クエリのプレースホルダーは psycopg2 と同じ %s です。"""
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", name):
+        raise ValueError(f"クエリ名に使えない文字が含まれています: {name}")
+    QUERIES[name] = query
+    return name
+
+
+def to_numbered_params(query):
+    """%s のプレースホルダーを、PREPARE で使う $1, $2, ... に変換し、(クエリ, パラメータ数) を返します。"""
+    counter = itertools.count(1)
+    converted = re.sub(r"%s", lambda _: f"${next(counter)}", query)
+    return converted, next(counter) - 1
+
+
+def _enabled_for_port(port):
+    mode = os.getenv("DB_PREPARED_STATEMENTS", "auto").lower()
+    if mode == "off" or _disabled:
+        return False
+    if mode == "on":
+        return True
+    return str(port) not in TRANSACTION_POOLER_PORTS
+
+
+def is_enabled(conn):
+    """この接続でサーバー側の PREPARE を使うかどうかを返します。"""
+    return _enabled_for_port(conn.info.port)
+
+
+def is_enabled_for_dsn(dsn):
+    """接続先 (URL または key=value 形式) でサーバー側の PREPARE を使うかどうかを返します。"""
+    return _enabled_for_port(psycopg2.extensions.parse_dsn(dsn).get("port", "5432"))
+
+
+def execute(cursor, name, params=()):
+    """
+    登録したクエリを実行します。この接続でまだ PREPARE していなければ、先に PREPARE します。
+    PREPARE した文が使えないことが分かった場合は PREPARE を無効にし、トランザクションの最初の文であれば
+    ロールバックして通常の実行でやり直します (途中の文の場合は、それまでの処理を失わないよう例外を送出します)。
+    """
+    global _disabled
+    conn = cursor.connection
+    prepared = getattr(conn, "_prepared_statements", None)
+    if prepared is None or not is_enabled(conn):
+        cursor.execute(QUERIES[name], params)
+        return
+
+    first_statement = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    try:
+        if name not in prepared:
+            query, _ = to_numbered_params(QUERIES[name])
+            cursor.execute(f"PREPARE {name} AS {query}")
+            prepared.add(name)
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}", params)
+    except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.DuplicatePreparedStatement):
+        # 接続がプーラーの背後で入れ替わっている: このプロセスでは以後 PREPARE を使わない
+        print("PREPARE した文が見つからないため、プリペアドステートメントを無効にします (DB_PREPARED_STATEMENTS=off を推奨)。")
+        _disabled = True
+        if not first_statement:
+            raise
+        # トランザクションの最初の文なので、ロールバックしても失われる処理はない
+        conn.rollback()
+        cursor.execute(QUERIES[name], params)
@@ -62,12 +62,20 @@ ON CONFLICT (recruitment_id) DO NOTHING;
 
 -- 8. Applications
 -- Note: recruitment_id and volunteer_id must exist.
-INSERT INTO Applications (application_id, recruitment_id, volunteer_id, status) VALUES
-(1, 1, 1, 'Approved'),
-(2, 1, 2, 'Pending'),
-(3, 2, 1, 'Pending'),
-(4, 4, 2, 'Approved')
-ON CONFLICT (application_id) DO NOTHING;
+-- Note: Applications is partitioned by application_date (the partition for that year must exist).
+-- ApplicationKeys enforces one application per volunteer and recruitment.
+INSERT INTO ApplicationKeys (recruitment_id, volunteer_id, application_id, application_date) VALUES
+(1, 1, 1, CURRENT_DATE),
+(1, 2, 2, CURRENT_DATE),
+(2, 1, 3, CURRENT_DATE),
+(4, 2, 4, CURRENT_DATE)
+ON CONFLICT (recruitment_id, volunteer_id) DO NOTHING;
+INSERT INTO Applications (application_id, recruitment_id, volunteer_id, application_date, status)
+SELECT k.application_id, k.recruitment_id, k.volunteer_id, k.application_date, v.status::application_status
+FROM ApplicationKeys k
+JOIN (VALUES (1, 'Approved'), (2, 'Pending'), (3, 'Pending'), (4, 'Approved')) AS v(application_id, status)
+  ON v.application_id = k.application_id
+ON CONFLICT DO NOTHING;
 
 -- 9. RecruitmentCategoryMap
 -- Note: recruitment_id and category_id must exist.
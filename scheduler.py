@@ -0,0 +1,144 @@
+# scheduler.py
+#
+# jobs.py のジョブを一定間隔で実行し続けるプロセスです。Procfile の worker として、
+# Webプロセス (gunicorn) とは別に起動します。
+#   worker: python scheduler.py
+#
+# 実行するジョブと間隔 (秒) は環境変数 SCHEDULER_JOBS で指定します (指定すると既定のスケジュールを置き換えます)。
+#   SCHEDULER_JOBS="close_expired_recruitments:3600,purge_expired_sessions:3600"
+# 既定のスケジュール (DEFAULT_SCHEDULE) は jobs.py のジョブのうち、次のものを除くすべてです。
+#   generate_upload_variants: 元画像はWebサービスのディスクにあるため、Webプロセスが実行する (uploads.py を参照)
+#
+# worker を複数起動しても、同じジョブは SchedulerLocks の行のロックにより同時に1つしか実行されません
+# (トランザクション単位で接続を切り替えるプーラー経由でも使えるよう、セッション単位のアドバイザリロックは使いません)。
+# ロックには期限 (ジョブの間隔と SCHEDULER_MIN_LOCK_SECONDS の長い方) があり、worker が異常終了しても
+# 期限が過ぎれば他の worker が実行できます。
+# SIGTERM を受け取ると、実行中のジョブの終了を待ってから停止します。
+
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from jobs import JOBS, get_db_connection
+
+DEFAULT_SCHEDULE = (
+    "promote_waitlists:300,"                  # キャンセル待ちの繰り上げの取りこぼし
+    "refresh_daily_stats:900,"                # 日別集計の増分更新
+    "close_expired_recruitments:3600,"        # 終了日を過ぎた募集の終了
+    "analyze_recruitments:3600,"              # 新規・変更された募集の感情分析
+    "purge_expired_sessions:3600,"            # 期限切れのサーバー側セッションの削除
+    "refresh_recommendations:21600,"          # おすすめ募集の再計算
+    "send_notification_digests:86400,"        # 新着募集のまとめ通知
+    "maintain_application_partitions:86400,"  # 来年以降の応募のパーティションの作成
+    "archive_application_partitions:86400"    # 古い年の応募のアーカイブ
+)
+# ジョブがないときの待ち時間の上限 (秒)。停止の合図はこの間隔に関係なくすぐ反映される
+MAX_SLEEP_SECONDS = 60
+# ジョブのロックの期限の下限 (秒)。ジョブの実行時間より長くしてください
+MIN_LOCK_SECONDS = int(os.getenv("SCHEDULER_MIN_LOCK_SECONDS", "3600"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_stop = threading.Event()
+
+
+def parse_schedule(value):
+    """'ジョブ名:秒,ジョブ名:秒' を {ジョブ名: 秒} に変換します。"""
+    schedule = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, seconds = item.partition(":")
+        if name not in JOBS:
+            raise ValueError(f"登録されていないジョブです: {name}")
+        schedule[name] = int(seconds or 3600)
+    return schedule
+
+
+def try_lock(cursor, name, seconds):
+    """ジョブのロックを取れた場合は True を返します (他の worker のロックが期限切れなら取り直す)。"""
+    cursor.execute("""
+        INSERT INTO SchedulerLocks (job_name, locked_until, locked_by)
+        VALUES (%(name)s, now() + make_interval(secs => %(seconds)s), %(worker)s)
+        ON CONFLICT (job_name) DO UPDATE
+        SET locked_until = EXCLUDED.locked_until, locked_by = EXCLUDED.locked_by
+        WHERE SchedulerLocks.locked_until < now()
+        RETURNING job_name
+    """, {'name': name, 'seconds': seconds, 'worker': WORKER_ID})
+    return cursor.fetchone() is not None
+
+
+def unlock(cursor, name):
+    cursor.execute(
+        "UPDATE SchedulerLocks SET locked_until = now() WHERE job_name = %s AND locked_by = %s",
+        (name, WORKER_ID)
+    )
+
+
+def run_locked(name, interval=0):
+    """他の worker が同じジョブを実行していなければ、ジョブを1回実行します。"""
+    conn = get_db_connection()
+    if conn is None:
+        print(f"[{name}] データベースに接続できませんでした。次の予定で再試行します。")
+        return
+    cursor = conn.cursor()
+    try:
+        locked = try_lock(cursor, name, max(interval, MIN_LOCK_SECONDS))
+        conn.commit()
+        if not locked:
+            print(f"[{name}] 他の worker が実行中のため、今回は実行しません。")
+            return
+        started = time.monotonic()
+        try:
+            result = JOBS[name](conn)
+            print(f"[{name}] {result} ({time.monotonic() - started:.1f}秒)")
+        finally:
+            conn.rollback()
+            unlock(cursor, name)
+            conn.commit()
+    except Exception as e:
+        # 1つのジョブの失敗で worker 全体を止めない
+        print(f"[{name}] ジョブの実行に失敗しました: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def run_forever(schedule):
+    """各ジョブを起動直後に1回実行し、以後は指定の間隔で実行します。"""
+    next_run = {name: time.monotonic() for name in schedule}
+    while not _stop.is_set():
+        now = time.monotonic()
+        for name, interval in schedule.items():
+            if _stop.is_set():
+                break
+            if next_run[name] <= now:
+                run_locked(name, interval)
+                next_run[name] = time.monotonic() + interval
+        wait = min(next_run.values()) - time.monotonic()
+        _stop.wait(min(max(wait, 0), MAX_SLEEP_SECONDS))
+
+
+def main():
+    try:
+        schedule = parse_schedule(os.getenv("SCHEDULER_JOBS", DEFAULT_SCHEDULE))
+    except ValueError as e:
+        print(e)
+        return 1
+    if not schedule:
+        print("SCHEDULER_JOBS に実行するジョブがありません。")
+        return 1
+
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+    print("スケジューラーを開始します: " + ", ".join(f"{name} ({seconds}秒ごと)" for name, seconds in schedule.items()))
+    run_forever(schedule)
+    print("スケジューラーを停止しました。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
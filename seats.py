@@ -0,0 +1,211 @@
+# seats.py
+#
+# 募集人数 (Recruitments.capacity) のある募集の、空き枠の管理とキャンセル待ちです。
+#
+# 空き枠のカウンター:
+#   空き枠の数は RecruitmentSeatShards に SEAT_SHARDS 行 (既定 8) に分けて保存します。
+#   応募はランダムに選んだシャードから順に、他の応募がロックしていないシャードの枠を1つ取ります (SKIP LOCKED)。
+#   人気の募集に応募が集中しても、全員が1つの行のロックを順番に待つことはなく、表全体をロックすることもありません。
+#   枠を持つ応募 ('Pending', 'Approved') の数と空き枠の合計は、常に募集人数と一致します。
+#
+# キャンセル待ち:
+#   枠が取れなかった応募は 'Waitlisted' で登録します。キャンセルで枠が空くと、先に応募した順に
+#   'Pending' に繰り上げます (キャンセルした応募の枠をそのまま引き継ぐ)。募集人数を増やした場合も繰り上げます
+#   (promote_waitlist)。同時に実行された応募とキャンセルの間で繰り上げが漏れた場合は、
+#   jobs.py の promote_waitlists が後から繰り上げます。
+#
+# 重複応募は ApplicationKeys への INSERT ... ON CONFLICT DO NOTHING で判定します (例外は使いません)。
+# 計測は bench/bench_flash_crowd.py で行えます。
+
+import os
+import random
+from datetime import datetime
+
+SEAT_SHARDS = int(os.getenv("SEAT_COUNTER_SHARDS", "8"))
+SEAT_HOLDING_STATUSES = ('Pending', 'Approved')
+
+# start 番以降のシャード、0番以降のシャードの順に、空きのあるシャードを1つ選んで枠を1つ減らす
+CLAIM_SEAT_QUERY = """
+    UPDATE RecruitmentSeatShards s
+    SET remaining = s.remaining - 1
+    FROM (
+        SELECT recruitment_id, shard FROM RecruitmentSeatShards
+        WHERE recruitment_id = %(recruitment_id)s AND remaining > 0
+        ORDER BY shard < %(start)s, shard
+        LIMIT 1
+        FOR UPDATE {lock_mode}
+    ) picked
+    WHERE s.recruitment_id = picked.recruitment_id AND s.shard = picked.shard
+    RETURNING s.shard
+"""
+
+
+def claim_seat(cursor, recruitment_id):
+    """空き枠を1つ取り、シャードの番号を返します。満員の場合は None を返します。"""
+    params = {'recruitment_id': recruitment_id, 'start': random.randrange(SEAT_SHARDS)}
+    lock_mode = 'SKIP LOCKED'
+    while True:
+        cursor.execute(CLAIM_SEAT_QUERY.format(lock_mode=lock_mode), params)
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM RecruitmentSeatShards WHERE recruitment_id = %s AND remaining > 0)",
+            (recruitment_id,)
+        )
+        if not cursor.fetchone()[0]:
+            return None
+        # 空きのあるシャードがすべて他の応募にロックされている: 次はロックの解放を待ってから判定する
+        lock_mode = ''
+
+
+def release_seat(cursor, recruitment_id):
+    """枠を1つ空き枠に戻します (募集人数のない募集では何もしません)。"""
+    cursor.execute("""
+        UPDATE RecruitmentSeatShards SET remaining = remaining + 1
+        WHERE (recruitment_id, shard) = (
+            SELECT recruitment_id, shard FROM RecruitmentSeatShards
+            WHERE recruitment_id = %s
+            ORDER BY shard < %s, shard
+            LIMIT 1
+        )
+    """, (recruitment_id, random.randrange(SEAT_SHARDS)))
+
+
+def _next_waitlisted(cursor, recruitment_id):
+    """最も先に応募したキャンセル待ちの応募をロックし、(応募ID, 応募日時) を返します。"""
+    cursor.execute("""
+        SELECT application_id, application_date FROM Applications
+        WHERE recruitment_id = %s AND status = 'Waitlisted'
+        ORDER BY application_date, application_id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """, (recruitment_id,))
+    return cursor.fetchone()
+
+
+def _promote(cursor, waitlisted):
+    cursor.execute(
+        "UPDATE Applications SET status = 'Pending' WHERE application_id = %s AND application_date = %s",
+        waitlisted
+    )
+
+
+def promote_waitlist(cursor, recruitment_id):
+    """空き枠がある間、キャンセル待ちの応募を先に応募した順に 'Pending' に繰り上げ、繰り上げた応募IDを返します。"""
+    promoted = []
+    while True:
+        waitlisted = _next_waitlisted(cursor, recruitment_id)
+        if not waitlisted or claim_seat(cursor, recruitment_id) is None:
+            return promoted
+        _promote(cursor, waitlisted)
+        promoted.append(waitlisted[0])
+
+
+def apply(cursor, recruitment_id, volunteer_id):
+    """
+    募集に応募し、(結果, 応募ID) を返します。結果は次のいずれかです。
+      'applied': 応募しました / 'waitlisted': 満員のためキャンセル待ちに登録しました
+      'duplicate': 既に応募済みです / 'not_found': 募集がありません
+    コミットは呼び出し側で行います。
+    """
+    # 応募の間に募集人数が変わらないようにする。FOR KEY SHARE は応募の外部キーの確認と同じロックで、
+    # 応募同士や募集の編集とは競合せず、set_capacity の FOR UPDATE とだけ競合する
+    cursor.execute("SELECT capacity FROM Recruitments WHERE recruitment_id = %s FOR KEY SHARE", (recruitment_id,))
+    row = cursor.fetchone()
+    if not row:
+        return 'not_found', None
+    capacity = row[0]
+
+    cursor.execute("""
+        INSERT INTO ApplicationKeys (recruitment_id, volunteer_id, application_id, application_date)
+        VALUES (%s, %s, nextval(pg_get_serial_sequence('applications', 'application_id')), %s)
+        ON CONFLICT (recruitment_id, volunteer_id) DO NOTHING
+        RETURNING application_id, application_date
+    """, (recruitment_id, volunteer_id, datetime.now()))
+    key = cursor.fetchone()
+    if not key:
+        return 'duplicate', None
+    application_id, application_date = key
+
+    status = 'Pending'
+    if capacity is not None and claim_seat(cursor, recruitment_id) is None:
+        status = 'Waitlisted'
+    cursor.execute("""
+        INSERT INTO Applications (application_id, recruitment_id, volunteer_id, application_date, status)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (application_id, recruitment_id, volunteer_id, application_date, status))
+    return ('waitlisted' if status == 'Waitlisted' else 'applied'), application_id
+
+
+def cancel(cursor, application_id, volunteer_id):
+    """
+    ボランティア本人の応募を取り消します。枠を持っていた場合は、その枠でキャンセル待ちの先頭を繰り上げます
+    (キャンセル待ちがいなければ空き枠に戻します)。
+    取り消した応募の募集IDを返します (応募がない場合は None)。コミットは呼び出し側で行います。
+    """
+    cursor.execute("""
+        DELETE FROM Applications WHERE application_id = %s AND volunteer_id = %s
+        RETURNING recruitment_id, status
+    """, (application_id, volunteer_id))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    recruitment_id, status = row
+    cursor.execute(
+        "DELETE FROM ApplicationKeys WHERE recruitment_id = %s AND volunteer_id = %s",
+        (recruitment_id, volunteer_id)
+    )
+    if status in SEAT_HOLDING_STATUSES:
+        # 枠はキャンセル待ちの先頭に直接引き継ぐ。キャンセル待ちがいない場合はランダムに選んだシャードを
+        # 1行だけ更新する。同じシャードを選んだキャンセル同士や、そのシャードの枠を取っている応募とは
+        # そのトランザクションの終了を待ち合うが、シャードが分かれているため待つのは一部だけになる
+        waitlisted = _next_waitlisted(cursor, recruitment_id)
+        if waitlisted:
+            _promote(cursor, waitlisted)
+        else:
+            release_seat(cursor, recruitment_id)
+    return recruitment_id
+
+
+def set_capacity(cursor, recruitment_id, capacity):
+    """
+    募集人数を変更し、空き枠を (募集人数 - 枠を持つ応募の数) に合わせます。None で人数制限をなくします。
+    増やした場合はキャンセル待ちを繰り上げます。コミットは呼び出し側で行います。
+    """
+    # 実行中の応募 (FOR KEY SHARE) の終了を待ち、以後の応募はこのトランザクションの終了を待たせる
+    cursor.execute("SELECT capacity FROM Recruitments WHERE recruitment_id = %s FOR UPDATE", (recruitment_id,))
+    row = cursor.fetchone()
+    if not row or row[0] == capacity:
+        return
+    cursor.execute("UPDATE Recruitments SET capacity = %s WHERE recruitment_id = %s", (capacity, recruitment_id))
+
+    if capacity is None:
+        cursor.execute("DELETE FROM RecruitmentSeatShards WHERE recruitment_id = %s", (recruitment_id,))
+        cursor.execute(
+            "UPDATE Applications SET status = 'Pending' WHERE recruitment_id = %s AND status = 'Waitlisted'",
+            (recruitment_id,)
+        )
+        return
+
+    # 枠を空き枠に戻しているキャンセルが終わるのを待ってから数える (応募は募集の行のロックで既に待たせている)
+    cursor.execute(
+        "SELECT shard FROM RecruitmentSeatShards WHERE recruitment_id = %s ORDER BY shard FOR UPDATE",
+        (recruitment_id,)
+    )
+    cursor.execute(
+        "SELECT COUNT(*) FROM Applications WHERE recruitment_id = %s AND status = ANY(%s::application_status[])",
+        (recruitment_id, list(SEAT_HOLDING_STATUSES))
+    )
+    free = max(capacity - cursor.fetchone()[0], 0)
+    cursor.execute("""
+        INSERT INTO RecruitmentSeatShards (recruitment_id, shard, remaining)
+        SELECT %(recruitment_id)s, s, %(free)s / %(shards)s + (s < %(free)s %% %(shards)s)::int
+        FROM generate_series(0, %(shards)s - 1) AS s
+        ON CONFLICT (recruitment_id, shard) DO UPDATE SET remaining = EXCLUDED.remaining
+    """, {'recruitment_id': recruitment_id, 'free': free, 'shards': SEAT_SHARDS})
+    cursor.execute(
+        "DELETE FROM RecruitmentSeatShards WHERE recruitment_id = %s AND shard >= %s",
+        (recruitment_id, SEAT_SHARDS)
+    )
+    promote_waitlist(cursor, recruitment_id)
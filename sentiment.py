@@ -0,0 +1,113 @@
+# sentiment.py
+#
+# 募集テキストの感情分析を行うアナライザーをまとめたモジュールです。
+# 分析ジョブ (jobs.py) から使用され、環境変数 SENTIMENT_ANALYZER で実装を切り替えます。
+#   local  : オフラインで動作する簡易辞書ベースの分析 (既定)
+#   google : Google Cloud Natural Language API
+#
+# どのアナライザーも analyze_batch(texts) を実装し、テキストと同じ順番で
+# {'sentiment_score': float, 'sentiment_magnitude': float} または None (失敗時) のリストを返します。
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SentimentAnalyzer:
+    """感情分析アナライザーの基底クラス"""
+
+    name = "base"
+
+    def analyze_batch(self, texts):
+        """複数のテキストをまとめて分析します。"""
+        raise NotImplementedError
+
+
+class LocalSentimentAnalyzer(SentimentAnalyzer):
+    """
+    外部APIを使わずに動作する辞書ベースの感情分析。
+    ポジティブ語とネガティブ語の出現数からスコア (-1.0〜1.0) と強度を算出します。
+    """
+
+    name = "local"
+
+    POSITIVE_WORDS = (
+        "楽しい", "楽しく", "楽しみ", "嬉しい", "うれしい", "笑顔", "感謝", "ありがとう",
+        "安心", "歓迎", "大歓迎", "気軽", "初心者", "未経験", "一緒に", "仲間", "交流",
+        "喜び", "喜ば", "素敵", "元気", "貢献", "やりがい", "充実", "温かい", "優しい",
+        "楽しめ", "達成感", "思い出", "親切", "明るい", "きれい", "美しい", "自由",
+    )
+    NEGATIVE_WORDS = (
+        "大変", "危険", "厳しい", "きつい", "重い", "困難", "不安", "注意", "禁止",
+        "必須", "体力", "重労働", "長時間", "早朝", "深夜", "暑い", "寒い", "汚れ",
+        "責任", "ノルマ", "罰", "不可", "できません", "困って", "被害", "災害",
+    )
+
+    def analyze_text(self, text):
+        """1件のテキストを分析します。"""
+        text = text or ""
+        positive = sum(text.count(word) for word in self.POSITIVE_WORDS)
+        negative = sum(text.count(word) for word in self.NEGATIVE_WORDS)
+        total = positive + negative
+        if total == 0:
+            return {'sentiment_score': 0.0, 'sentiment_magnitude': 0.0}
+        score = (positive - negative) / total
+        # 強度は感情を含む表現の量 (Natural Language APIのmagnitudeに近い意味合い)
+        magnitude = total * 0.5
+        return {'sentiment_score': round(score, 3), 'sentiment_magnitude': round(magnitude, 3)}
+
+    def analyze_batch(self, texts):
+        return [self.analyze_text(text) for text in texts]
+
+
+class GoogleSentimentAnalyzer(SentimentAnalyzer):
+    """
+    Google Cloud Natural Language APIを使用した感情分析。
+    APIにバッチ機能がないため、1つのクライアントを共有してバッチ内を並列に呼び出します。
+    """
+
+    name = "google"
+
+    def __init__(self, max_workers=None):
+        # ライブラリの読み込みが重いため、このアナライザーを使う時だけインポートする
+        from google.cloud import language_v1
+
+        # ai_key/ は.gitignoreで除外されているため、本番では環境変数から認証情報を読み込む
+        if "GOOGLE_APPLICATION_CREDENTIALS_JSON" in os.environ:
+            credentials_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp_google_credentials.json")
+            with open(credentials_path, "w") as f:
+                f.write(os.environ["GOOGLE_APPLICATION_CREDENTIALS_JSON"])
+            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+
+        self._language_v1 = language_v1
+        self._client = language_v1.LanguageServiceClient()
+        self._max_workers = max_workers or int(os.getenv("SENTIMENT_MAX_WORKERS", "4"))
+
+    def analyze_text(self, text):
+        """1件のテキストを分析します。失敗した場合は None を返します。"""
+        try:
+            document = self._language_v1.Document(
+                content=text, type_=self._language_v1.Document.Type.PLAIN_TEXT, language='ja'
+            )
+            sentiment = self._client.analyze_sentiment(request={'document': document}).document_sentiment
+            return {'sentiment_score': sentiment.score, 'sentiment_magnitude': sentiment.magnitude}
+        except Exception as e:
+            print(f"Natural Language API Error: {e}")
+            return None
+
+    def analyze_batch(self, texts):
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            return list(executor.map(self.analyze_text, texts))
+
+
+ANALYZERS = {
+    LocalSentimentAnalyzer.name: LocalSentimentAnalyzer,
+    GoogleSentimentAnalyzer.name: GoogleSentimentAnalyzer,
+}
+
+
+def get_analyzer(name=None):
+    """名前 (省略時は環境変数 SENTIMENT_ANALYZER) に対応するアナライザーを生成します。"""
+    name = (name or os.getenv("SENTIMENT_ANALYZER", "local")).lower()
+    if name not in ANALYZERS:
+        raise ValueError(f"未知のアナライザーです: {name} (使用可能: {', '.join(ANALYZERS)})")
+    return ANALYZERS[name]()
@@ -2,32 +2,39 @@
 # pip install Flask mysql-connector-python python-dotenv google-cloud-language pandas Flask-Bcrypt Flask-Mail fpdf
 
 import os
-from flask import Flask, jsonify, render_template, request, session, redirect, url_for, flash, send_from_directory, send_file
+from flask import Flask, jsonify, render_template, request, session, redirect, url_for, flash, send_from_directory, send_file, g, has_request_context
 from flask_bcrypt import Bcrypt
 from functools import wraps
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
+import psycopg2.pool
 from dotenv import load_dotenv
-import pandas as pd
+# 注意: pandas / fpdf / flask_mail / smtplib は読み込みに時間がかかるため、
+# ワーカー起動を速くする目的で、実際に使用する関数の中で遅延インポートしています。
 # from google.cloud import language_v1
-import smtplib
-import ssl
 from email.message import EmailMessage
-from flask_mail import Mail, Message
 import secrets
 from datetime import datetime
-from fpdf import FPDF
 import io
 import csv
+import re
+import math
 import threading
+import time
+import random
+from collections import OrderedDict, defaultdict
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
-app = Flask(__name__, static_folder='.', template_folder='.')
+# 静的ファイルは static_assets.py の /assets/ から配信する
+# (static_folder='.' だとリポジトリ直下のすべてのファイルが配信されてしまうため無効にしている)
+app = Flask(__name__, static_folder=None, template_folder='.')
 app.config['SERVER_NAME'] = 'teamh-noilen.onrender.com'
 app.config['PREFERRED_URL_SCHEME'] = 'https'
-app.secret_key = os.urandom(24) # セッション管理のための秘密鍵
+# セッション管理のための秘密鍵。ワーカー間で共通にするため環境変数 SECRET_KEY で指定してください。
+app.secret_key = os.getenv("SECRET_KEY") or os.urandom(24)
 bcrypt = Bcrypt(app) # Bcryptの初期化
 
 def format_datetime(value, format_string='%Y-%m-%d'):
@@ -40,31 +47,574 @@ def format_datetime(value, format_string='%Y-%m-%d'):
 # フィルタをJinja環境に 'strftime' という名前で登録
 app.jinja_env.filters['strftime'] = format_datetime
 
+# 静的ファイルの配信 (/assets/) とテンプレート関数 asset_url を登録
+import static_assets
+static_assets.init_app(app)
+
+# テンプレートのバイトコードキャッシュとフラグメントキャッシュ (template_cache.py を参照)
+import template_cache
+from template_cache import fragment_cache
+template_cache.init_app(app)
+
+# アップロード画像の保存と配信 (uploads.py を参照)
+import uploads
+app.jinja_env.globals['media_url'] = uploads.media_url
+
+# 頻繁に実行するクエリを接続ごとに PREPARE して実行する (prepared_queries.py を参照)
+import prepared_queries
+
+# 郵便番号による近くの募集の検索 (geo.py を参照)
+import geo
+
+# 募集人数の空き枠とキャンセル待ち (seats.py を参照)
+import seats
+
+# APIのJSONレスポンスを orjson で作成する (fast_json.py を参照)
+import fast_json
+from fast_json import rows_response
+fast_json.init_app(app)
+
 # Flask-Mail設定
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
 app.config['MAIL_PORT'] = 587
 app.config['MAIL_USE_TLS'] = True
 app.config['MAIL_USERNAME'] = os.getenv("GMAIL_USER")
 app.config['MAIL_PASSWORD'] = os.getenv("GMAIL_APP_PASSWORD")
-mail = Mail(app)
+_mail = None
+
+def get_mail():
+    """Flask-Mailのインスタンスを初回利用時に生成して返します。"""
+    global _mail
+    if _mail is None:
+        from flask_mail import Mail
+        _mail = Mail(app)
+    return _mail
 
 # アップロードフォルダの設定
 UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# データベース接続設定
-def get_db_connection():
-    """データベース接続を取得します。"""
+# ------------------------------
+# データベース接続プール
+# ------------------------------
+
+# ワーカー (プロセス) ごとに最大 DB_POOL_SIZE 本の接続を使い回します。
+# 各ビューは従来どおり get_db_connection() / conn.close() を使い、close() で接続がプールへ返却されます。
+# DB_POOL_SIZE=0 にするとプールを使わず、毎回新しく接続します。
+#
+# 環境変数 DATABASE_REPLICA_URL (読み取り専用レプリカ) を設定すると、@read_only を付けたビューは
+# レプリカから読み込みます (プールは接続先ごとに作成)。レプリカの遅延で自分の書き込みが見えなくなるのを防ぐため、
+# 更新リクエスト (POSTなど) が成功したセッションは REPLICA_STICKY_SECONDS 秒間プライマリから読み込みます。
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+# ログイン中のユーザーを表すセッションのキー (これがないセッションには上記の記録を残さない)
+SESSION_USER_KEYS = ('volunteer_id', 'org_user', 'admin_user')
+# 接続の失敗が続いた場合にブレーカーを開く回数と、開いている時間 (秒。開くたびに2倍、最大 DB_BREAKER_MAX_SECONDS)
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", "3"))
+DB_BREAKER_BASE_SECONDS = float(os.getenv("DB_BREAKER_BASE_SECONDS", "1"))
+DB_BREAKER_MAX_SECONDS = float(os.getenv("DB_BREAKER_MAX_SECONDS", "60"))
+# 1つのSQL文の実行時間の上限 (ミリ秒。0 は無制限)。ビューごとに @statement_timeout で変更できます。
+# リクエスト全体が REQUEST_DEADLINE_SECONDS 秒を超えた場合は、実行中のクエリを取り消します
+# (gunicorn の timeout でワーカーが強制終了される前に、接続をプールへ戻せるようにするため)。
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "25"))
+
+class PooledConnection(psycopg2.extensions.connection):
+    """close() で接続を閉じずに、プールへ返却する接続"""
+    _pool = None
+    _lease = 0
+    _in_use = False
+    _statement_timeout = None
+    _deadline_cancelled = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # この接続で PREPARE 済みのクエリ名 (prepared_queries.py を参照)
+        self._prepared_statements = set()
+
+    def close(self):
+        if self._pool is None:
+            super().close()
+        elif self._in_use:
+            self._pool.putconn(self, self._lease)
+
+    def cursor(self, *args, **kwargs):
+        # タイムアウトで取り消されたクエリを記録するため、カーソルのクラスを差し替える
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = timeout_tracking_cursor(base)
+        try:
+            return super().cursor(*args, **kwargs)
+        except psycopg2.InterfaceError:
+            mark_db_unavailable()
+            raise
+
+class ConnectionPool:
+    """スレッドセーフな接続プール。空きがない場合は timeout 秒まで返却を待ちます。"""
+
+    def __init__(self, dsn, size, timeout):
+        self._dsn = dsn
+        self._timeout = timeout
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._next_lease = 0
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise psycopg2.pool.PoolError(f"{self._timeout}秒以内に空き接続を取得できませんでした。")
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                self._next_lease += 1
+                lease = self._next_lease
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(self._dsn, connection_factory=PooledConnection)
+                conn._pool = self
+            conn._lease = lease
+            conn._in_use = True
+            conn._deadline_cancelled = False
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, lease):
+        """接続を返却します。lease が貸し出し時と異なる場合 (返却済み) は何もしません。"""
+        with self._lock:
+            if not conn._in_use or conn._lease != lease:
+                return
+            conn._in_use = False
+        try:
+            if not conn.closed:
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    # 切断された接続は再利用しない
+                    self._discard(conn)
+                else:
+                    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    with self._lock:
+                        self._idle.append(conn)
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        conn._pool = None
+        conn.close()
+
+class CircuitBreaker:
+    """
+    接続の失敗が threshold 回続いたら、しばらくは接続を試みずに失敗させるブレーカー。
+    障害中に全リクエストが接続を試みて、データベースへの接続が殺到するのを防ぎます。
+    開いている時間は開くたびに2倍 (max_delay まで) になり、経過後は1つのリクエストだけが接続を試します。
+    """
+
+    def __init__(self, threshold, base_delay, max_delay):
+        self._threshold = threshold
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._failures = 0
+        self._opened = 0
+        self._open_until = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._failures >= self._threshold
+
+    def allow(self):
+        """接続を試してよいかどうかを返します。"""
+        with self._lock:
+            if self._failures < self._threshold:
+                return True
+            if self._trial or time.monotonic() < self._open_until:
+                return False
+            # 待ち時間が過ぎたので、このリクエストだけで接続を試す
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._failures >= self._threshold:
+                print("データベースへの接続が回復しました。")
+            self._failures = 0
+            self._opened = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._failures >= self._threshold:
+                delay = min(self._max_delay, self._base_delay * (2 ** self._opened))
+                self._opened += 1
+                # ワーカー間で再接続の時刻がそろわないよう、少しずらす
+                delay *= random.uniform(0.8, 1.2)
+                self._open_until = time.monotonic() + delay
+                print(f"データベースへの接続に{self._failures}回続けて失敗したため、{delay:.1f}秒間接続を停止します。")
+
+    def release(self):
+        """接続の成否が分からなかった場合 (プールの空き待ちのタイムアウトなど) に、試行中の状態を解除します。"""
+        with self._lock:
+            self._trial = False
+
+_db_pools = {}
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool(database_url):
+    """このプロセス用の、接続先ごとの接続プールを返します (fork後の子プロセスでは作り直します)。"""
+    global _db_pools, _db_pool_pid
+    pool = _db_pools.get(database_url) if _db_pool_pid == os.getpid() else None
+    if pool is None:
+        with _db_pool_lock:
+            if _db_pool_pid != os.getpid():
+                _db_pools = {}
+                _db_pool_pid = os.getpid()
+            pool = _db_pools.get(database_url)
+            if pool is None:
+                pool = _db_pools[database_url] = ConnectionPool(database_url, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+    return pool
+
+def read_only(f):
+    """データベースを読み込むだけのビューに付けるデコレータ。レプリカがあればそちらから読み込みます。"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+def requires_primary(session):
+    """直前に書き込みを行ったセッションかどうか (プライマリから読み込む必要があるか) を返します。"""
+    return session.get('db_primary_until', 0) > time.time()
+
+def use_replica():
+    """現在のリクエストでレプリカを使うかどうかを返します。"""
+    # g を先に確認する (セッションの読み込み中に呼ばれた場合は session に触れない)
+    return (
+        bool(os.getenv("DATABASE_REPLICA_URL"))
+        and has_request_context()
+        and g.get('db_read_only', False)
+        and not requires_primary(session)
+    )
+
+_db_breakers = {}
+
+def get_db_breaker(database_url):
+    """接続先ごとのブレーカーを返します。"""
+    breaker = _db_breakers.get(database_url)
+    if breaker is None:
+        with _db_pool_lock:
+            breaker = _db_breakers.setdefault(
+                database_url, CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_BASE_SECONDS, DB_BREAKER_MAX_SECONDS)
+            )
+    return breaker
+
+def connect_to(database_url):
+    """指定した接続先の接続を取得します (プールを使う場合はプールから)。"""
+    breaker = get_db_breaker(database_url)
+    if not breaker.allow():
+        # ブレーカーが開いている間は接続を試みずに失敗させる
+        mark_db_unavailable()
+        return None
     try:
-        database_url = os.getenv("DATABASE_URL")
-        if not database_url:
-            print("環境変数 DATABASE_URL が設定されていません。")
-            return None
-        conn = psycopg2.connect(database_url)
-        return conn
+        if DB_POOL_SIZE <= 0:
+            conn = psycopg2.connect(database_url, connection_factory=PooledConnection)
+        else:
+            conn = get_db_pool(database_url).getconn()
+        if has_request_context():
+            # 例外などで close() されなかった接続を、リクエスト終了時に確実に返却するため記録する
+            # (期限を過ぎたリクエストのクエリを取り消す時にも使う)
+            g.setdefault('db_leases', []).append((conn, conn._lease))
+        try:
+            apply_statement_timeout(conn)
+        except BaseException:
+            # リクエスト外 (ジョブなど) では返却する処理がないため、ここで返却する
+            # (切断された接続は返却時にプールから外され、プールを使わない接続は閉じる)
+            conn.close()
+            raise
+    except psycopg2.pool.PoolError as err:
+        # 空き接続の待ち時間切れはデータベースの障害ではないため、失敗として数えない
+        breaker.release()
+        print(f"データベース接続エラー: {err}")
+        return None
     except psycopg2.Error as err:
+        breaker.record_failure()
         print(f"データベース接続エラー: {err}")
+        mark_db_unavailable()
+        return None
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record_success()
+    return conn
+
+# ------------------------------
+# ステートメントタイムアウト
+# ------------------------------
+
+def statement_timeout(milliseconds):
+    """ビューのSQL文の実行時間の上限 (ミリ秒。0 は無制限) を DB_STATEMENT_TIMEOUT_MS から変更するデコレータ"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.db_statement_timeout = milliseconds
+            return f(*args, **kwargs)
+        # /admin/api/statement_timeouts で上限を表示するため記録する (@wraps で外側の関数にも引き継がれる)
+        decorated_function.statement_timeout_ms = milliseconds
+        return decorated_function
+    return decorator
+
+def apply_statement_timeout(conn):
+    """貸し出す接続のタイムアウトを、現在のビューの設定に合わせます (変わる場合だけ SET を実行)。"""
+    # リクエスト外 (バックグラウンドのジョブなど) では上限を設けない
+    wanted = g.get('db_statement_timeout', DB_STATEMENT_TIMEOUT_MS) if has_request_context() else 0
+    if conn._statement_timeout != wanted:
+        with conn.cursor() as cursor:
+            cursor.execute("SET statement_timeout = %s", (wanted,))
+        # ロールバックで設定が戻らないよう確定させる
+        conn.commit()
+        conn._statement_timeout = wanted
+
+# タイムアウト・取り消しが発生した回数 (ワーカーごと)。/admin/api/statement_timeouts で確認できます。
+_timeout_stats = defaultdict(lambda: {'statement_timeout': 0, 'deadline': 0, 'last_at': None})
+_timeout_stats_lock = threading.Lock()
+_timeout_cursor_classes = {}
+
+def record_query_cancel(conn, err):
+    """取り消されたクエリを、ビュー (エンドポイント) ごとに記録します。"""
+    endpoint = (request.endpoint or request.path) if has_request_context() else '(リクエスト外)'
+    kind = 'deadline' if conn._deadline_cancelled else 'statement_timeout'
+    with _timeout_stats_lock:
+        stats = _timeout_stats[endpoint]
+        stats[kind] += 1
+        stats['last_at'] = datetime.now().isoformat(timespec='seconds')
+    print(f"クエリを取り消しました ({endpoint}, {kind}): {str(err).strip()}")
+
+def mark_db_unavailable():
+    """現在のリクエストで、データベースが使えなかったことを記録します (@serve_stale が古い応答を返す条件)。"""
+    if has_request_context():
+        g.db_unavailable = True
+
+def timeout_tracking_cursor(base):
+    """base のカーソルに、タイムアウトによる取り消しと、切断された接続を記録する処理を加えたクラスを返します。"""
+    cls = _timeout_cursor_classes.get(base)
+    if cls is None:
+        class TimeoutTrackingCursor(base):
+            def execute(self, query, vars=None):
+                try:
+                    return super().execute(query, vars)
+                except psycopg2.errors.QueryCanceled as err:
+                    record_query_cancel(self.connection, err)
+                    raise
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    # プールで待機中にサーバーから切断された接続など (返却時にプールから外される)
+                    mark_db_unavailable()
+                    raise
+        cls = _timeout_cursor_classes.setdefault(base, TimeoutTrackingCursor)
+    return cls
+
+# 実行中のリクエスト (期限, 接続の一覧) と、期限切れのクエリを取り消すスレッド
+_inflight_requests = {}
+_inflight_lock = threading.Lock()
+_deadline_watchdog_pid = None
+
+def watch_request_deadlines():
+    """期限を過ぎたリクエストが使っている接続の、実行中のクエリを取り消します。"""
+    while True:
+        time.sleep(0.5)
+        now = time.monotonic()
+        with _inflight_lock:
+            expired = [leases for deadline, leases in _inflight_requests.values() if deadline < now]
+        for leases in expired:
+            for conn, lease in list(leases):
+                # 既にプールへ返却され、他のリクエストが使っている接続は取り消さない
+                if conn.closed or conn._lease != lease or (conn._pool is not None and not conn._in_use):
+                    continue
+                if not conn._deadline_cancelled:
+                    conn._deadline_cancelled = True
+                    try:
+                        conn.cancel()
+                    except psycopg2.Error as err:
+                        print(f"クエリの取り消しに失敗しました: {err}")
+
+@app.before_request
+def start_request_deadline():
+    """リクエストの期限を記録し、期限切れを監視するスレッドを (プロセスごとに1つ) 起動します。"""
+    global _deadline_watchdog_pid
+    if REQUEST_DEADLINE_SECONDS <= 0:
+        return
+    if _deadline_watchdog_pid != os.getpid():
+        with _inflight_lock:
+            if _deadline_watchdog_pid != os.getpid():
+                threading.Thread(target=watch_request_deadlines, name="db-deadline-watchdog", daemon=True).start()
+                _deadline_watchdog_pid = os.getpid()
+    g.request_token = object()
+    with _inflight_lock:
+        _inflight_requests[g.request_token] = (time.monotonic() + REQUEST_DEADLINE_SECONDS, g.setdefault('db_leases', []))
+
+# データベース接続設定
+def get_db_connection():
+    """データベース接続を取得します。@read_only のビューでは、可能ならレプリカの接続を返します。"""
+    if os.getenv("DATABASE_URL") and use_replica():
+        conn = connect_to(os.getenv("DATABASE_REPLICA_URL"))
+        if conn is not None:
+            return conn
+        # レプリカに接続できない場合はプライマリから読み込む
+    return get_primary_db_connection()
+
+def get_primary_db_connection():
+    """
+    プライマリ (DATABASE_URL) の接続を取得します。@read_only のビューの中でも書き込む処理
+    (セッションの保存など) に使います。
+    """
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("環境変数 DATABASE_URL が設定されていません。")
         return None
+    return connect_to(database_url)
+
+# ------------------------------
+# データベース障害時の応答 (serve-stale)
+# ------------------------------
+
+# @serve_stale を付けた公開の読み込み用ビューは、正常な応答をワーカーごとに最大 STALE_CACHE_SIZE 件保存します。
+# データベースに接続できない間 (ブレーカーが開いている間など) は、エラーの代わりに最後に保存した応答を返します。
+# 古い応答には Age (保存してからの秒数) と Warning: 110 ヘッダーを付けます。
+# ログイン中のユーザーによって内容が変わるリクエストでは、ビューで g.private_response = True にすると、
+# 保存も古い応答の返却も行いません (他のユーザーの応答を返さないため)。
+STALE_CACHE_SIZE = int(os.getenv("STALE_CACHE_SIZE", "512"))
+_stale_responses = OrderedDict()
+_stale_lock = threading.Lock()
+
+def serve_stale(f):
+    """データベースの障害中は、最後の正常な応答を返すようにするデコレータ (セッションに依存しないビュー用)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.full_path
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except psycopg2.Error:
+            # ビューが処理しなかったデータベースのエラーも、障害中なら古い応答で置き換える
+            if g.get('private_response') or not (g.get('db_unavailable') and key in _stale_responses):
+                raise
+            response = app.response_class(status=503)
+        if g.get('private_response'):
+            return response
+        if response.status_code == 200 and not response.direct_passthrough:
+            with _stale_lock:
+                _stale_responses[key] = (time.time(), response.get_data(), response.mimetype)
+                _stale_responses.move_to_end(key)
+                while len(_stale_responses) > STALE_CACHE_SIZE:
+                    _stale_responses.popitem(last=False)
+        elif response.status_code >= 500 and g.get('db_unavailable'):
+            entry = _stale_responses.get(key)
+            if entry is not None:
+                saved_at, body, mimetype = entry
+                response = app.response_class(body, mimetype=mimetype)
+                response.headers['Age'] = str(int(time.time() - saved_at))
+                response.headers['Warning'] = '110 - "Response is Stale"'
+                response.headers['Cache-Control'] = 'no-store'
+        return response
+    return decorated_function
+
+@app.after_request
+def remember_recent_write(response):
+    """
+    更新リクエストが成功したセッションは、しばらくプライマリから読み込むようにします。
+    未ログインのリクエストや、ログアウトなどでセッションを空にしたリクエストでは記録しません
+    (セッションを作成・復活させないため)。
+    """
+    if (os.getenv("DATABASE_REPLICA_URL") and request.method not in ('GET', 'HEAD', 'OPTIONS')
+            and response.status_code < 400 and any(key in session for key in SESSION_USER_KEYS)):
+        session['db_primary_until'] = time.time() + REPLICA_STICKY_SECONDS
+    return response
+
+@app.teardown_request
+def release_db_connections(exc):
+    """リクエスト中に返却されなかった接続をプールへ返却します (プールを使わない接続は閉じます)。"""
+    token = g.pop('request_token', None)
+    if token is not None:
+        with _inflight_lock:
+            _inflight_requests.pop(token, None)
+    for conn, lease in g.pop('db_leases', []):
+        if conn._pool is not None:
+            conn._pool.putconn(conn, lease)
+        elif not conn.closed:
+            conn.close()
+
+# ------------------------------
+# サーバー側セッション
+# ------------------------------
+
+# CookieにはセッションIDだけを入れ、中身は SESSION_BACKEND の保存先に置く (session_store.py を参照)
+# セッションは @read_only のビューの後にも保存されるため、保存先の接続は常にプライマリを使う
+from session_store import ServerSideSessionInterface, create_session_store
+app.session_interface = ServerSideSessionInterface(
+    create_session_store(get_primary_db_connection),
+    lifetime_seconds=int(os.getenv("SESSION_LIFETIME_SECONDS", str(7 * 24 * 3600))),
+)
+
+# ------------------------------
+# 参照データのキャッシュ
+# ------------------------------
+
+# カテゴリ一覧のように、めったに変更されず多くの画面で使われるデータを
+# ワーカープロセス内にキャッシュします。変更時は invalidate_reference_data() を呼び出してください。
+# (他のワーカーのキャッシュは REFERENCE_CACHE_SECONDS 秒で期限切れになります)
+REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_SECONDS", "300"))
+REFERENCE_QUERIES = {
+    'categories': "SELECT category_id, category_name FROM RecruitmentCategories ORDER BY category_id",
+}
+_reference_cache = {}
+_reference_cache_lock = threading.Lock()
+
+def get_reference_data(cursor, name):
+    """参照データをキャッシュから返します。キャッシュがない場合は cursor でクエリを実行して読み込みます。"""
+    entry = _reference_cache.get(name)
+    if entry is not None and time.time() - entry[0] < REFERENCE_CACHE_TTL:
+        return entry[1]
+
+    cursor.execute(REFERENCE_QUERIES[name])
+    data = [dict(zip([col[0] for col in cursor.description], row)) for row in cursor.fetchall()]
+    with _reference_cache_lock:
+        _reference_cache[name] = (time.time(), data)
+    return data
+
+def invalidate_reference_data(name):
+    """参照データのキャッシュと、そのデータを使うテンプレートのフラグメントを破棄します。"""
+    with _reference_cache_lock:
+        _reference_cache.pop(name, None)
+    template_cache.invalidate(name)
+
+# フラグメントキャッシュ (template_cache.py) のデータのバージョンは DataVersions テーブルに置き、
+# どのワーカーでも変更直後から新しいHTMLを返すようにします。
+# データを変更するトランザクションの中で bump_data_version() を呼び出してください。
+def bump_data_version(cursor, name):
+    """データのバージョンを1つ進めます (呼び出し元のトランザクションで確定します)。"""
+    cursor.execute("""
+        INSERT INTO DataVersions (name, version) VALUES (%s, 1)
+        ON CONFLICT (name) DO UPDATE SET version = DataVersions.version + 1
+    """, (name,))
+
+def load_data_versions(names):
+    """データのバージョンを {データ名: バージョン} で返します。"""
+    conn = get_db_connection()
+    if conn is None:
+        raise psycopg2.OperationalError("データベースに接続できませんでした。")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT name, version FROM DataVersions WHERE name = ANY(%s)", (list(names),))
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+        conn.close()
+
+template_cache.set_version_loader(load_data_versions)
 
 def login_required(f):
     """市町村職員のログイン状態をチェックするデコレータ"""
@@ -86,6 +636,8 @@ def index():
     return render_template("hp/index.html")
 
 @app.route("/opportunity/<int:recruitment_id>")
+@serve_stale
+@read_only
 def opportunity_detail(recruitment_id):
     """特定の募集案件の詳細をレンダリングします。"""
     conn = get_db_connection()
@@ -94,7 +646,7 @@ def opportunity_detail(recruitment_id):
 
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     try:
-        cursor.execute("SELECT recruitment_id, title, description, start_date, end_date, contact_phone_number FROM Recruitments WHERE recruitment_id = %s", (recruitment_id,))
+        cursor.execute("SELECT recruitment_id, title, description, start_date, end_date, contact_phone_number, image_hash FROM Recruitments WHERE recruitment_id = %s", (recruitment_id,))
         opportunity = cursor.fetchone()
     except psycopg2.Error as err:
         print(f"クエリエラー: {err}")
@@ -139,7 +691,7 @@ def user_login_process():
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         
-        cursor.execute("SELECT volunteer_id, full_name, email, phone_number, password_hash FROM Volunteers WHERE email = %s", (email,))
+        prepared_queries.execute(cursor, 'volunteer_login', (email,))
         user = cursor.fetchone()
         
         cursor.close()
@@ -155,6 +707,7 @@ def user_login_process():
                 password_match = (user['password_hash'] == password)
 
             if password_match:
+                session.regenerate()
                 session['logged_in'] = True
                 session['volunteer_id'] = user['volunteer_id']
                 session['user_name'] = user['full_name']
@@ -331,6 +884,7 @@ def admin_login():
         conn.close()
 
         if user and bcrypt.check_password_hash(user['password_hash'], password): 
+            session.regenerate()
             session['admin_user'] = user['username']
             return redirect(url_for('admin_dashboard'))
         else:
@@ -342,6 +896,7 @@ def admin_login():
 @app.route("/admin/logout")
 def admin_logout():
     """管理者ログアウト処理"""
+    session.regenerate()
     session.pop('admin_user', None)
     return redirect(url_for('admin_login'))
 
@@ -352,69 +907,160 @@ def admin_dashboard():
         return redirect(url_for('admin_login'))
     
     conn = get_db_connection()
-    locations = []
+    daily_stats = []
     if conn:
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         try:
-            cursor.execute("""
-                SELECT
-                    p.name AS prefecture_name,
-                    o.name AS organization_name
-                FROM
-                    Prefectures p
-                JOIN
-                    Organizations o ON p.prefecture_id = o.prefecture_id
-                ORDER BY
-                    p.name, o.name;
-            """)
-            locations = cursor.fetchall()
+            # 日次集計テーブルから直近の推移を取得 (日数に比例した件数しか読まない)
+            daily_stats = fetch_daily_stats(cursor, days=14)
         except psycopg2.Error as err:
-            flash(f"地域情報の取得中にエラーが発生しました: {err}", "error")
+            flash(f"統計情報の取得中にエラーが発生しました: {err}", "error")
         finally:
             cursor.close()
             conn.close()
 
-    return render_template("admin/platform-admin.html") # locations removed from here
+    return render_template("admin/platform-admin.html", daily_stats=daily_stats)
 
 @app.route("/admin/registered_regions")
+@statement_timeout(2000)
 def admin_registered_regions():
     """登録済み地域一覧ページ"""
     if 'admin_user' not in session:
         return redirect(url_for('admin_login'))
     
     prefecture_filter = request.args.get('prefecture_name', '').strip()
-    
+    try:
+        regions_table = render_registered_regions_table(prefecture_filter)
+    except psycopg2.Error as err:
+        flash(f"地域情報の取得中にエラーが発生しました: {err}", "error")
+        regions_table = render_template("admin/_registered_regions_table.html", locations=[])
+
+    return render_template("admin/registered_regions.html", regions_table=regions_table)
+
+@fragment_cache('regions')
+def render_registered_regions_table(prefecture_filter):
+    """登録済み地域の一覧表を描画します。地域が追加されるまで、同じ絞り込み条件の結果を再利用します。"""
     conn = get_db_connection()
-    locations = []
-    if conn:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        try:
-            query = """
-                SELECT
-                    p.name AS prefecture_name,
-                    o.name AS organization_name
-                FROM
-                    Prefectures p
-                JOIN
-                    Organizations o ON p.prefecture_id = o.prefecture_id
-            """
-            params = []
-            if prefecture_filter:
-                query += " WHERE p.name ILIKE %s"
-                params.append(f"%{prefecture_filter}%")
-            
-            query += " ORDER BY p.name, o.name;"
-            
-            cursor.execute(query, tuple(params))
-            locations = cursor.fetchall()
-        except psycopg2.Error as err:
-            flash(f"地域情報の取得中にエラーが発生しました: {err}", "error")
-        finally:
-            cursor.close()
-            conn.close()
+    if conn is None:
+        raise psycopg2.OperationalError("データベースに接続できませんでした。")
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        query = """
+            SELECT
+                p.name AS prefecture_name,
+                o.name AS organization_name
+            FROM
+                Prefectures p
+            JOIN
+                Organizations o ON p.prefecture_id = o.prefecture_id
+        """
+        params = []
+        if prefecture_filter:
+            query += " WHERE p.name ILIKE %s"
+            params.append(f"%{prefecture_filter}%")
+        
+        query += " ORDER BY p.name, o.name;"
+        
+        cursor.execute(query, tuple(params))
+        locations = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    return render_template("admin/_registered_regions_table.html", locations=locations)
+
+
+def fetch_daily_stats(cursor, days=30, organization_id=None):
+    """
+    日次集計テーブル (jobs.py の refresh_daily_stats で更新) から、直近 days 日分の
+    応募数・承認数・新規募集数・新規ボランティア数を日付順に返します。
+    organization_id を指定した場合はその組織の値のみを集計します。
+    """
+    cursor.execute("""
+        WITH days AS (
+            SELECT generate_series(CURRENT_DATE - (%(days)s - 1), CURRENT_DATE, interval '1 day')::date AS stat_date
+        )
+        SELECT
+            d.stat_date,
+            COALESCE(a.applications, 0) AS applications,
+            COALESCE(a.approvals, 0) AS approvals,
+            COALESCE(r.new_recruitments, 0) AS new_recruitments,
+            COALESCE(v.new_volunteers, 0) AS new_volunteers
+        FROM days d
+        LEFT JOIN (
+            SELECT stat_date, SUM(applications) AS applications, SUM(approvals) AS approvals
+            FROM DailyApplicationStats
+            WHERE category_id = 0 AND stat_date > CURRENT_DATE - %(days)s
+              AND (%(org_id)s::int IS NULL OR organization_id = %(org_id)s)
+            GROUP BY stat_date
+        ) a ON a.stat_date = d.stat_date
+        LEFT JOIN (
+            SELECT stat_date, SUM(new_recruitments) AS new_recruitments
+            FROM DailyRecruitmentStats
+            WHERE category_id = 0 AND stat_date > CURRENT_DATE - %(days)s
+              AND (%(org_id)s::int IS NULL OR organization_id = %(org_id)s)
+            GROUP BY stat_date
+        ) r ON r.stat_date = d.stat_date
+        LEFT JOIN (
+            SELECT stat_date, SUM(new_volunteers) AS new_volunteers
+            FROM DailyVolunteerStats
+            WHERE stat_date > CURRENT_DATE - %(days)s
+              AND (%(org_id)s::int IS NULL OR organization_id = %(org_id)s)
+            GROUP BY stat_date
+        ) v ON v.stat_date = d.stat_date
+        ORDER BY d.stat_date
+    """, {'days': days, 'org_id': organization_id})
+    stats = []
+    for row in cursor.fetchall():
+        stat = {key: int(value) for key, value in dict(row).items() if key != 'stat_date'}
+        stat['date'] = row['stat_date'].isoformat()
+        stats.append(stat)
+    return stats
+
+@app.route("/admin/api/stats/daily")
+def admin_daily_stats_api():
+    """
+    日次の推移をJSONで返すAPI。
+    group_by=organization を指定すると、市町村ごとの日別応募数を返します。
+    """
+    if 'admin_user' not in session:
+        return jsonify({"error": "認証が必要です。"}), 401
+
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    organization_id = request.args.get('organization_id', type=int)
+    group_by = request.args.get('group_by')
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "データベースに接続できませんでした。"}), 500
 
-    return render_template("admin/registered_regions.html", locations=locations)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        if group_by == 'organization':
+            cursor.execute("""
+                SELECT s.stat_date, s.organization_id, o.name AS organization_name,
+                       s.applications, s.approvals
+                FROM DailyApplicationStats s
+                JOIN Organizations o ON o.organization_id = s.organization_id
+                WHERE s.category_id = 0 AND s.stat_date > CURRENT_DATE - %s
+                ORDER BY s.stat_date, o.name
+            """, (days,))
+            stats = []
+            for row in cursor.fetchall():
+                stat = dict(row)
+                stat['date'] = stat.pop('stat_date').isoformat()
+                stats.append(stat)
+        else:
+            stats = fetch_daily_stats(cursor, days=days, organization_id=organization_id)
+    except psycopg2.Error as err:
+        print(f"クエリエラー: {err}")
+        return jsonify({"error": "統計情報の取得に失敗しました。"}), 500
+    finally:
+        cursor.close()
+        conn.close()
 
+    return jsonify(stats)
 
 @app.route("/admin/analysis")
 def admin_analysis():
@@ -454,6 +1100,7 @@ def admin_org_register():
             prefecture_id = prefecture['prefecture_id']
             
             cursor.execute("INSERT INTO Organizations (prefecture_id, name, application_date) VALUES (%s, %s, %s)", (prefecture_id, org_name, app_date))
+            bump_data_version(cursor, 'regions')
             conn.commit()
             flash(f"「{prefecture_name} {org_name}」を登録しました。", "success")
         except psycopg2.Error as err:
@@ -506,6 +1153,7 @@ def admin_add_prefecture():
     try:
         cursor.execute("INSERT INTO Prefectures (name) VALUES (%s) RETURNING prefecture_id, name", (prefecture_name,))
         new_prefecture = cursor.fetchone()
+        bump_data_version(cursor, 'regions')
         conn.commit()
         return jsonify({'success': True, 'message': f"都道府県「{prefecture_name}」を追加しました。", 'prefecture': {'id': new_prefecture[0], 'name': new_prefecture[1]}}), 200
     except psycopg2.Error as err:
@@ -649,7 +1297,7 @@ def admin_category_management():
     conn = get_db_connection()
     if conn is None:
         flash("データベースに接続できませんでした。", "error")
-        return render_template("admin/category_management.html", categories=[])
+        return render_template("admin/category_management.html", category_rows=render_template("admin/_category_rows.html", categories=[]))
 
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
@@ -660,7 +1308,9 @@ def admin_category_management():
         else:
             try:
                 cursor.execute("INSERT INTO RecruitmentCategories (category_name) VALUES (%s)", (category_name,))
+                bump_data_version(cursor, 'categories')
                 conn.commit()
+                invalidate_reference_data('categories')
                 flash(f"カテゴリー「{category_name}」を追加しました。", "success")
             except psycopg2.Error as err:
                 conn.rollback()
@@ -673,12 +1323,33 @@ def admin_category_management():
         conn.close()
         return redirect(url_for('admin_category_management'))
 
-    cursor.execute("SELECT * FROM RecruitmentCategories ORDER BY category_name")
-    categories = cursor.fetchall()
     cursor.close()
     conn.close()
 
-    return render_template("admin/category_management.html", categories=categories)
+    try:
+        category_rows = render_category_rows()
+    except psycopg2.Error as err:
+        flash(f"カテゴリーの取得中にエラーが発生しました: {err}", "error")
+        category_rows = render_template("admin/_category_rows.html", categories=[])
+
+    return render_template("admin/category_management.html", category_rows=category_rows)
+
+@fragment_cache('categories')
+def render_category_rows():
+    """カテゴリー管理ページの一覧の行を描画します。カテゴリーが変更されるまで再利用します。"""
+    conn = get_db_connection()
+    if conn is None:
+        raise psycopg2.OperationalError("データベースに接続できませんでした。")
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute("SELECT * FROM RecruitmentCategories ORDER BY category_name")
+        categories = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    return render_template("admin/_category_rows.html", categories=categories)
 
 @app.route('/admin/category/delete/<int:category_id>', methods=['POST'])
 def admin_category_delete(category_id):
@@ -694,7 +1365,9 @@ def admin_category_delete(category_id):
     cursor = conn.cursor()
     try:
         cursor.execute("DELETE FROM RecruitmentCategories WHERE category_id = %s", (category_id,))
+        bump_data_version(cursor, 'categories')
         conn.commit()
+        invalidate_reference_data('categories')
         flash(f"カテゴリーを削除しました。", "success")
     except psycopg2.Error as err:
         flash(f"削除中にエラーが発生しました: {err}", "error")
@@ -726,7 +1399,9 @@ def admin_category_edit(category_id):
         
         try:
             cursor.execute("UPDATE RecruitmentCategories SET category_name = %s WHERE category_id = %s", (category_name, category_id))
+            bump_data_version(cursor, 'categories')
             conn.commit()
+            invalidate_reference_data('categories')
             flash(f"カテゴリー名を「{category_name}」に更新しました。", "success")
             return redirect(url_for('admin_category_management'))
         except psycopg2.Error as err:
@@ -835,25 +1510,185 @@ def uploaded_file(filename):
     """アップロードされたファイルを配信するためのルート"""
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+@app.route('/media/<content_hash>/<variant>')
+def media_file(content_hash, variant):
+    """アップロードされた画像 (元画像またはリサイズ版) を配信するためのルート"""
+    if not re.fullmatch(r'[0-9a-f]{64}', content_hash):
+        return "画像が見つかりませんでした。", 404
+    return uploads.send_media(content_hash, variant)
+
+# 公開APIのクエリ (asgi.py の非同期版と共有するため、モジュールレベルで定義)
+OPPORTUNITIES_QUERY = """
+    SELECT 
+        r.recruitment_id, r.title, r.description, r.start_date, r.end_date,
+        MIN(rc.category_name) as category_name
+    FROM Recruitments r
+    LEFT JOIN RecruitmentCategoryMap rcm ON r.recruitment_id = rcm.recruitment_id
+    LEFT JOIN RecruitmentCategories rc ON rcm.category_id = rc.category_id
+    WHERE r.status = 'Open'
+    GROUP BY r.recruitment_id, r.title, r.description, r.start_date, r.end_date
+"""
+PREFECTURES_QUERY = "SELECT prefecture_id, name FROM Prefectures ORDER BY prefecture_id"
+MUNICIPALITIES_QUERY = "SELECT organization_id, name FROM Organizations WHERE prefecture_id = %s ORDER BY name"
+# ボランティア1人の応募 (アーカイブ済みの古い年の応募を含む) を a として返す FROM 句です。パラメータはボランティアID。
+# アーカイブ済みの応募は ApplicationArchive の JSONB を展開して読むため、通常の応募より遅くなります
+# (jobs.py の archive_application_partitions を参照)。
+VOLUNTEER_APPLICATIONS = """
+    (SELECT %s::integer AS volunteer_id) target
+    CROSS JOIN LATERAL (
+        SELECT a.application_id, a.recruitment_id, a.volunteer_id, a.application_date, a.status
+        FROM Applications a
+        WHERE a.volunteer_id = target.volunteer_id
+        UNION ALL
+        SELECT x.application_id, x.recruitment_id, aa.volunteer_id, x.application_date, x.status
+        FROM ApplicationArchive aa
+        CROSS JOIN LATERAL jsonb_to_recordset(aa.applications) AS x(
+            application_id INTEGER, recruitment_id INTEGER, application_date TIMESTAMP, status application_status
+        )
+        WHERE aa.volunteer_id = target.volunteer_id
+    ) a
+"""
+# 日付は表示用の文字列に SQL で整形する (Python側で1行ずつ strftime しない)
+MY_ACTIVITIES_QUERY = f"""
+    SELECT
+        a.application_id, r.recruitment_id, r.title, r.description,
+        to_char(r.start_date, 'YYYY"年"MM"月"DD"日"') AS start_date,
+        to_char(r.end_date, 'YYYY"年"MM"月"DD"日"') AS end_date,
+        to_char(a.application_date, 'YYYY"年"MM"月"DD"日" HH24:MI') AS application_date,
+        a.status AS application_status
+    FROM {VOLUNTEER_APPLICATIONS}
+    JOIN Recruitments r ON a.recruitment_id = r.recruitment_id
+    ORDER BY a.application_date DESC
+"""
+RECRUITMENT_DETAIL_QUERY = """
+    SELECT 
+        r.recruitment_id, r.title, r.description, r.start_date, r.end_date, r.contact_phone_number, r.contact_email,
+        (SELECT c.category_name FROM RecruitmentCategories c
+         JOIN RecruitmentCategoryMap cm ON c.category_id = cm.category_id
+         WHERE cm.recruitment_id = r.recruitment_id LIMIT 1) AS category
+    FROM Recruitments r
+    WHERE r.recruitment_id = %s
+"""
+VOLUNTEER_LOGIN_QUERY = "SELECT volunteer_id, full_name, email, phone_number, password_hash FROM Volunteers WHERE email = %s"
+# 応募者一覧は並び替えの列・方向ごとに別のクエリとして登録する
+APPLICANT_SORT_COLUMNS = {
+    'application_date': 'a.application_date',
+    'full_name': 'v.full_name',
+    'status': 'a.status'
+}
+APPLICANT_SORT_ORDERS = {
+    'asc': 'ASC',
+    'desc': 'DESC'
+}
+
+# おすすめの募集 (主キー (volunteer_id, rank) の範囲を読むだけ。応募済み・募集終了の案件は除く)
+RECOMMENDATIONS_QUERY = """
+    SELECT
+        r.recruitment_id, r.title, r.description, o.name AS organization_name,
+        to_char(r.start_date, 'YYYY"年"MM"月"DD"日"') AS start_date,
+        (SELECT string_agg(rc.category_name, ', ')
+         FROM RecruitmentCategoryMap rcm
+         JOIN RecruitmentCategories rc ON rcm.category_id = rc.category_id
+         WHERE rcm.recruitment_id = r.recruitment_id) AS category,
+        vr.score
+    FROM VolunteerRecommendations vr
+    JOIN Recruitments r ON r.recruitment_id = vr.recruitment_id
+    JOIN Organizations o ON o.organization_id = r.organization_id
+    WHERE vr.volunteer_id = %s
+      AND r.status = 'Open'
+      AND NOT EXISTS (
+          SELECT 1 FROM Applications a
+          WHERE a.recruitment_id = vr.recruitment_id AND a.volunteer_id = vr.volunteer_id
+      )
+    ORDER BY vr.rank
+    LIMIT %s
+"""
+RECOMMENDATION_LIMIT = int(os.getenv("RECOMMENDATION_TOP_N", "50"))
+
+prepared_queries.register('my_activities', MY_ACTIVITIES_QUERY)
+prepared_queries.register('recommendations', RECOMMENDATIONS_QUERY)
+prepared_queries.register('recruitment_detail', RECRUITMENT_DETAIL_QUERY)
+prepared_queries.register('volunteer_login', VOLUNTEER_LOGIN_QUERY)
+for _sort_by, _column in APPLICANT_SORT_COLUMNS.items():
+    for _sort_order, _direction in APPLICANT_SORT_ORDERS.items():
+        # 案件がこの組織に属しているかの確認（セキュリティのため）も同じクエリで行う。
+        # 案件を起点に LEFT JOIN するため、0行なら案件がない・権限がない、
+        # application_id が NULL の1行なら応募者がいないことを表す。
+        prepared_queries.register(f"recruitment_applicants_{_sort_by}_{_sort_order}", f"""
+            SELECT a.application_id, v.full_name, v.email, a.status
+            FROM Recruitments r
+            LEFT JOIN Applications a ON a.recruitment_id = r.recruitment_id
+            LEFT JOIN Volunteers v ON a.volunteer_id = v.volunteer_id
+            WHERE r.recruitment_id = %s AND r.organization_id = %s
+            ORDER BY {_column} {_direction}
+        """)
+
+def build_recruitments_query(prefecture_id=None, organization_id=None, category_filter='', origin=None, radius_km=None):
+    """
+    /api/recruitments の絞り込み条件から (クエリ, パラメータ) を組み立てます。
+    origin (緯度, 経度) を指定すると、半径 radius_km 以内の募集を近い順に返し、距離 (distance_km) を付けます。
+    """
+    params = []
+    where_clauses = ["r.status = 'Open'"]
+    distance_column = ""
+    order_by = "r.start_date DESC"
+
+    if origin:
+        # geohash の格子でインデックスから候補を絞り、正確な距離で判定する
+        precision, cells = geo.covering_cells(origin[0], origin[1], radius_km)
+        distance = geo.distance_sql("r", "%s", "%s")
+        where_clauses.append(f"left(r.geohash, {precision}) = ANY(%s)")
+        params.append(cells)
+        where_clauses.append(f"{distance} <= %s")
+        params.extend(geo.distance_params(*origin) + [radius_km])
+        distance_column = f", round({distance}::numeric, 1)::float8 AS distance_km"
+        order_by = "distance_km, r.start_date DESC"
+
+    if organization_id:
+        where_clauses.append("o.organization_id = %s")
+        params.append(organization_id)
+    elif prefecture_id:
+        where_clauses.append("o.prefecture_id = %s")
+        params.append(prefecture_id)
+
+    # 複数カテゴリーを持つ募集も、いずれかが一致すれば残す (集約前に絞り込む)
+    if category_filter and category_filter != 'all':
+        where_clauses.append("r.recruitment_id IN (SELECT rcm.recruitment_id FROM RecruitmentCategoryMap rcm JOIN RecruitmentCategories rc ON rcm.category_id = rc.category_id WHERE rc.category_name = %s)")
+        params.append(category_filter)
+
+    query = f"""
+        SELECT
+            r.recruitment_id, r.title, r.description, o.name as organization_name,
+            (SELECT string_agg(rc_sub.category_name, ', ')
+             FROM RecruitmentCategoryMap rcm_sub
+             JOIN RecruitmentCategories rc_sub ON rcm_sub.category_id = rc_sub.category_id
+             WHERE rcm_sub.recruitment_id = r.recruitment_id) AS category{distance_column}
+        FROM Recruitments r
+        JOIN Organizations o ON r.organization_id = o.organization_id
+        LEFT JOIN RecruitmentCategoryMap rcm ON r.recruitment_id = rcm.recruitment_id
+        LEFT JOIN RecruitmentCategories rc ON rcm.category_id = rc.category_id
+        WHERE {' AND '.join(where_clauses)}
+        GROUP BY r.recruitment_id, o.name
+        ORDER BY {order_by}
+    """
+    # 距離の式は SELECT 句にもあるため、そのパラメータを先頭に加える
+    if origin:
+        params = geo.distance_params(*origin) + params
+    return query, params
+
 @app.route("/api/opportunities")
+@serve_stale
+@read_only
 def get_opportunities():
     """募集中のボランティア情報をデータベースから取得してJSONで返します。"""
     conn = get_db_connection()
     if conn is None:
         return jsonify({"error": "データベースに接続できませんでした。"}), 500
 
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor()
     try:
-        cursor.execute("""
-            SELECT 
-                r.recruitment_id, r.title, r.description, r.start_date, r.end_date,
-                MIN(rc.category_name) as category_name
-            FROM Recruitments r
-            LEFT JOIN RecruitmentCategoryMap rcm ON r.recruitment_id = rcm.recruitment_id
-            LEFT JOIN RecruitmentCategories rc ON rcm.category_id = rc.category_id
-            WHERE r.status = 'Open'
-                        GROUP BY r.recruitment_id, r.title, r.description, r.start_date, r.end_date        """)
-        opportunities = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(OPPORTUNITIES_QUERY)
+        return rows_response(cursor)
     except psycopg2.Error as err:
         print(f"クエリエラー: {err}")
         return jsonify({"error": f"データの取得に失敗しました: {err}"}), 500
@@ -861,8 +1696,6 @@ def get_opportunities():
         cursor.close()
         conn.close()
 
-    return jsonify(opportunities)
-
 @app.route("/api/send_inquiry", methods=["POST"])
 def send_inquiry():
     """問い合わせフォームのデータを処理し、指定されたGmailアドレスにメールを送信します。"""
@@ -904,6 +1737,9 @@ def send_inquiry():
 {data["inquiry_content"]}
 """
     msg.set_content(body)
+
+    import smtplib
+    import ssl
     context = ssl.create_default_context()
 
     try:
@@ -916,6 +1752,8 @@ def send_inquiry():
         return jsonify({"error": f"メールの送信中にエラーが発生しました: {str(e)}"}), 500
 
 @app.route("/api/categories")
+@serve_stale
+@read_only
 def get_categories():
     """カテゴリの一覧をデータベースから取得してJSONで返します。"""
     conn = get_db_connection()
@@ -924,8 +1762,7 @@ def get_categories():
 
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     try:
-        cursor.execute("SELECT category_id, category_name FROM RecruitmentCategories ORDER BY category_id")
-        categories = [dict(row) for row in cursor.fetchall()]
+        categories = get_reference_data(cursor, 'categories')
     except psycopg2.Error as err:
         print(f"クエリエラー: {err}")
         return jsonify({"error": "カテゴリの取得に失敗しました。"}), 500
@@ -936,6 +1773,8 @@ def get_categories():
     return jsonify(categories)
 
 @app.route("/api/organizations")
+@serve_stale
+@read_only
 def get_organizations():
     """導入市町村の一覧をデータベースから取得してJSONで返します。"""
     conn = get_db_connection()
@@ -956,25 +1795,28 @@ def get_organizations():
     return jsonify(organizations)
 
 @app.route("/api/prefectures")
+@serve_stale
+@read_only
 def get_prefectures_api():
     """都道府県の一覧をデータベースから取得してJSONで返します。"""
     conn = get_db_connection()
     if conn is None:
         return jsonify({"error": "データベースに接続できませんでした。"}), 500
 
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT prefecture_id, name FROM Prefectures ORDER BY prefecture_id")
-        prefectures = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(PREFECTURES_QUERY)
+        return rows_response(cursor)
     except psycopg2.Error as err:
         print(f"クエリエラー: {err}")
         return jsonify({"error": "都道府県の取得に失敗しました。"}), 500
     finally:
         cursor.close()
         conn.close()
-    return jsonify(prefectures)
 
 @app.route("/api/municipalities")
+@serve_stale
+@read_only
 def get_municipalities_api():
     """指定された都道府県に属する市町村の一覧をデータベースから取得してJSONで返します。"""
     prefecture_id = request.args.get('prefecture_id', type=int)
@@ -985,17 +1827,16 @@ def get_municipalities_api():
     if conn is None:
         return jsonify({"error": "データベースに接続できませんでした。"}), 500
 
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT organization_id, name FROM Organizations WHERE prefecture_id = %s ORDER BY name", (prefecture_id,))
-        municipalities = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(MUNICIPALITIES_QUERY, (prefecture_id,))
+        return rows_response(cursor)
     except psycopg2.Error as err:
         print(f"クエリエラー: {err}")
         return jsonify({"error": "市町村の取得に失敗しました。"}), 500
     finally:
         cursor.close()
         conn.close()
-    return jsonify(municipalities)
 
 @app.route('/api/current_user')
 def current_user():
@@ -1090,109 +1931,64 @@ def update_user_profile():
         conn.close()
 
 @app.route('/api/recruitments')
+@serve_stale
+@read_only
 def get_recruitments_api():
     """ユーザー向けに募集一覧をJSONで返す。都道府県と市町村区での絞り込みに対応。"""
     prefecture_id = request.args.get('prefecture_id', type=int)
     organization_id = request.args.get('organization_id', type=int)
     category_filter = request.args.get('category', '').strip()
+    # 近くの募集の検索: postal_code=1234567 または near=me (ログイン中のボランティアの郵便番号)
+    postal_code = request.args.get('postal_code', '').strip()
+    near = request.args.get('near', '').strip()
+    radius_km = request.args.get('radius_km', geo.DEFAULT_RADIUS_KM, type=float)
+    if not math.isfinite(radius_km):
+        return jsonify({"error": "radius_km には数値を指定してください。"}), 400
+    radius_km = min(max(radius_km, 1), geo.MAX_RADIUS_KM)
+    if near == 'me':
+        # ボランティアの郵便番号によって結果が変わるため、serve-stale の保存と返却の対象にしない
+        g.private_response = True
+        if not session.get('logged_in'):
+            return jsonify({"error": "ログインが必要です。"}), 401
 
-    recruitments = []
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        params = []
-        query = """
-            SELECT
-                r.recruitment_id, r.title, r.description, o.name as organization_name,
-                string_agg(rc.category_name, ', ') AS category
-            FROM Recruitments r
-            JOIN Organizations o ON r.organization_id = o.organization_id
-            LEFT JOIN RecruitmentCategoryMap rcm ON r.recruitment_id = rcm.recruitment_id
-            LEFT JOIN RecruitmentCategories rc ON rcm.category_id = rc.category_id
-            WHERE r.status = 'Open'
-        """
-        
-        if organization_id:
-            query += " AND o.organization_id = %s"
-            params.append(organization_id)
-        elif prefecture_id:
-            query += " AND o.prefecture_id = %s"
-            params.append(prefecture_id)
-        
-        # This part of the logic might need adjustment if a recruitment belongs to multiple categories
-        # and the user wants to filter if ANY of them match.
-        # For now, we'll check if the aggregated string contains the category.
-        if category_filter and category_filter != 'all':
-            # We can't use a simple WHERE clause with the aggregated string.
-            # We need to filter on the individual category names before aggregation.
-            # A subquery or a HAVING clause is needed. Let's use a subquery for clarity.
-            # This is getting complex, let's adjust the initial query.
-            pass # Re-thinking the query structure below.
-
-        # Corrected Query Structure
-        base_query = """
-            FROM Recruitments r
-            JOIN Organizations o ON r.organization_id = o.organization_id
-            LEFT JOIN RecruitmentCategoryMap rcm ON r.recruitment_id = rcm.recruitment_id
-            LEFT JOIN RecruitmentCategories rc ON rcm.category_id = rc.category_id
-        """
-        
-        where_clauses = ["r.status = 'Open'"]
-        
-        if organization_id:
-            where_clauses.append("o.organization_id = %s")
-            params.append(organization_id)
-        elif prefecture_id:
-            where_clauses.append("o.prefecture_id = %s")
-            params.append(prefecture_id)
-
-        # For category filtering, we need to ensure the recruitment ID is kept if it matches the category,
-        # before the final aggregation.
-        if category_filter and category_filter != 'all':
-            where_clauses.append("r.recruitment_id IN (SELECT rcm.recruitment_id FROM RecruitmentCategoryMap rcm JOIN RecruitmentCategories rc ON rcm.category_id = rc.category_id WHERE rc.category_name = %s)")
-            params.append(category_filter)
+        cursor = conn.cursor()
 
-        query = f"""
-            SELECT
-                r.recruitment_id, r.title, r.description, o.name as organization_name,
-                (SELECT string_agg(rc_sub.category_name, ', ')
-                 FROM RecruitmentCategoryMap rcm_sub
-                 JOIN RecruitmentCategories rc_sub ON rcm_sub.category_id = rc_sub.category_id
-                 WHERE rcm_sub.recruitment_id = r.recruitment_id) AS category
-            {base_query}
-            WHERE {' AND '.join(where_clauses)}
-            GROUP BY r.recruitment_id, o.name
-            ORDER BY r.start_date DESC
-        """
-        
+        origin = None
+        if postal_code or near == 'me':
+            if near == 'me':
+                cursor.execute("SELECT postal_code FROM Volunteers WHERE volunteer_id = %s", (session.get('volunteer_id'),))
+                row = cursor.fetchone()
+                postal_code = row[0] if row else ''
+            normalized = geo.normalize_postal_code(postal_code)
+            origin = geo.find_postal_location(cursor, normalized) if normalized else None
+            if origin is None:
+                cursor.close()
+                conn.close()
+                return jsonify({"error": "郵便番号の位置が見つかりません。"}), 400
+
+        query, params = build_recruitments_query(prefecture_id, organization_id, category_filter, origin, radius_km)
         cursor.execute(query, tuple(params))
-        recruitments = [dict(row) for row in cursor.fetchall()]
+        response = rows_response(cursor)
         cursor.close()
         conn.close()
     except Exception as e:
         print(f"Database error: {e}")
         return jsonify({"error": "データベースの取得に失敗しました。"}), 500
-    return jsonify(recruitments)
+    return response
 
 
 @app.route('/api/recruitments/<int:recruitment_id>')
+@serve_stale
+@read_only
 def get_recruitment_detail_json(recruitment_id):
     """募集詳細をJSONで返す"""
     recruitment = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        query = """
-            SELECT 
-                r.recruitment_id, r.title, r.description, r.start_date, r.end_date, r.contact_phone_number, r.contact_email,
-                (SELECT c.category_name FROM RecruitmentCategories c
-                 JOIN RecruitmentCategoryMap cm ON c.category_id = cm.category_id
-                 WHERE cm.recruitment_id = r.recruitment_id LIMIT 1) AS category
-            FROM Recruitments r
-            WHERE r.recruitment_id = %s
-        """
-        cursor.execute(query, (recruitment_id,))
+        prepared_queries.execute(cursor, 'recruitment_detail', (recruitment_id,))
         recruitment = cursor.fetchone()
         cursor.close()
         conn.close()
@@ -1208,37 +2004,19 @@ def get_recruitment_detail_json(recruitment_id):
     return jsonify(dict(recruitment))
 
 @app.route('/api/my_activities')
+@read_only
 def get_my_activities():
     """ログイン中のユーザーの活動履歴を返す"""
     if not session.get('logged_in') or not session.get('volunteer_id'):
         return jsonify({'error': 'ログインしていません。'}), 401
 
     volunteer_id = session.get('volunteer_id')
-    activities = []
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        query = """
-            SELECT
-                a.application_id, r.recruitment_id, r.title, r.description, r.start_date, r.end_date,
-                a.application_date, a.status AS application_status
-            FROM Applications a
-            JOIN Volunteers v ON a.volunteer_id = v.volunteer_id
-            JOIN Recruitments r ON a.recruitment_id = r.recruitment_id
-            WHERE a.volunteer_id = %s
-            ORDER BY a.application_date DESC
-        """
-        cursor.execute(query, (volunteer_id,))
-        activities_rows = cursor.fetchall()
-        activities = [dict(row) for row in activities_rows]
-        
-        for activity in activities:
-            if activity.get('start_date'):
-                activity['start_date'] = activity['start_date'].strftime('%Y年%m月%d日')
-            if activity.get('end_date'):
-                activity['end_date'] = activity['end_date'].strftime('%Y年%m月%d日')
-            if activity.get('application_date'):
-                activity['application_date'] = activity['application_date'].strftime('%Y年%m月%d日 %H:%M')
+        cursor = conn.cursor()
+        # 日付は MY_ACTIVITIES_QUERY の中で表示用の文字列に整形済み
+        prepared_queries.execute(cursor, 'my_activities', (volunteer_id,))
+        response = rows_response(cursor)
 
         cursor.close()
         conn.close()
@@ -1246,7 +2024,29 @@ def get_my_activities():
         print(f"Database error fetching activities: {e}")
         return jsonify({'error': '活動履歴の取得に失敗しました。'}), 500
     
-    return jsonify(activities)
+    return response
+
+@app.route('/api/recommendations')
+@read_only
+def get_recommendations():
+    """ログイン中のユーザーへのおすすめの募集を返す (jobs.py の refresh_recommendations で事前に計算済み)"""
+    if not session.get('logged_in') or not session.get('volunteer_id'):
+        return jsonify({'error': 'ログインしていません。'}), 401
+
+    limit = min(max(request.args.get('limit', 20, type=int), 1), RECOMMENDATION_LIMIT)
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        prepared_queries.execute(cursor, 'recommendations', (session.get('volunteer_id'), limit))
+        response = rows_response(cursor)
+
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        print(f"Database error fetching recommendations: {e}")
+        return jsonify({'error': 'おすすめの取得に失敗しました。'}), 500
+
+    return response
 
 @app.route('/api/apply', methods=['POST'])
 def apply_for_recruitment():
@@ -1265,22 +2065,53 @@ def apply_for_recruitment():
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        cursor.execute(
-            "INSERT INTO Applications (recruitment_id, volunteer_id, application_date, status) VALUES (%s, %s, %s, %s)",
-            (recruitment_id, volunteer_id, datetime.now(), 'Pending')
-        )
-        conn.commit()
+        # 重複応募の判定と、募集人数のある募集の空き枠の確保は seats.apply で行う
+        result, application_id = seats.apply(cursor, recruitment_id, volunteer_id)
+        if result in ('duplicate', 'not_found'):
+            conn.rollback()
+        else:
+            conn.commit()
         cursor.close()
         conn.close()
 
-        return jsonify({'success': True, 'message': '応募が完了しました。'})
+        if result == 'duplicate':
+            return jsonify({'success': False, 'message': 'この募集には既に応募済みです。'}), 409
+        if result == 'not_found':
+            return jsonify({'success': False, 'message': '募集が見つかりません。'}), 404
+        if result == 'waitlisted':
+            return jsonify({
+                'success': True, 'waitlisted': True, 'application_id': application_id,
+                'message': 'この募集は定員に達しているため、キャンセル待ちに登録しました。キャンセルが出ると応募順に繰り上がります。'
+            })
+        return jsonify({'success': True, 'waitlisted': False, 'application_id': application_id, 'message': '応募が完了しました。'})
 
-    except psycopg2.IntegrityError:
-        return jsonify({'success': False, 'message': 'この募集には既に応募済みです。'}), 409
     except Exception as e:
         print(f"Database error during application: {e}")
         return jsonify({'success': False, 'message': '応募処理中にエラーが発生しました。'}), 500
 
+@app.route('/api/applications/<int:application_id>/cancel', methods=['POST'])
+def cancel_application(application_id):
+    """応募の取り消し (枠が空いた場合は、キャンセル待ちの応募を繰り上げる)"""
+    if not session.get('logged_in') or not session.get('volunteer_id'):
+        return jsonify({'success': False, 'message': 'ログインが必要です。'}), 401
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        recruitment_id = seats.cancel(cursor, application_id, session.get('volunteer_id'))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        if recruitment_id is None:
+            return jsonify({'success': False, 'message': '応募が見つかりません。'}), 404
+        return jsonify({'success': True, 'message': '応募を取り消しました。'})
+
+    except Exception as e:
+        print(f"Database error during cancellation: {e}")
+        return jsonify({'success': False, 'message': '応募の取り消し中にエラーが発生しました。'}), 500
+
 @app.route('/api/inquiries', methods=['POST'])
 def post_inquiry():
     """募集に関する問い合わせ"""
@@ -1318,6 +2149,7 @@ def post_inquiry():
         admin_user = cursor.fetchone()
 
         if admin_user and admin_user['username']:
+            from flask_mail import Message
             recipient_email = admin_user['username']
             email_body = f"""
 募集案件「{recruitment_title}」に関する新しい問い合わせがあります。
@@ -1337,7 +2169,7 @@ def post_inquiry():
                 recipients=[recipient_email],
                 body=email_body
             )
-            mail.send(msg)
+            get_mail().send(msg)
         else:
             print(f"No OrgAdmin email found for organization {organization_id}. Email not sent.")
 
@@ -1351,6 +2183,7 @@ def post_inquiry():
         return jsonify({'success': False, 'message': '問い合わせの送信中にエラーが発生しました。'}), 500
 
 @app.route('/api/issue_certificate')
+@statement_timeout(10000)
 def issue_certificate():
     """ボランティア活動証明書をPDFで発行する"""
     if not session.get('logged_in') or not session.get('volunteer_id'):
@@ -1367,17 +2200,18 @@ def issue_certificate():
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
-        query = """
+        # アーカイブ済みの古い応募の証明書も発行できるよう、VOLUNTEER_APPLICATIONS から探す
+        query = f"""
             SELECT
                 v.full_name AS volunteer_name, r.title AS recruitment_title,
                 r.description AS recruitment_description, r.start_date AS activity_start_date,
                 r.end_date AS activity_end_date, a.application_date
-            FROM Applications a
+            FROM {VOLUNTEER_APPLICATIONS}
             JOIN Volunteers v ON a.volunteer_id = v.volunteer_id
             JOIN Recruitments r ON a.recruitment_id = r.recruitment_id
-            WHERE a.application_id = %s AND a.recruitment_id = %s AND a.volunteer_id = %s
+            WHERE a.application_id = %s AND a.recruitment_id = %s
         """
-        cursor.execute(query, (application_id, recruitment_id, volunteer_id))
+        cursor.execute(query, (volunteer_id, application_id, recruitment_id))
         activity_data = cursor.fetchone()
         cursor.close()
         conn.close()
@@ -1385,6 +2219,7 @@ def issue_certificate():
         if not activity_data:
             return jsonify({'error': '指定された活動履歴が見つかりません。'}), 404
 
+        from fpdf import FPDF
         pdf = FPDF()
         # 日本語フォントの追加（絶対パスを使用）
         font_path = os.path.join(app.root_path, 'fonts', 'NotoSansJP-Regular.ttf')
@@ -1510,89 +2345,126 @@ def update_user_interests():
 # AI分析機能
 # ------------------------------
 
-# # Google Cloud Natural Language APIの認証情報を環境変数から読み込む
-# # ai_key/borantelia-ca0b9d410b20.json はリポジリから除外されているため、環境変数から読み込む
-# if "GOOGLE_APPLICATION_CREDENTIALS_JSON" in os.environ:
-#     # 環境変数からJSON文字列を読み込み、一時ファイルとして保存
-#     credentials_json = os.environ["GOOGLE_APPLICATION_CREDENTIALS_JSON"]
-#     temp_credentials_path = os.path.join(app.root_path, "temp_google_credentials.json")
-#     with open(temp_credentials_path, "w") as f:
-#         f.write(credentials_json)
-#     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = temp_credentials_path
-# else:
-#     # ローカル開発環境など、環境変数がない場合は既存のファイルパスを使用
-#     # ただし、ai_keyディレクトリは.gitignoreで除外されているため、このパスはローカルでのみ有効
-#     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(app.root_path, 'ai_key', 'borantelia-ca0b9d410b20.json')
-
-# # Google Cloud Natural Language APIクライアントを初期化
-# # 環境変数 GOOGLE_APPLICATION_CREDENTIALS が設定されているため、自動的に認証される
-# language_client = language_v1.LanguageServiceClient()
-
-# def analyze_recruitment_text(text):
-#     """Google Cloud Natural Language APIを使用して、テキストの感情分析を行います。"""
-#     try:
-#         # ここでは既に初期化済みの language_client を使用
-#         document = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT, language='ja')
-#         sentiment = language_client.analyze_sentiment(request={'document': document}).document_sentiment
-#         return {'sentiment_score': sentiment.score, 'sentiment_magnitude': sentiment.magnitude}
-#     except Exception as e:
-#         print(f"Natural Language API Error: {e}")
-#         return {'sentiment_score': 0, 'sentiment_magnitude': 0, 'error': str(e)}
-
-# @app.route('/analyze_popular_factors')
-# def analyze_popular_factors():
-#     """DBから求人テキストと応募者数を取得し、相関を分析して結果をJSONで返すAPI"""
-#     conn = get_db_connection()
-#     if conn is None:
-#         return jsonify({"error": "データベースに接続できませんでした。"}), 500
-
-#     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-#     try:
-#         query = """
-#             SELECT 
-#                 r.recruitment_id, r.title, r.description,
-#                 COUNT(a.application_id) AS applicants
-#             FROM Recruitments r
-#             LEFT JOIN Applications a ON r.recruitment_id = a.recruitment_id
-#             GROUP BY r.recruitment_id, r.title, r.description
-#             ORDER BY applicants DESC;
-#         """
-#         cursor.execute(query)
-#         db_data = cursor.fetchall()
-#     except psycopg2.Error as err:
-#         print(f"クエリエラー: {err}")
-#         return jsonify({"error": "データ取得中にエラーが発生しました。"}), 500
-#     finally:
-#         cursor.close()
-#         conn.close()
-
-#     if not db_data:
-#         return jsonify({"summary": "分析対象のデータがありません。", "details": []})
-
-#     analysis_results = []
-#     for row in db_data:
-#         recruitment_text = f"{row['title']} {row['description']}"
-#         nl_result = analyze_recruitment_text(recruitment_text)
-#         analysis_results.append({
-#             "id": row['recruitment_id'], "title": row['title'], "description": row['description'],
-#             "applicants": row['applicants'], "sentiment_score": nl_result.get('sentiment_score', 0),
-#             "sentiment_magnitude": nl_result.get('sentiment_magnitude', 0)
-#         })
-
-#     df_analysis = pd.DataFrame(analysis_results)
-#     df_filtered = df_analysis[df_analysis['applicants'] > 0]
-#     if len(df_filtered) > 1:
-#         correlation = df_filtered['sentiment_score'].corr(df_filtered['applicants'])
-#         correlation_summary = f"感情スコアと応募数の相関: {correlation:.2f}"
-#     else:
-#         correlation_summary = "相関を計算するにはデータが不十分です。"
-
-#     report = {
-#         "summary": "AIによる人気募集の傾向分析レポート",
-#         "correlation_sentiment_applicants": correlation_summary,
-#         "details": df_analysis.to_dict('records')
-#     }
-#     return jsonify(report)
+# 感情分析はリクエスト内では行わず、jobs.py の analyze_recruitments で事前に計算して
+# RecruitmentSentiment テーブルに保存しています。ここでは保存済みの結果を読むだけです。
+# アナライザーの切り替えは sentiment.py を参照してください。
+
+@app.route('/analyze_popular_factors')
+def analyze_popular_factors():
+    """事前計算済みの感情分析結果と応募者数から相関を求め、結果をJSONで返すAPI"""
+    if 'admin_user' not in session:
+        return jsonify({"error": "認証が必要です。"}), 401
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "データベースに接続できませんでした。"}), 500
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute("""
+            SELECT
+                r.recruitment_id AS id, r.title, r.description,
+                s.applicants, s.sentiment_score, s.sentiment_magnitude, s.analyzed_at
+            FROM RecruitmentSentiment s
+            JOIN Recruitments r ON r.recruitment_id = s.recruitment_id
+            ORDER BY s.applicants DESC, r.recruitment_id
+        """)
+        details = [dict(row) for row in cursor.fetchall()]
+    except psycopg2.Error as err:
+        print(f"クエリエラー: {err}")
+        return jsonify({"error": "データ取得中にエラーが発生しました。"}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+    if not details:
+        return jsonify({"summary": "分析対象のデータがありません。分析ジョブが実行されているか確認してください。", "details": []})
+
+    # 応募者がいる募集だけで、感情スコアと応募数の相関を計算する
+    filtered = [d for d in details if d['applicants'] > 0]
+    correlation_summary = "相関を計算するにはデータが不十分です。"
+    if len(filtered) > 1:
+        import statistics
+        try:
+            correlation = statistics.correlation(
+                [d['sentiment_score'] for d in filtered], [d['applicants'] for d in filtered]
+            )
+            correlation_summary = f"感情スコアと応募数の相関: {correlation:.2f}"
+        except statistics.StatisticsError:
+            # どちらかの値がすべて同じ場合は相関を定義できない
+            pass
+
+    last_analyzed_at = max(d['analyzed_at'] for d in details)
+    for d in details:
+        d.pop('analyzed_at')
+
+    report = {
+        "summary": f"AIによる人気募集の傾向分析レポート (最終分析: {last_analyzed_at.strftime('%Y-%m-%d %H:%M')})",
+        "correlation_sentiment_applicants": correlation_summary,
+        "details": details
+    }
+    return jsonify(report)
+
+@app.route('/admin/api/statement_timeouts')
+def admin_statement_timeouts_api():
+    """このワーカーで、SQL文のタイムアウトやリクエストの期限切れによりクエリが取り消された回数をビューごとに返すAPI"""
+    if 'admin_user' not in session:
+        return jsonify({"error": "認証が必要です。"}), 401
+
+    with _timeout_stats_lock:
+        stats = {endpoint: dict(values) for endpoint, values in _timeout_stats.items()}
+    endpoints = []
+    for endpoint, values in stats.items():
+        view = app.view_functions.get(endpoint)
+        endpoints.append({
+            "endpoint": endpoint,
+            "timeout_ms": getattr(view, 'statement_timeout_ms', DB_STATEMENT_TIMEOUT_MS),
+            **values,
+        })
+    endpoints.sort(key=lambda e: e['statement_timeout'] + e['deadline'], reverse=True)
+    return jsonify({
+        "worker_pid": os.getpid(),
+        "default_timeout_ms": DB_STATEMENT_TIMEOUT_MS,
+        "request_deadline_seconds": REQUEST_DEADLINE_SECONDS,
+        "endpoints": endpoints,
+    })
+
+# 応募傾向レポートの計算結果 (ワーカーごとにキャッシュする)
+_popularity_report_cache = {'report': None, 'computed_at': 0.0}
+_popularity_report_lock = threading.Lock()
+POPULARITY_REPORT_TTL = int(os.getenv("ANALYTICS_CACHE_SECONDS", "300"))
+
+@app.route('/admin/api/analytics')
+@statement_timeout(15000)
+def admin_analytics_api():
+    """カテゴリ別・市町村別・曜日別・リードタイム別の応募傾向をJSONで返すAPI"""
+    if 'admin_user' not in session:
+        return jsonify({"error": "認証が必要です。"}), 401
+
+    refresh = request.args.get('refresh') == '1'
+    with _popularity_report_lock:
+        cached = _popularity_report_cache['report']
+        if cached is not None and not refresh and time.time() - _popularity_report_cache['computed_at'] < POPULARITY_REPORT_TTL:
+            return jsonify(cached)
+
+        conn = get_db_connection()
+        if conn is None:
+            return jsonify({"error": "データベースに接続できませんでした。"}), 500
+
+        try:
+            # pandas/NumPyは重いため、このAPIが呼ばれた時だけ読み込む
+            import analytics
+            report = analytics.build_popularity_report(conn)
+        except psycopg2.Error as err:
+            print(f"クエリエラー: {err}")
+            return jsonify({"error": "分析データの取得に失敗しました。"}), 500
+        finally:
+            conn.close()
+
+        report['generated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        _popularity_report_cache['report'] = report
+        _popularity_report_cache['computed_at'] = time.time()
+    return jsonify(report)
 
 
 # ------------------------------
@@ -1621,8 +2493,13 @@ def staff_login():
             return render_template("staff/re/staff_login.html")
 
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        # AdminUsersテーブルからユーザーを検索
-        cursor.execute("SELECT admin_id, organization_id, username, password_hash, role FROM AdminUsers WHERE username = %s", (username,))
+        # AdminUsersテーブルからユーザーを検索 (メニュー表示用に組織名も同時に取得)
+        cursor.execute("""
+            SELECT u.admin_id, u.organization_id, u.username, u.password_hash, u.role, o.name AS organization_name
+            FROM AdminUsers u
+            LEFT JOIN Organizations o ON o.organization_id = u.organization_id
+            WHERE u.username = %s
+        """, (username,))
         user = cursor.fetchone()
         cursor.close()
         conn.close()
@@ -1638,10 +2515,12 @@ def staff_login():
                 is_password_correct = False
 
         if is_password_correct:
-            # 認証成功: 必要な情報をセッションに保存
+            # 認証成功: 必要な情報をセッションに保存 (セッションIDは新しく発行する)
+            session.regenerate()
             session['org_user'] = user['username']      # 職員のユーザー名
             session['org_id'] = user['organization_id'] # 所属組織ID
             session['org_role'] = user['role']          # 権限 (OrgAdmin/Staff)
+            session['org_name'] = user['organization_name'] # 組織名 (メニュー表示用)
             return redirect(url_for('staff_menu'))
         else:
             flash("ユーザー名またはパスワードが正しくありません。", "error")
@@ -1655,10 +2534,12 @@ def staff_login():
 def staff_logout():
     """職員のログアウト処理。セッションをクリアし、ログイン画面へリダイレクトします。"""
     
-    # 関連するセッションキーのみを削除
+    # 関連するセッションキーのみを削除 (セッションIDは新しく発行する)
+    session.regenerate()
     session.pop('org_user', None)
     session.pop('org_id', None)
     session.pop('org_role', None)
+    session.pop('org_name', None)
 
     # ログアウト時に既存のflashメッセージをクリア
     # これにより、ログイン成功時の「ようこそ、〇様」メッセージがログアウト後に表示されるのを防ぐ
@@ -1673,48 +2554,113 @@ def staff_logout():
 
 @app.route("/staff/menu")
 def staff_menu():
-    """市町村職員メニュー（ダッシュボード）。組織名を取得して表示する。"""
+    """市町村職員メニュー（ダッシュボード）。組織名はログイン時にセッションへ保存したものを表示する。"""
     if not check_org_login():
         return redirect(url_for('staff_login'))
-    
-    username = session.get('org_user')
+
+    # 件数や最近の応募は /staff/api/dashboard からまとめて取得するため、ここではDBに接続しない
+    context = {
+        'username': session.get('org_user'),
+        'org_id': session.get('org_id'),
+        'org_role': session.get('org_role'),
+        'org_name': session.get('org_name') or "所属組織不明"
+    }
+    return render_template("staff/re/staff_menu.html", **context)
+
+@app.route("/staff/api/dashboard")
+def staff_dashboard_api():
+    """
+    職員ダッシュボードに必要な情報 (組織名、ステータス別の募集数、承認待ちの応募数、
+    最近の応募、直近7日間の応募数の推移) を1回のクエリでまとめて返します。
+    """
+    if not check_org_login():
+        return jsonify({"error": "認証が必要です"}), 401
+
     org_id = session.get('org_id')
-    org_role = session.get('org_role')
-    org_name = "所属組織不明" # デフォルト値
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "データベースに接続できませんでした。"}), 500
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute("""
+            WITH rec AS (
+                SELECT recruitment_id, title, status
+                FROM Recruitments
+                WHERE organization_id = %(org_id)s
+            ),
+            recruitment_counts AS (
+                SELECT
+                    COUNT(*) FILTER (WHERE status = 'Open') AS open_count,
+                    COUNT(*) FILTER (WHERE status = 'Draft') AS draft_count,
+                    COUNT(*) FILTER (WHERE status = 'Closed') AS closed_count
+                FROM rec
+            ),
+            pending AS (
+                SELECT COUNT(*) AS pending_applications
+                FROM Applications a
+                JOIN rec ON rec.recruitment_id = a.recruitment_id
+                WHERE a.status = 'Pending'
+            ),
+            recent AS (
+                SELECT COALESCE(json_agg(x ORDER BY x.application_date DESC), '[]'::json) AS recent_activity
+                FROM (
+                    SELECT a.application_id, a.application_date, a.status,
+                           v.full_name AS applicant_name, rec.recruitment_id, rec.title AS recruitment_title
+                    FROM Applications a
+                    JOIN rec ON rec.recruitment_id = a.recruitment_id
+                    JOIN Volunteers v ON v.volunteer_id = a.volunteer_id
+                    ORDER BY a.application_date DESC
+                    LIMIT 10
+                ) x
+            ),
+            trend AS (
+                SELECT COALESCE(json_agg(json_build_object('date', d.stat_date::date, 'applications', COALESCE(s.applications, 0))
+                                         ORDER BY d.stat_date), '[]'::json) AS daily_applications
+                FROM generate_series(CURRENT_DATE - 6, CURRENT_DATE, interval '1 day') AS d(stat_date)
+                LEFT JOIN DailyApplicationStats s
+                       ON s.stat_date = d.stat_date::date AND s.organization_id = %(org_id)s AND s.category_id = 0
+            )
+            SELECT o.name AS organization_name, recruitment_counts.*, pending.*, recent.*, trend.*
+            FROM recruitment_counts, pending, recent, trend
+            LEFT JOIN Organizations o ON o.organization_id = %(org_id)s
+        """, {'org_id': org_id})
+        summary = dict(cursor.fetchone())
+    except psycopg2.Error as err:
+        print(f"ダッシュボード情報の取得エラー: {err}")
+        return jsonify({"error": "ダッシュボード情報の取得に失敗しました。"}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+    # 組織名が変更されている場合に備えて、セッションの値も更新しておく
+    if summary['organization_name'] and summary['organization_name'] != session.get('org_name'):
+        session['org_name'] = summary['organization_name']
+
+    return jsonify(summary)
+
+@app.route("/staff/api/stats/daily")
+def staff_daily_stats_api():
+    """ログイン中の職員の組織について、日次の推移をJSONで返します。"""
+    if not check_org_login():
+        return jsonify({"error": "認証が必要です"}), 401
 
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
     conn = get_db_connection()
     if conn is None:
-        flash("データベースに接続できませんでした。", "error")
-        # データベース接続エラーでも、セッション情報だけは表示できるようにする
-        context = {
-            'username': username,
-            'org_id': org_id,
-            'org_role': org_role,
-            'org_name': org_name
-        }
-        return render_template("staff/re/staff_menu.html", **context)
+        return jsonify({"error": "データベースに接続できませんでした。"}), 500
 
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     try:
-        # Organizationsテーブルから組織名を取得
-        cursor.execute("SELECT name FROM Organizations WHERE organization_id = %s", (org_id,))
-        org_data = cursor.fetchone()
-        if org_data:
-            org_name = org_data['name']
+        stats = fetch_daily_stats(cursor, days=days, organization_id=session.get('org_id'))
     except psycopg2.Error as err:
-        flash(f"組織情報の取得中にエラーが発生しました: {err}", "error")
+        print(f"クエリエラー: {err}")
+        return jsonify({"error": "統計情報の取得に失敗しました。"}), 500
     finally:
         cursor.close()
         conn.close()
 
-    # テンプレートに渡す情報に組織名(org_name)を追加
-    context = {
-        'username': username,
-        'org_id': org_id,
-        'org_role': org_role,
-        'org_name': org_name 
-    }
-    return render_template("staff/re/staff_menu.html", **context)
+    return jsonify(stats)
 
 @app.route("/staff/recruitment/list")
 def staff_opportunity_list_page():
@@ -1738,6 +2684,7 @@ def staff_opportunity_create_page():
 
 
 @app.route("/staff/api/opportunities/all") 
+@read_only
 def get_staff_opportunities():
     """
     ログインしている職員の組織IDに紐づく募集案件の一覧をJSONで返します。
@@ -1751,42 +2698,35 @@ def get_staff_opportunities():
     if conn is None:
         return jsonify({"error": "データベースに接続できませんでした。"}), 500
 
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor()
     
     try:
         # 募集人数に関するカラムの取得を削除済み
+        # status はHTML側のJSで使われる値 ('published', 'draft', 'closed') に、
+        # 日付は 'YYYY-MM-DD' の文字列 (未設定の場合は空文字) に SQL で変換する
         cursor.execute("""
             SELECT 
                 r.recruitment_id AS id, 
                 r.title, 
-                r.start_date AS date,     -- 募集開始日を活動日(date)として表示
-                r.end_date AS deadline,   -- 募集終了日を締切日(deadline)として表示
-                r.status,                 -- DBのステータス (Draft, Open, Closed)
-                COUNT(a.application_id) AS applied_count -- 応募レコードの総数
+                COALESCE(to_char(r.start_date, 'YYYY-MM-DD'), '') AS date,   -- 募集開始日を活動日(date)として表示
+                COALESCE(to_char(r.end_date, 'YYYY-MM-DD'), '') AS deadline, -- 募集終了日を締切日(deadline)として表示
+                CASE r.status                                                -- DBのステータス (Draft, Open, Closed)
+                    WHEN 'Open' THEN 'published'
+                    WHEN 'Draft' THEN 'draft'
+                    WHEN 'Closed' THEN 'closed'
+                    ELSE r.status
+                END AS status,
+                -- 枠を持つ応募 (Pending, Approved) の数。募集人数と並べて表示するため、キャンセル待ちは別に数える
+                (SELECT COUNT(*) FROM Applications a
+                 WHERE a.recruitment_id = r.recruitment_id AND a.status = ANY(%s::application_status[])) AS applied_count,
+                (SELECT COUNT(*) FROM Applications a
+                 WHERE a.recruitment_id = r.recruitment_id AND a.status = 'Waitlisted') AS waitlisted_count,
+                r.capacity                                -- 募集人数 (NULL は人数制限なし)
             FROM Recruitments r
-            LEFT JOIN Applications a ON r.recruitment_id = a.recruitment_id
             WHERE r.organization_id = %s -- ログインしている職員の組織IDで絞り込み
-            GROUP BY r.recruitment_id, r.title, r.start_date, r.end_date, r.status 
             ORDER BY r.end_date DESC
-        """, (org_id,))
-        
-        opportunities = [dict(row) for row in cursor.fetchall()]
-
-        # HTML側のJSで使われる status の値に変換 ('published', 'draft', 'closed')
-        # DBの status: 'Draft', 'Open', 'Closed'
-        for op in opportunities:
-
-            if op['status'] == 'Open':
-                op['status'] = 'published'
-            elif op['status'] == 'Draft':
-                op['status'] = 'draft'
-            elif op['status'] == 'Closed':
-                op['status'] = 'closed'
-            # 日付オブジェクトを文字列に変換 (HTML側で表示するため)
-            op['date'] = op['date'].isoformat() if op['date'] else ''
-            op['deadline'] = op['deadline'].isoformat() if op['deadline'] else ''
-
-        
+        """, (list(seats.SEAT_HOLDING_STATUSES), org_id))
+        return rows_response(cursor)
     except psycopg2.Error as err:
         print(f"クエリエラー: {err}")
         return jsonify({"error": f"募集案件の取得に失敗しました: {err}"}), 500
@@ -1794,8 +2734,6 @@ def get_staff_opportunities():
         cursor.close()
         conn.close()
 
-    return jsonify(opportunities)
-
 
 @app.route("/staff/user/edit/<string:username>", methods=['GET', 'POST'])
 def staff_user_edit(username):
@@ -1881,7 +2819,8 @@ def get_staff_opportunity_detail(recruitment_id):
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     try:
-        # 1. 案件詳細を取得
+        # 案件詳細・選択中のカテゴリーID・応募者数を1回のクエリで取得
+        # (応募者数は枠を持つ応募 (Pending, Approved) の数で、募集人数と比べられる。キャンセル待ちは別に数える)
         cursor.execute("""
             SELECT 
                 r.recruitment_id AS id, 
@@ -1892,10 +2831,19 @@ def get_staff_opportunity_detail(recruitment_id):
                 r.contact_phone_number AS phone_number,
                 r.contact_email AS email,
                 r.status,
-                (SELECT COUNT(*) FROM Applications a WHERE a.recruitment_id = r.recruitment_id) AS applied_count
+                r.capacity AS required_count,
+                (SELECT COUNT(*) FROM Applications a
+                 WHERE a.recruitment_id = r.recruitment_id AND a.status = ANY(%s::application_status[])) AS applied_count,
+                (SELECT COUNT(*) FROM Applications a
+                 WHERE a.recruitment_id = r.recruitment_id AND a.status = 'Waitlisted') AS waitlisted_count,
+                ARRAY(
+                    SELECT rcm.category_id FROM RecruitmentCategoryMap rcm
+                    WHERE rcm.recruitment_id = r.recruitment_id
+                    ORDER BY rcm.category_id
+                ) AS categories
             FROM Recruitments r
             WHERE r.recruitment_id = %s AND r.organization_id = %s
-        """, (recruitment_id, org_id))
+        """, (list(seats.SEAT_HOLDING_STATUSES), recruitment_id, org_id))
         
         opportunity = cursor.fetchone()
 
@@ -1906,18 +2854,9 @@ def get_staff_opportunity_detail(recruitment_id):
         # 日付オブジェクトをISO形式の文字列に変換
         opportunity['activity_date'] = opportunity['activity_date'].isoformat() if opportunity['activity_date'] else ''
         opportunity['deadline'] = opportunity['deadline'].isoformat() if opportunity['deadline'] else ''
-        
-        # 2. 案件に紐づくカテゴリーIDを取得
-        cursor.execute("""
-            SELECT category_id FROM RecruitmentCategoryMap WHERE recruitment_id = %s
-        """, (recruitment_id,))
-        
-        selected_categories = [row['category_id'] for row in cursor.fetchall()]
-        
-        # 3. 全カテゴリー情報を取得
-        cursor.execute("SELECT category_id, category_name FROM RecruitmentCategories ORDER BY category_id")
-        # Explicitly convert all_categories to a list of dictionaries
-        all_categories = [dict(row) for row in cursor.fetchall()]
+
+        # 全カテゴリー情報はワーカー内のキャッシュから取得 (キャッシュがない時だけクエリを実行)
+        all_categories = get_reference_data(cursor, 'categories')
 
     except psycopg2.Error as err:
         print(f"クエリエラー: {err}")
@@ -1928,13 +2867,11 @@ def get_staff_opportunity_detail(recruitment_id):
 
     # Convert DictRow to a regular dictionary to add new keys
     opportunity_dict = dict(opportunity)
-    opportunity_dict['categories'] = selected_categories
     
     # HTML側のJSで使われる time_frame を暫定的に空文字として追加 (スキーマ変更対応)
     opportunity_dict['time_frame'] = '' 
-    # HTML側のJSで使われる required_count, location, required_skills の代替値 (スキーマ変更対応)
+    # HTML側のJSで使われる location, required_skills の代替値 (スキーマ変更対応)
     # SQLでSELECTしていないため、ここで明示的にキーを追加し、暫定値を設定する
-    opportunity_dict['required_count'] = 1
     opportunity_dict['location'] = '未指定'
     opportunity_dict['required_skills'] = '特になし'
 
@@ -1945,6 +2882,7 @@ def get_staff_opportunity_detail(recruitment_id):
 
 @app.route('/staff/opportunity/bulk_upload', methods=['POST'])
 @login_required
+@statement_timeout(15000)
 def bulk_upload_opportunities():
     """
     CSVファイルを受け取り、募集情報を一括でデータベースに登録します。
@@ -1977,8 +2915,7 @@ def bulk_upload_opportunities():
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
             # 事前に全カテゴリをメモリに読み込む
-            cursor.execute("SELECT category_id, category_name FROM RecruitmentCategories")
-            category_map = {row['category_name'].strip(): row['category_id'] for row in cursor.fetchall()}
+            category_map = {row['category_name'].strip(): row['category_id'] for row in get_reference_data(cursor, 'categories')}
 
             # ファイルストリームをデコード
             try:
@@ -2042,6 +2979,9 @@ def bulk_upload_opportunities():
                                 "INSERT INTO RecruitmentCategoryMap (recruitment_id, category_id) VALUES %s",
                                 insert_values
                             )
+                            # 公開した募集の通知は、1人1通にまとめて送る (NOTIFICATION_MODE の説明を参照)
+                            if status == 'Open':
+                                queue_recruitment_notification(cursor, recruitment_id)
                     
                     conn.commit()
                     success_count += 1
@@ -2072,23 +3012,12 @@ def get_recruitment_applicants(rec_id):
     sort_by = request.args.get('sort_by', 'application_date')
     sort_order = request.args.get('sort_order', 'desc')
 
-    # Whitelist for sortable columns and their corresponding SQL expressions
-    sortable_columns = {
-        'application_date': 'a.application_date',
-        'full_name': 'v.full_name',
-        'status': 'a.status'
-    }
-    
-    # Whitelist for sort orders
-    sort_orders = {
-        'asc': 'ASC',
-        'desc': 'DESC'
-    }
-
     # Default to application_date if invalid column is provided
-    order_by_column = sortable_columns.get(sort_by, 'a.application_date')
+    if sort_by not in APPLICANT_SORT_COLUMNS:
+        sort_by = 'application_date'
     # Default to DESC if invalid order is provided
-    order_direction = sort_orders.get(sort_order, 'DESC')
+    if sort_order not in APPLICANT_SORT_ORDERS:
+        sort_order = 'desc'
 
     org_id = session.get('org_id')
     conn = get_db_connection()
@@ -2097,23 +3026,13 @@ def get_recruitment_applicants(rec_id):
 
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     try:
-        # 案件が本当にこの組織に属しているか確認（セキュリティのため）
-        cursor.execute("SELECT organization_id FROM Recruitments WHERE recruitment_id = %s", (rec_id,))
-        recruitment = cursor.fetchone()
-        if not recruitment or recruitment['organization_id'] != org_id:
+        # 応募者情報を取得 (案件の所有の確認も同じクエリで行う。APPLICANT_SORT_COLUMNS の登録箇所を参照)
+        prepared_queries.execute(cursor, f"recruitment_applicants_{sort_by}_{sort_order}", (rec_id, org_id))
+        rows = cursor.fetchall()
+        if not rows:
             return jsonify({"error": "案件が見つからないか、アクセス権がありません。"}), 404
 
-        # 応募者情報を取得
-        query = f"""
-            SELECT a.application_id, v.full_name, v.email, a.status
-            FROM Applications a
-            JOIN Volunteers v ON a.volunteer_id = v.volunteer_id
-            WHERE a.recruitment_id = %s
-            ORDER BY {order_by_column} {order_direction}
-        """
-        cursor.execute(query, (rec_id,))
-        
-        applicants = [dict(row) for row in cursor.fetchall()]
+        applicants = [dict(row) for row in rows if row['application_id'] is not None]
         
     except psycopg2.Error as err:
         print(f"応募者情報の取得エラー: {err}")
@@ -2136,6 +3055,10 @@ def batch_approve_applications():
 
     if not application_ids or not isinstance(application_ids, list) or len(application_ids) == 0:
         return jsonify({"success": False, "message": "無効なリクエストです。応募者IDのリストが必要です。"}), 400
+    try:
+        requested_ids = sorted({int(app_id) for app_id in application_ids})
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "無効なリクエストです。応募者IDは整数で指定してください。"}), 400
 
     conn = get_db_connection()
     if conn is None:
@@ -2143,38 +3066,39 @@ def batch_approve_applications():
 
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     try:
-        # --- セキュリティチェック ---
-        # 承認しようとしている応募が、本当にログイン中の職員の組織に属しているかを確認
-        ids_tuple = tuple(application_ids)
-        
-        # 渡されたIDのリストから、ログイン中の組織に属するIDだけを抽出
+
+        # --- セキュリティチェックとステータス更新を1回のクエリで行う ---
+        # owned: 渡されたIDのうち、ログイン中の組織に属する応募
+        # 権限のない応募が1件でも含まれている場合は、どの応募も更新しない
         cursor.execute("""
-            SELECT a.application_id
-            FROM Applications a
-            JOIN Recruitments r ON a.recruitment_id = r.recruitment_id
-            WHERE r.organization_id = %s AND a.application_id IN %s
-        """, (org_id, ids_tuple))
-        
-        valid_ids_rows = cursor.fetchall()
-        valid_ids = [row['application_id'] for row in valid_ids_rows]
+            WITH owned AS (
+                SELECT a.application_id
+                FROM Applications a
+                JOIN Recruitments r ON a.recruitment_id = r.recruitment_id
+                WHERE r.organization_id = %(org_id)s AND a.application_id = ANY(%(ids)s)
+            ), updated AS (
+                UPDATE Applications
+                SET status = 'Approved'
+                WHERE application_id IN (SELECT application_id FROM owned)
+                  AND status = 'Pending'
+                  AND (SELECT COUNT(*) FROM owned) = %(requested)s
+                RETURNING application_id
+            )
+            SELECT (SELECT COUNT(*) FROM owned) AS owned_count, (SELECT COUNT(*) FROM updated) AS updated_count
+        """, {'org_id': org_id, 'ids': requested_ids, 'requested': len(requested_ids)})
+        result = cursor.fetchone()
 
-        if len(valid_ids) != len(application_ids):
+        if result['owned_count'] != len(requested_ids):
             # リクエストされたIDの中に、権限のないIDが含まれている
+            conn.rollback()
             return jsonify({"success": False, "message": "権限のない応募が含まれています。"}), 403
-        
-        if not valid_ids:
+
+        if result['owned_count'] == 0:
             # 有効なIDが一つもなかった
+            conn.rollback()
             return jsonify({"success": False, "message": "承認対象の応募が見つかりません。"}), 404
 
-        # --- ステータス更新 ---
-        # 有効なIDのみを対象に更新
-        valid_ids_tuple = tuple(valid_ids)
-        cursor.execute(
-            "UPDATE Applications SET status = 'Approved' WHERE application_id IN %s AND status = 'Pending'",
-            (valid_ids_tuple,)
-        )
-        
-        updated_rows = cursor.rowcount
+        updated_rows = result['updated_count']
         conn.commit()
 
         return jsonify({"success": True, "message": f"{updated_rows}件の応募を承認しました。"})
@@ -2187,6 +3111,20 @@ def batch_approve_applications():
         cursor.close()
         conn.close()
 
+# 新着募集の通知方法 (環境変数 NOTIFICATION_MODE)
+#   immediate: 募集が公開されるたびに、興味のあるユーザーへすぐにメールを送る (既定)
+#   digest   : 公開された募集を PendingRecruitmentNotifications に溜めておき、
+#              jobs.py の send_notification_digests で1人1通にまとめて送る
+# 一括登録 (bulk_upload_opportunities) で公開した募集は、大量のメールにならないよう常にまとめて送ります。
+NOTIFICATION_MODE = os.getenv("NOTIFICATION_MODE", "immediate").lower()
+
+def queue_recruitment_notification(cursor, recruitment_id):
+    """募集をまとめて通知する対象に加えます (呼び出し元のトランザクションで確定します)。"""
+    cursor.execute(
+        "INSERT INTO PendingRecruitmentNotifications (recruitment_id) VALUES (%s) ON CONFLICT (recruitment_id) DO NOTHING",
+        (recruitment_id,)
+    )
+
 def send_new_recruitment_notifications(app, recruitment_id, category_ids):
     """新しい募集が登録されたことを興味のあるユーザーにメールで通知する"""
     # 修正: test_request_contextを使用して、URL生成に必要なリクエストコンテキストを作成する
@@ -2194,6 +3132,7 @@ def send_new_recruitment_notifications(app, recruitment_id, category_ids):
         if not category_ids:
             return
 
+        from flask_mail import Message
         conn = get_db_connection()
         if conn is None:
             print("通知メール送信のためのDB接続に失敗しました。")
@@ -2249,7 +3188,7 @@ def send_new_recruitment_notifications(app, recruitment_id, category_ids):
 今後とも地域支援Hubをよろしくお願いいたします。
 """
                 msg = Message(subject, sender=app.config['MAIL_USERNAME'], recipients=[user['email']], body=body)
-                mail.send(msg)
+                get_mail().send(msg)
                 print(f"通知メールを {user['email']} に送信しました。")
 
         except Exception as e:
@@ -2258,6 +3197,55 @@ def send_new_recruitment_notifications(app, recruitment_id, category_ids):
             cursor.close()
             conn.close()
 
+def sync_recruitment_categories(cursor, recruitment_id, category_ids):
+    """
+    募集に紐づくカテゴリーを category_ids と一致させます。
+    不要になった紐付けの削除と新しい紐付けの追加を1つの文で行い、(追加したID, 削除したID) を返します。
+    変更のない紐付けには触れないため、カテゴリー数に関係なく往復は1回です。
+    """
+    # DBに渡すcategory_idは文字列ではなく数値である必要があるため、int()で型変換
+    category_ids = sorted({int(cat_id) for cat_id in category_ids})
+    cursor.execute("""
+        WITH removed AS (
+            DELETE FROM RecruitmentCategoryMap
+            WHERE recruitment_id = %(recruitment_id)s AND category_id <> ALL(%(category_ids)s::int[])
+            RETURNING category_id
+        ), added AS (
+            INSERT INTO RecruitmentCategoryMap (recruitment_id, category_id)
+            SELECT %(recruitment_id)s, unnest(%(category_ids)s::int[])
+            ON CONFLICT (recruitment_id, category_id) DO NOTHING
+            RETURNING category_id
+        )
+        SELECT
+            ARRAY(SELECT category_id FROM added ORDER BY category_id),
+            ARRAY(SELECT category_id FROM removed ORDER BY category_id)
+    """, {'recruitment_id': recruitment_id, 'category_ids': category_ids})
+    added, removed = cursor.fetchone()
+    return added, removed
+
+def parse_capacity(value):
+    """フォームの募集人数 (required_count) を整数にします。空欄は None (人数制限なし)、1未満や数値以外は ValueError です。"""
+    if value is None or value == '':
+        return None
+    capacity = int(value)
+    if capacity < 1:
+        raise ValueError(capacity)
+    return capacity
+
+def set_recruitment_location(cursor, recruitment_id, postal_code):
+    """
+    募集の活動場所の郵便番号を保存し、PostalCodes の位置 (緯度・経度・geohash) をコピーします。
+    郵便番号が空または PostalCodes にない場合、位置は NULL になり、近くの募集の検索には表示されません。
+    """
+    postal_code = geo.normalize_postal_code(postal_code)
+    cursor.execute("""
+        UPDATE Recruitments SET
+            postal_code = %s,
+            (latitude, longitude, geohash) = (
+                SELECT latitude, longitude, geohash FROM PostalCodes WHERE postal_code = %s
+            )
+        WHERE recruitment_id = %s
+    """, (postal_code, postal_code, recruitment_id))
 
 @app.route('/staff/api/opportunities', methods=['POST'])
 def staff_api_create_opportunity():
@@ -2276,6 +3264,11 @@ def staff_api_create_opportunity():
     if not all(field in data and data[field] for field in required_fields):
         # required_count は数値0も許容したい場合は調整が必要ですが、ここでは必須項目とします。
         return jsonify({"error": "必須項目が不足しているか、空です。"}), 400
+
+    try:
+        capacity = parse_capacity(data.get('required_count'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "募集人数は1以上の整数で入力してください。"}), 400
     
     # HTML: 'published', 'draft' -> DB: 'Open', 'Draft'
     db_status = data['status']
@@ -2320,15 +3313,25 @@ def staff_api_create_opportunity():
         # 2. カテゴリーの紐付け (RecruitmentCategoryMap)
         selected_categories = data.get('categories', [])
         if selected_categories:
-            insert_map_query = "INSERT INTO RecruitmentCategoryMap (recruitment_id, category_id) VALUES (%s, %s)"
-            # DBに渡すcategory_idは文字列ではなく数値である必要があるため、int()で型変換
-            category_values = [(new_recruitment_id, int(cat_id)) for cat_id in selected_categories]
-            cursor.executemany(insert_map_query, category_values)
+            sync_recruitment_categories(cursor, new_recruitment_id, selected_categories)
+
+        # 活動場所の郵便番号 (オプション。近くの募集の検索に使う)
+        if data.get('postal_code'):
+            set_recruitment_location(cursor, new_recruitment_id, data['postal_code'])
+
+        # 募集人数 (オプション。空欄の場合は人数制限なし)
+        if capacity is not None:
+            seats.set_capacity(cursor, new_recruitment_id, capacity)
+
+        # 3. メール通知 (公開の場合のみ。まとめて送る設定なら、募集と同じトランザクションで通知待ちに加える)
+        notify = db_status == 'Open' and selected_categories
+        if notify and NOTIFICATION_MODE == 'digest':
+            queue_recruitment_notification(cursor, new_recruitment_id)
         
         conn.commit()
 
-        # 3. メール通知 (公開の場合のみ、バックグラウンドで実行)
-        if db_status == 'Open' and selected_categories:
+        # すぐに送る設定の場合は、バックグラウンドで送信する
+        if notify and NOTIFICATION_MODE != 'digest':
             thread = threading.Thread(target=send_new_recruitment_notifications, args=(app, new_recruitment_id, selected_categories))
             thread.start()
 
@@ -2368,6 +3371,11 @@ def staff_api_update_opportunity(recruitment_id):
     if not all(field in data and data[field] for field in required_fields):
         return jsonify({"error": "必須項目が不足しているか、空です。"}), 400
 
+    try:
+        capacity = parse_capacity(data.get('required_count'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "募集人数は1以上の整数で入力してください。"}), 400
+
     # HTML側のJSで使われる status の値に変換
     # HTML: 'published', 'draft', 'closed' -> DB: 'Open', 'Draft', 'Closed'
     db_status = data['status']
@@ -2414,18 +3422,16 @@ def staff_api_update_opportunity(recruitment_id):
             conn.rollback()
             return jsonify({"error": "案件が見つからないか、更新する権限がありません。"}), 403
 
-        # 2. カテゴリーの更新 (RecruitmentCategoryMapを一度クリアし、再挿入する)
-        
-        # 既存のカテゴリーを削除
-        cursor.execute("DELETE FROM RecruitmentCategoryMap WHERE recruitment_id = %s", (recruitment_id,))
-        
-        # 新しいカテゴリーを挿入
-        selected_categories = data.get('categories', [])
-        if selected_categories:
-            insert_map_query = "INSERT INTO RecruitmentCategoryMap (recruitment_id, category_id) VALUES (%s, %s)"
-            # DBに渡すcategory_idは文字列ではなく数値である必要があるため、int()で型変換
-            category_values = [(recruitment_id, int(cat_id)) for cat_id in selected_categories]
-            cursor.executemany(insert_map_query, category_values)
+        # 2. カテゴリーの更新 (差分だけを削除・追加する)
+        sync_recruitment_categories(cursor, recruitment_id, data.get('categories', []))
+
+        # 3. 活動場所の郵便番号 (送られた場合のみ更新する)
+        if 'postal_code' in data:
+            set_recruitment_location(cursor, recruitment_id, data['postal_code'])
+
+        # 4. 募集人数 (送られた場合のみ更新する。増やした場合はキャンセル待ちが繰り上がる)
+        if 'required_count' in data:
+            seats.set_capacity(cursor, recruitment_id, capacity)
         
         conn.commit()
         return jsonify({"message": f"案件ID: {recruitment_id} が正常に更新されました。"}, 200)
@@ -2443,8 +3449,101 @@ def staff_api_update_opportunity(recruitment_id):
             cursor.close()
             conn.close()
 
+# リサイズ版は元画像と同じディスクで作成する必要があるため、scheduler.py の worker ではなく、
+# アップロードを受け付けたWebプロセスのバックグラウンドのスレッドで generate_upload_variants を実行します。
+# スレッドはプロセスごとに1つで、実行中に受け付けたアップロードも処理してから終了します。
+_upload_variants_lock = threading.Lock()
+_upload_variants_pending = False
+_upload_variants_thread = None
+
+def run_upload_variants():
+    """リサイズ版のない画像がなくなるまで generate_upload_variants を実行します。"""
+    global _upload_variants_pending, _upload_variants_thread
+    import jobs
+
+    while True:
+        with _upload_variants_lock:
+            if not _upload_variants_pending:
+                _upload_variants_thread = None
+                return
+            _upload_variants_pending = False
+        # リクエストの接続プールの枠を使わないよう、専用の接続で実行する
+        try:
+            conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+        except psycopg2.Error as err:
+            print(f"リサイズ版の作成用の接続に失敗しました: {err}")
+            continue
+        try:
+            print(jobs.generate_upload_variants(conn))
+        except Exception as e:
+            print(f"リサイズ版の作成に失敗しました: {e}")
+        finally:
+            conn.close()
+
+def start_upload_variants():
+    """このプロセスでリサイズ版の作成を始めます (実行中の場合は、終了前にもう一度確認させます)。"""
+    global _upload_variants_pending, _upload_variants_thread
+    with _upload_variants_lock:
+        _upload_variants_pending = True
+        if _upload_variants_thread is None:
+            _upload_variants_thread = threading.Thread(target=run_upload_variants, name="upload-variants", daemon=True)
+            _upload_variants_thread.start()
+
+@app.route('/staff/api/opportunities/<int:recruitment_id>/image', methods=['POST'])
+def staff_api_upload_opportunity_image(recruitment_id):
+    """
+    募集案件の画像をアップロードします。
+    同じ画像が既に保存されている場合は再利用し、リサイズ版はこのプロセスのバックグラウンドで作成されます。
+    """
+    if not check_org_login():
+        return jsonify({"error": "認証が必要です"}), 401
+
+    file = request.files.get('image')
+    if file is None or file.filename == '':
+        return jsonify({"error": "画像ファイルを選択してください。"}), 400
+
+    org_id = session.get('org_id')
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "データベースに接続できませんでした。"}), 500
+
+    cursor = conn.cursor()
+    try:
+        # 所有権は画像を保存する前に確認する (権限のないリクエストのファイルをディスクに残さない)
+        cursor.execute(
+            "SELECT 1 FROM Recruitments WHERE recruitment_id = %s AND organization_id = %s FOR NO KEY UPDATE",
+            (recruitment_id, org_id)
+        )
+        if cursor.fetchone() is None:
+            conn.rollback()
+            return jsonify({"error": "案件が見つからないか、更新する権限がありません。"}), 403
+        content_hash = uploads.save_upload(cursor, file)
+        cursor.execute(
+            "UPDATE Recruitments SET image_hash = %s WHERE recruitment_id = %s",
+            (content_hash, recruitment_id)
+        )
+        conn.commit()
+        start_upload_variants()
+        return jsonify({
+            "message": "画像を登録しました。",
+            "image_hash": content_hash,
+            "image_url": uploads.media_url(content_hash),
+        })
+    except uploads.UploadError as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 400
+    except psycopg2.Error as err:
+        conn.rollback()
+        print(f"画像登録クエリエラー: {err}")
+        return jsonify({"error": f"画像の登録中にデータベースエラーが発生しました: {err}"}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
 @app.route("/staff/applications")
 @login_required
+@read_only
+@statement_timeout(3000)
 def staff_applications_list():
     """職員向けの応募者一覧ページ。組織全体の応募者を一覧表示する。"""
     if not check_org_login():
@@ -2606,29 +3705,31 @@ def get_staff_applications_by_recruitment(recruitment_id):
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     try:
-        # 案件の所有権を確認
-        cursor.execute("SELECT title FROM Recruitments WHERE recruitment_id = %s AND organization_id = %s", (recruitment_id, org_id))
-        recruitment = cursor.fetchone()
-        if not recruitment:
-            return jsonify({"error": "案件が見つからないか、アクセス権がありません。"}), 403
-
-        # 応募者情報を取得
+        # 案件タイトルと応募者情報を取得 (案件の所有権の確認も同じクエリで行う)
         cursor.execute("""
             SELECT 
+                r.title AS recruitment_title,
                 a.application_id AS id,
                 v.full_name AS name,
                 v.email,
                 a.status
-            FROM Applications a
-            JOIN Volunteers v ON a.volunteer_id = v.volunteer_id
-            WHERE a.recruitment_id = %s
+            FROM Recruitments r
+            LEFT JOIN Applications a ON a.recruitment_id = r.recruitment_id
+            LEFT JOIN Volunteers v ON a.volunteer_id = v.volunteer_id
+            WHERE r.recruitment_id = %s AND r.organization_id = %s
             ORDER BY a.application_date DESC
-        """, (recruitment_id,))
-        
-        applications = [dict(row) for row in cursor.fetchall()]
+        """, (recruitment_id, org_id))
+        rows = cursor.fetchall()
+        if not rows:
+            return jsonify({"error": "案件が見つからないか、アクセス権がありません。"}), 403
+
+        applications = [
+            {'id': row['id'], 'name': row['name'], 'email': row['email'], 'status': row['status']}
+            for row in rows if row['id'] is not None
+        ]
         
         return jsonify({
-            "recruitment_title": recruitment['title'],
+            "recruitment_title": rows[0]['recruitment_title'],
             "applications": applications
         })
 
@@ -2804,6 +3905,14 @@ def delete_user_data(user_id):
     
     try:
         # 1. 関連テーブルのレコードを削除 (Applications)
+        # 枠を持つ応募は seats.cancel で取り消し、枠をキャンセル待ちの先頭に引き継ぐ (いなければ空き枠に戻す)
+        cursor.execute(
+            "SELECT application_id FROM Applications WHERE volunteer_id = %s AND status = ANY(%s::application_status[]) "
+            "ORDER BY application_id",
+            (user_id, list(seats.SEAT_HOLDING_STATUSES))
+        )
+        for (application_id,) in cursor.fetchall():
+            seats.cancel(cursor, application_id, user_id)
         cursor.execute("DELETE FROM Applications WHERE volunteer_id = %s", (user_id,))
         
         # 2. 関連テーブルのレコードを削除 (VolunteerCategoryInterests)
@@ -0,0 +1,356 @@
+# session_store.py
+#
+# サーバー側セッションの保存先をまとめたモジュールです。
+# CookieにはランダムなセッションIDだけを入れ、セッションの中身 (volunteer_id や org_id など) は
+# 保存先に置くため、gunicornのワーカーが再起動しても、別のワーカーにリクエストが届いてもセッションが維持されます。
+#
+# 保存先は環境変数 SESSION_BACKEND で切り替えます。
+#   postgres : Sessions テーブル (既定)
+#   file     : ローカルディレクトリ (同じマシン上のワーカー間で共有)
+#   redis    : Redis (SESSION_REDIS_URL。redisパッケージが必要)
+#   memory   : プロセス内の辞書 (開発用。ワーカー間では共有されない)
+#
+# どの保存先も Redis と同じ get(key) / setex(key, seconds, value) / delete(key) を実装するため、
+# redis.Redis のクライアントをそのまま保存先として使えます。
+#
+# 保存先の障害 (データベースの停止など) ではリクエストをエラーにせず、ログインしていないセッションとして扱います。
+# その間はセッションを保存せず、Cookieも変更しません。
+
+import copy
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class MemorySessionStore:
+    """プロセス内の辞書に保存する保存先 (Redisの代わりに使える最小限の実装)"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self.delete(key)
+            return None
+        return entry[1]
+
+    def setex(self, key, seconds, value):
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            self._data[key] = (time.time() + seconds, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class FileSessionStore:
+    """ローカルディレクトリに1セッション1ファイルで保存する保存先"""
+
+    def __init__(self, directory):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        # キーをそのままファイル名にしないよう、ハッシュ化する
+        return os.path.join(self._directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at, _, value = f.read().partition(b'\n')
+        except OSError:
+            return None
+        if float(expires_at) < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def setex(self, key, seconds, value):
+        if isinstance(value, str):
+            value = value.encode()
+        path = self._path(key)
+        # 書き込み途中のファイルを他のワーカーが読まないよう、一時ファイルから置き換える
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, 'wb') as f:
+            f.write(f"{time.time() + seconds}\n".encode() + value)
+        os.replace(temp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def purge_expired(self):
+        """期限切れのセッションファイルを削除し、削除件数を返します。"""
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    expires_at = float(f.readline())
+            except (OSError, ValueError):
+                continue
+            if expires_at < now:
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+class SessionStoreError(RuntimeError):
+    """セッションの保存先を使えない場合のエラー"""
+
+
+class PostgresSessionStore:
+    """Sessions テーブルに保存する保存先。connect は接続を返す関数 (server.get_db_connection など)"""
+
+    def __init__(self, connect):
+        self._connect = connect
+
+    def _execute(self, query, params, fetch=False):
+        conn = self._connect()
+        if conn is None:
+            raise SessionStoreError("セッション用のデータベースに接続できませんでした。")
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            row = cursor.fetchone() if fetch else None
+            conn.commit()
+            return row
+        finally:
+            cursor.close()
+            conn.close()
+
+    def get(self, key):
+        row = self._execute(
+            "SELECT data FROM Sessions WHERE session_id = %s AND expires_at > NOW()",
+            (key,), fetch=True
+        )
+        return bytes(row[0]) if row else None
+
+    def setex(self, key, seconds, value):
+        if isinstance(value, str):
+            value = value.encode()
+        self._execute("""
+            INSERT INTO Sessions (session_id, data, expires_at)
+            VALUES (%s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (session_id) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+        """, (key, value, seconds))
+
+    def delete(self, key):
+        self._execute("DELETE FROM Sessions WHERE session_id = %s", (key,))
+
+
+class CachedSessionStore:
+    """
+    よく使われるセッションをプロセス内にキャッシュする保存先のラッパー。
+    書き込みと削除は保存先へそのまま反映し、読み込みは ttl 秒間キャッシュから返します。
+    (別のワーカーでの変更は、このワーカーの読み込みには最大 ttl 秒遅れて反映されます。
+    書き込む時は get_uncached で最新の内容を読み直すため、古いキャッシュで上書きすることはありません)
+    """
+
+    def __init__(self, store, ttl, max_entries):
+        self._store = store
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return entry[1]
+        return self.get_uncached(key)
+
+    def get_uncached(self, key):
+        """キャッシュを使わずに保存先から読み込みます (読み込んだ内容でキャッシュを更新します)。"""
+        value = self._store.get(key)
+        if value is None:
+            with self._lock:
+                self._cache.pop(key, None)
+        else:
+            self._remember(key, value)
+        return value
+
+    def setex(self, key, seconds, value):
+        self._store.setex(key, seconds, value)
+        self._remember(key, value if isinstance(value, bytes) else value.encode())
+
+    def delete(self, key):
+        self._store.delete(key)
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def _remember(self, key, value):
+        if self._ttl <= 0:
+            return
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self._ttl, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+
+
+def create_session_store(connect, backend=None):
+    """設定 (環境変数) に応じた保存先を生成します。"""
+    backend = (backend or os.getenv("SESSION_BACKEND", "postgres")).lower()
+    if backend == 'postgres':
+        store = PostgresSessionStore(connect)
+    elif backend == 'file':
+        store = FileSessionStore(os.getenv("SESSION_FILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "flask_session")))
+    elif backend == 'redis':
+        # redisパッケージはこの保存先を使う時だけ必要
+        import redis
+        store = redis.Redis.from_url(os.environ["SESSION_REDIS_URL"])
+    elif backend == 'memory':
+        return MemorySessionStore()
+    else:
+        raise ValueError(f"未知のセッション保存先です: {backend} (使用可能: postgres, file, redis, memory)")
+
+    return CachedSessionStore(
+        store,
+        ttl=int(os.getenv("SESSION_CACHE_SECONDS", "2")),
+        max_entries=int(os.getenv("SESSION_CACHE_SIZE", "1000")),
+    )
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """サーバー側に保存されるセッション。変更されたかどうかを記録します。"""
+
+    def __init__(self, initial=None, sid=None, saved_at=None, unavailable=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.saved_at = saved_at
+        self.modified = False
+        # 保存時に、このリクエストで変更したキーだけを保存先の最新の内容に反映するため、読み込んだ時の内容を残す
+        self.loaded = copy.deepcopy(dict(self))
+        self.regenerated = False
+        # 保存先の障害で読み込めなかったセッション (保存しない)
+        self.unavailable = unavailable
+
+    def regenerate(self):
+        """ログイン・ログアウトなどで権限が変わる時に呼び出し、保存時に新しいセッションIDを発行します (セッション固定化対策)。"""
+        self.regenerated = True
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    CookieにはセッションIDだけを保存し、中身は保存先に置くセッションインターフェース。
+    変更がないリクエストでは保存先へ書き込みません (有効期限の延長は期間の半分を過ぎた時だけ行います)。
+    """
+
+    serializer = TaggedJSONSerializer()
+    key_prefix = "session:"
+
+    def __init__(self, store, lifetime_seconds):
+        self.store = store
+        self.lifetime_seconds = lifetime_seconds
+
+    def _load(self, raw):
+        """保存先の値を (セッションの内容, 保存時刻) に変換します。壊れている場合は None を返します。"""
+        try:
+            payload = self.serializer.loads(raw.decode())
+            return payload['data'], payload['saved_at']
+        except (ValueError, KeyError):
+            return None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                raw = self.store.get(self.key_prefix + sid)
+            except Exception as e:
+                # 保存先の障害ではエラーにせず、ログインしていないセッションとして扱う
+                print(f"セッションの読み込みに失敗しました: {e}")
+                return ServerSideSession(sid=sid, unavailable=True)
+            loaded = self._load(raw) if raw is not None else None
+            if loaded is not None:
+                return ServerSideSession(loaded[0], sid=sid, saved_at=loaded[1])
+        # 保存先にないIDは受け付けず、保存時に新しいIDを発行する (セッション固定化対策)
+        return ServerSideSession()
+
+    def _merge_with_stored(self, session):
+        """
+        このリクエストで変更したキーを、保存先の最新の内容に反映したものを返します。
+        他のリクエスト (他のワーカー) がその間に変更したキーを、読み込んだ時の古い内容で上書きしないためです。
+        保存先から削除されていた場合 (他の画面でログアウトした場合など) は None を返します。
+        """
+        get_uncached = getattr(self.store, 'get_uncached', self.store.get)
+        raw = get_uncached(self.key_prefix + session.sid)
+        loaded = self._load(raw) if raw is not None else None
+        if loaded is None:
+            return None
+        data = loaded[0]
+        for key in session.loaded.keys() - session.keys():
+            data.pop(key, None)
+        for key, value in session.items():
+            if key not in session.loaded or session.loaded[key] != value:
+                data[key] = value
+        return data
+
+    def save_session(self, app, session, response):
+        # open_session の前に失敗したリクエストでは session が None になる
+        if session is None or session.unavailable:
+            return
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        try:
+            self._save(app, session, response, cookie_name, domain, path)
+        except Exception as e:
+            # 保存に失敗してもリクエストはエラーにしない (Cookieは変更しない)
+            print(f"セッションの保存に失敗しました: {e}")
+
+    def _save(self, app, session, response, cookie_name, domain, path):
+        if not session:
+            if session.modified and session.sid:
+                self.store.delete(self.key_prefix + session.sid)
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+        if session.regenerated and session.sid:
+            # 権限が変わったので、古いIDのセッションを削除して新しいIDで保存する
+            self.store.delete(self.key_prefix + session.sid)
+            session.sid = None
+        now = time.time()
+        if not session.modified and now - session.saved_at < self.lifetime_seconds / 2:
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+            data = dict(session)
+        else:
+            data = self._merge_with_stored(session)
+            if data is None:
+                # 削除されたセッションは復活させない (Cookieは、同時に発行された新しいIDを消さないよう変更しない)
+                return
+        payload = {'data': data, 'saved_at': now}
+        self.store.setex(self.key_prefix + session.sid, self.lifetime_seconds, self.serializer.dumps(payload))
+        response.set_cookie(
+            cookie_name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
@@ -0,0 +1,187 @@
+# static_assets.py
+#
+# 静的ファイル (CSS/JS/画像) の配信をまとめたモジュールです。
+#
+# ビルド時 (デプロイ時に1回。gunicorn.conf.py の on_starting でも実行されます):
+#   python static_assets.py
+#   - ASSET_DIRS 配下の静的ファイルを、内容のハッシュ入りのファイル名で static_build/ にコピーします
+#     (例: user/gazou/dorae.jfif -> user/gazou/dorae.3f2a1b9c0d.jfif)
+#   - 圧縮が効く形式は .gz (と、brotliパッケージがあれば .br) を事前に作成します
+#   - 元のパスとハッシュ入りのパスの対応を static_build/manifest.json に保存します
+#
+# 実行時:
+#   テンプレートでは {{ asset_url('user/gazou/dorae.jfif') }} のようにURLを生成します。
+#   ハッシュ入りのURLは内容が変わるとURLも変わるため、1年間キャッシュ (immutable) させます。
+#   ビルドしていない場合 (開発時) は元のファイルをキャッシュなしで配信します。
+#
+# 環境変数 STATIC_SENDFILE でファイル本体の送信をWebサーバーに任せられます。
+#   x-accel   : nginx の X-Accel-Redirect (STATIC_ACCEL_PREFIX に internal の location を指定)
+#   x-sendfile: Apache / lighttpd の X-Sendfile
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+
+from flask import abort, current_app, request, send_file
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(ROOT, "static_build")
+MANIFEST_PATH = os.path.join(BUILD_DIR, "manifest.json")
+
+# 静的ファイルとして配信してよいディレクトリと拡張子 (これ以外のファイルは配信しない)
+ASSET_DIRS = ("hp", "user", "staff", "admin")
+ASSET_EXTENSIONS = {
+    ".css", ".js", ".map", ".svg", ".ico", ".png", ".jpg", ".jpeg", ".jfif", ".gif", ".webp",
+    ".woff", ".woff2", ".ttf",
+}
+# 事前圧縮の効果がある (すでに圧縮されていない) 形式
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".map", ".svg", ".ico", ".ttf"}
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+mimetypes.add_type("image/jpeg", ".jfif")
+
+_manifest = None
+_built_paths = None
+
+
+def is_asset(path):
+    """配信してよい静的ファイルのパスかどうかを返します。"""
+    parts = path.replace("\\", "/").split("/")
+    if len(parts) < 2 or parts[0] not in ASSET_DIRS or ".." in parts or any(p.startswith(".") for p in parts):
+        return False
+    return os.path.splitext(path)[1].lower() in ASSET_EXTENSIONS
+
+
+def fingerprint(path, content):
+    """ファイル名に内容のハッシュを入れたパスを返します。"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.{hashlib.sha256(content).hexdigest()[:10]}{ext}"
+
+# ------------------------------
+# ビルド
+# ------------------------------
+
+def build(root=ROOT, build_dir=BUILD_DIR):
+    """静的ファイルをハッシュ入りのファイル名でコピーし、事前圧縮してマニフェストを作成します。"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    manifest = {}
+    for directory in ASSET_DIRS:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, directory)):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for filename in filenames:
+                source = os.path.join(dirpath, filename)
+                path = os.path.relpath(source, root).replace(os.sep, "/")
+                if not is_asset(path):
+                    continue
+                with open(source, "rb") as f:
+                    content = f.read()
+                built_path = fingerprint(path, content)
+                target = os.path.join(build_dir, built_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "wb") as f:
+                    f.write(content)
+                if os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                    with open(target + ".gz", "wb") as f:
+                        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+                    if brotli is not None:
+                        with open(target + ".br", "wb") as f:
+                            f.write(brotli.compress(content, quality=11))
+                manifest[path] = built_path
+
+    os.makedirs(build_dir, exist_ok=True)
+    with open(os.path.join(build_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    return manifest, brotli is not None
+
+# ------------------------------
+# 配信
+# ------------------------------
+
+def get_manifest():
+    """ビルド時に作成したマニフェストを読み込みます (ビルドしていない場合は空)。"""
+    global _manifest, _built_paths
+    if _manifest is None:
+        try:
+            with open(MANIFEST_PATH, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        _built_paths = set(manifest.values())
+        _manifest = manifest
+    return _manifest
+
+
+def asset_url(path):
+    """テンプレートから静的ファイルのURLを生成します。ビルド済みならハッシュ入りのURLを返します。"""
+    return "/assets/" + get_manifest().get(path, path)
+
+
+def send_asset(filename):
+    """
+    /assets/<filename> のレスポンスを返します。
+    ハッシュ入りのファイルは事前圧縮版を選んで長期キャッシュ付きで、それ以外は元のファイルをキャッシュなしで返します。
+    """
+    get_manifest()
+    built = os.path.join(BUILD_DIR, filename)
+    if filename in _built_paths and os.path.isfile(built):
+        path, max_age = built, IMMUTABLE_MAX_AGE
+    else:
+        source = os.path.join(ROOT, filename)
+        if not is_asset(filename) or not os.path.isfile(source):
+            abort(404)
+        path, max_age = source, 0
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    if max_age:
+        accepted = request.headers.get("Accept-Encoding", "")
+        for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if candidate in accepted and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, candidate
+                break
+
+    offload = os.getenv("STATIC_SENDFILE", "").lower()
+    if offload == "x-accel":
+        # nginx にファイル本体を送信させる (Pythonのワーカーはヘッダーだけ返す)
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = os.getenv("STATIC_ACCEL_PREFIX", "/_static_internal/") + os.path.relpath(path, ROOT).replace(os.sep, "/")
+    else:
+        # STATIC_SENDFILE=x-sendfile の場合は Flask が X-Sendfile ヘッダーを付けて本体を省略する
+        response = send_file(
+            path, mimetype=mimetype, download_name=os.path.basename(filename),
+            conditional=True, etag=True, max_age=max_age or None,
+        )
+
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if max_age:
+        response.headers["Cache-Control"] = f"public, max-age={max_age}, immutable"
+        response.vary.add("Accept-Encoding")
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def init_app(app):
+    """Flaskアプリに /assets/ のルートとテンプレート関数 asset_url を登録します。"""
+    app.config["USE_X_SENDFILE"] = os.getenv("STATIC_SENDFILE", "").lower() == "x-sendfile"
+    app.add_url_rule("/assets/<path:filename>", "static_asset", send_asset)
+    app.jinja_env.globals["asset_url"] = asset_url
+
+
+if __name__ == "__main__":
+    manifest, with_brotli = build()
+    print(f"{len(manifest)}件の静的ファイルを {os.path.relpath(BUILD_DIR, ROOT)}/ に出力しました。"
+          f" (事前圧縮: gzip{' + brotli' if with_brotli else ''})")
+    sys.exit(0)
@@ -0,0 +1,115 @@
+# template_cache.py
+#
+# テンプレートの描画を速くするためのキャッシュをまとめたモジュールです。
+#
+# 1. バイトコードキャッシュ
+#    Jinjaがテンプレートをコンパイルした結果をディスク (JINJA_CACHE_DIR) に保存し、
+#    すべてのワーカーで共有します。ワーカーの起動直後でも、テンプレートを再コンパイルせずに済みます。
+#    `python template_cache.py` (gunicorn.conf.py の on_starting でも実行) で全テンプレートを事前にコンパイルします。
+#
+# 2. フラグメントキャッシュ
+#    地域一覧やカテゴリー一覧のように、めったに変わらない部分のHTMLを @fragment_cache で
+#    キャッシュします。キャッシュはデータのバージョンと結び付いており、バージョンが変わると次の描画で作り直されます。
+#    set_version_loader でバージョンの読み込み先 (server.py では DataVersions テーブル) を設定すると、
+#    どのワーカーでもデータの変更直後から新しいHTMLを返します。設定しない場合はワーカーごとのバージョンを使い、
+#    invalidate('regions') のように呼び出したワーカー以外では FRAGMENT_CACHE_SECONDS 秒で期限切れになります。
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+
+from jinja2 import FileSystemBytecodeCache, TemplateSyntaxError
+from markupsafe import Markup
+
+BYTECODE_CACHE_DIR = os.getenv(
+    "JINJA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".jinja_cache")
+)
+FRAGMENT_CACHE_TTL = int(os.getenv("FRAGMENT_CACHE_SECONDS", "300"))
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "256"))
+
+_fragments = OrderedDict()
+_data_versions = defaultdict(int)
+_fragment_lock = threading.Lock()
+_version_loader = None
+
+
+def init_app(app):
+    """Flaskアプリのテンプレート環境にバイトコードキャッシュを設定します。"""
+    os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(BYTECODE_CACHE_DIR)
+
+
+def precompile_templates(app):
+    """すべてのHTMLテンプレートを読み込み、バイトコードキャッシュに保存します。(成功数, 失敗したテンプレート) を返します。"""
+    compiled = 0
+    failed = []
+    for name in app.jinja_env.list_templates(filter_func=lambda n: n.endswith(".html") and not n.startswith(".")):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except TemplateSyntaxError as e:
+            failed.append(f"{name}: {e}")
+    return compiled, failed
+
+# ------------------------------
+# フラグメントキャッシュ
+# ------------------------------
+
+def set_version_loader(loader):
+    """データのバージョンの読み込み先を設定します。loader(names) は {データ名: バージョン} を返す関数です。"""
+    global _version_loader
+    _version_loader = loader
+
+
+def data_versions(names):
+    """データのバージョンを names の順に返します。"""
+    if _version_loader is None:
+        return tuple(_data_versions[name] for name in names)
+    versions = _version_loader(names)
+    return tuple(versions.get(name, 0) for name in names)
+
+
+def invalidate(*names):
+    """データが変更されたことを記録し、それに依存するフラグメントを次回作り直すようにします。"""
+    with _fragment_lock:
+        for name in names:
+            _data_versions[name] += 1
+
+
+def fragment_cache(*depends_on):
+    """
+    HTMLの断片を返す関数の結果をキャッシュするデコレータ。
+    キャッシュのキーは関数名と引数で、depends_on に指定したデータのバージョンが変わると作り直します。
+    引数はハッシュ可能な値 (文字列や数値) にしてください。
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = (f.__name__, args, tuple(sorted(kwargs.items())))
+            versions = data_versions(depends_on)
+            entry = _fragments.get(key)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] == versions:
+                return entry[2]
+
+            html = Markup(f(*args, **kwargs))
+            with _fragment_lock:
+                _fragments[key] = (time.monotonic() + FRAGMENT_CACHE_TTL, versions, html)
+                _fragments.move_to_end(key)
+                while len(_fragments) > FRAGMENT_CACHE_SIZE:
+                    _fragments.popitem(last=False)
+            return html
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    from server import app
+
+    compiled, failed = precompile_templates(app)
+    print(f"{compiled}件のテンプレートをコンパイルしました。({os.path.relpath(BYTECODE_CACHE_DIR)})")
+    for message in failed:
+        print(f"  [失敗] {message}")
+    sys.exit(0)
@@ -0,0 +1,11 @@
+# tests/conftest.py
+#
+# リポジトリ直下のモジュール (server.py など) を読み込めるようにします。
+# サーバー側セッションは PostgresSessionStore を使い、接続は各テストで偽の接続に差し替えます。
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["SESSION_BACKEND"] = "postgres"
+os.environ.setdefault("DATABASE_URL", "postgresql://primary.test/app")
@@ -0,0 +1,142 @@
+# tests/test_delete_user_seats.py
+#
+# ボランティアを削除しても、枠を持つ応募の数と空き枠の合計が募集人数と一致したままであることを確認します
+# (枠はキャンセル待ちの先頭に引き継ぐか、空き枠に戻す)。
+
+import time
+
+import pytest
+
+import seats
+import server
+
+CAPACITY = 2
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, query, params=None):
+        db = self.db
+        query = " ".join(query.split())
+        self._rows = []
+        self.rowcount = 0
+        if "FROM Sessions" in query and query.startswith("SELECT"):
+            data = db.sessions.get(params[0])
+            self._rows = [(data,)] if data is not None else []
+        elif "INTO Sessions" in query:
+            db.sessions[params[0]] = params[1]
+        elif query.startswith("SELECT application_id FROM Applications WHERE volunteer_id"):
+            volunteer_id, statuses = params
+            self._rows = [(a["application_id"],) for a in db.applications
+                          if a["volunteer_id"] == volunteer_id and a["status"] in statuses]
+        elif query.startswith("DELETE FROM Applications WHERE application_id"):
+            application_id, volunteer_id = params
+            for a in db.applications:
+                if a["application_id"] == application_id and a["volunteer_id"] == volunteer_id:
+                    db.applications.remove(a)
+                    self._rows = [(a["recruitment_id"], a["status"])]
+                    break
+        elif query.startswith("SELECT application_id, application_date FROM Applications"):
+            waitlisted = sorted(
+                (a for a in db.applications if a["recruitment_id"] == params[0] and a["status"] == "Waitlisted"),
+                key=lambda a: (a["application_date"], a["application_id"])
+            )
+            self._rows = [(a["application_id"], a["application_date"]) for a in waitlisted[:1]]
+        elif query.startswith("UPDATE Applications SET status = 'Pending'"):
+            for a in db.applications:
+                if (a["application_id"], a["application_date"]) == tuple(params):
+                    a["status"] = "Pending"
+        elif query.startswith("UPDATE RecruitmentSeatShards SET remaining = remaining + 1"):
+            recruitment_id, start = params
+            shards = sorted(db.shards.get(recruitment_id, {}), key=lambda shard: (shard < start, shard))
+            if shards:
+                db.shards[recruitment_id][shards[0]] += 1
+        elif query.startswith("DELETE FROM Applications WHERE volunteer_id"):
+            db.applications = [a for a in db.applications if a["volunteer_id"] != params[0]]
+        elif query.startswith("DELETE FROM Volunteers"):
+            self.rowcount = 1
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.sessions = {}
+        # 募集 10 (募集人数 CAPACITY) の枠はボランティア 1 と 2 が持ち、空き枠はない
+        self.applications = [
+            {"application_id": 1, "recruitment_id": 10, "volunteer_id": 1, "application_date": 1, "status": "Approved"},
+            {"application_id": 2, "recruitment_id": 10, "volunteer_id": 2, "application_date": 2, "status": "Pending"},
+        ]
+        self.shards = {10: {shard: 0 for shard in range(seats.SEAT_SHARDS)}}
+
+    def seat_total(self, recruitment_id):
+        holders = sum(1 for a in self.applications
+                      if a["recruitment_id"] == recruitment_id and a["status"] in seats.SEAT_HOLDING_STATUSES)
+        return holders + sum(self.shards[recruitment_id].values())
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.delenv("DATABASE_REPLICA_URL", raising=False)
+    monkeypatch.setattr(server, "connect_to", lambda url: FakeConnection(fake))
+    monkeypatch.setitem(server.app.config, "SERVER_NAME", None)
+    return fake
+
+
+def staff_client(db):
+    interface = server.app.session_interface
+    payload = interface.serializer.dumps({"data": {"org_user": "staff"}, "saved_at": time.time()})
+    db.sessions[interface.key_prefix + "staff"] = payload.encode()
+    client = server.app.test_client()
+    client.set_cookie(server.app.config["SESSION_COOKIE_NAME"], "staff")
+    return client
+
+
+def test_delete_user_returns_seat_to_shards(db):
+    response = staff_client(db).delete("/api/user/1")
+
+    assert response.status_code == 200
+    assert sum(db.shards[10].values()) == 1
+    assert db.seat_total(10) == CAPACITY
+
+
+def test_delete_user_promotes_waitlist(db):
+    db.applications.append(
+        {"application_id": 3, "recruitment_id": 10, "volunteer_id": 3, "application_date": 3, "status": "Waitlisted"}
+    )
+
+    response = staff_client(db).delete("/api/user/1")
+
+    assert response.status_code == 200
+    assert sum(db.shards[10].values()) == 0
+    assert [a["status"] for a in db.applications if a["volunteer_id"] == 3] == ["Pending"]
+    assert db.seat_total(10) == CAPACITY
@@ -0,0 +1,148 @@
+# tests/test_read_replica_sessions.py
+#
+# @read_only のビューでも、セッションの読み込みと保存はプライマリに送られることと、
+# プライマリから読み込む記録 (db_primary_until) がログイン中のセッションにだけ残ることを確認します。
+
+import time
+
+import pytest
+
+import server
+
+PRIMARY_URL = "postgresql://primary.test/app"
+REPLICA_URL = "postgresql://replica.test/app"
+
+
+class FakeCursor:
+    def __init__(self, db, url):
+        self.db = db
+        self.url = url
+        self.description = None
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.db.queries.append((self.url, " ".join(query.split())))
+        self.description = [("prefecture_id",), ("name",)]
+        self._rows = []
+        if "FROM Sessions" in query and query.lstrip().startswith("SELECT"):
+            data = self.db.sessions.get(params[0])
+            self._rows = [(data,)] if data is not None else []
+        elif "INTO Sessions" in query:
+            if self.url != PRIMARY_URL:
+                raise server.psycopg2.errors.ReadOnlySqlTransaction("cannot execute INSERT in a read-only transaction")
+            self.db.sessions[params[0]] = params[1]
+        elif "FROM Prefectures" in query:
+            self._rows = [(13, "東京都")]
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db, url):
+        self.db = db
+        self.url = url
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.db, self.url)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.sessions = {}
+        self.queries = []
+
+    def session_queries(self):
+        return [(url, query) for url, query in self.queries if "Sessions" in query]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setenv("DATABASE_URL", PRIMARY_URL)
+    monkeypatch.setenv("DATABASE_REPLICA_URL", REPLICA_URL)
+    monkeypatch.setattr(server, "connect_to", lambda url: FakeConnection(fake, url))
+    monkeypatch.setitem(server.app.config, "SERVER_NAME", None)
+    server._stale_responses.clear()
+    return fake
+
+
+def store_session(interface, sid, data, saved_at):
+    payload = interface.serializer.dumps({"data": data, "saved_at": saved_at})
+    return interface.key_prefix + sid, payload.encode()
+
+
+def test_read_only_view_refreshes_session_on_primary(db):
+    interface = server.app.session_interface
+    # 有効期限の半分を過ぎたセッション (このリクエストで有効期限を延長する)
+    key, payload = store_session(
+        interface, "refresh-me", {"volunteer_id": 1}, time.time() - interface.lifetime_seconds
+    )
+    db.sessions[key] = payload
+
+    client = server.app.test_client()
+    client.set_cookie(server.app.config["SESSION_COOKIE_NAME"], "refresh-me")
+    response = client.get("/api/prefectures")
+
+    assert response.status_code == 200
+    assert response.get_json() == [{"prefecture_id": 13, "name": "東京都"}]
+    # 一覧はレプリカから読み込む
+    assert any(url == REPLICA_URL and "FROM Prefectures" in query for url, query in db.queries)
+    # セッションの読み込みと保存はプライマリへ
+    session_queries = db.session_queries()
+    assert [query.split()[0] for _, query in session_queries] == ["SELECT", "SELECT", "INSERT"]
+    assert {url for url, _ in session_queries} == {PRIMARY_URL}
+    assert response.headers.get("Set-Cookie", "").startswith("session=refresh-me")
+
+
+def test_read_only_view_reads_primary_after_write(db):
+    interface = server.app.session_interface
+    # 直前に書き込みを行ったセッションは、ビューもプライマリから読み込む
+    key, payload = store_session(
+        interface, "sticky", {"volunteer_id": 1, "db_primary_until": time.time() + 60}, time.time()
+    )
+    db.sessions[key] = payload
+
+    client = server.app.test_client()
+    client.set_cookie(server.app.config["SESSION_COOKIE_NAME"], "sticky")
+    response = client.get("/api/prefectures")
+
+    assert response.status_code == 200
+    assert all(url == PRIMARY_URL for url, _ in db.queries)
+
+
+def test_anonymous_write_does_not_create_session(db):
+    client = server.app.test_client()
+    response = client.post("/user/logout")
+
+    assert response.status_code == 200
+    assert not db.sessions
+    assert "session=" not in response.headers.get("Set-Cookie", "")
+
+
+def test_logout_leaves_no_session_behind(db):
+    interface = server.app.session_interface
+    key, payload = store_session(interface, "logged-in", {"volunteer_id": 1}, time.time())
+    db.sessions[key] = payload
+
+    client = server.app.test_client()
+    client.set_cookie(server.app.config["SESSION_COOKIE_NAME"], "logged-in")
+    response = client.post("/user/logout")
+
+    assert response.status_code == 200
+    assert not any(query.startswith("INSERT") for _, query in db.session_queries())
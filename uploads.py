@@ -0,0 +1,183 @@
+# uploads.py
+#
+# アップロードされた画像の保存と配信をまとめたモジュールです。
+#
+# 保存:
+#   元画像は内容のSHA-256をファイル名にして保存します (uploads/originals/ab/abcd....jpg)。
+#   同じ画像が何度アップロードされても、保存されるのは1つだけです。
+#   Uploads テーブルに1行ずつ記録し、リサイズ版 (VARIANTS) は jobs.py の
+#   generate_upload_variants ジョブがバックグラウンドで作成します (Pillowが必要)。
+#   元画像とリサイズ版はWebサービスのローカルディスクに置くため、ジョブはアップロードを受け付けた
+#   Webプロセスの中で実行します (server.start_upload_variants)。ディスクを共有しない
+#   scheduler.py の worker や Cron Job では実行しないでください。
+#
+# 配信 (/media/<content_hash>/<variant>):
+#   内容が変わればURLも変わるため、長期キャッシュ (immutable) と強いETagを付け、Rangeリクエストにも対応します。
+#   ブラウザがWebPに対応していればWebP版を、そうでなければJPEG版を返します。
+#   リサイズ版がまだ作成されていない場合は、元画像を短いキャッシュで返します。
+
+import hashlib
+import os
+import tempfile
+
+from flask import abort, request, send_file
+
+UPLOAD_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+ORIGINALS_DIR = os.path.join(UPLOAD_ROOT, 'originals')
+VARIANTS_DIR = os.path.join(UPLOAD_ROOT, 'variants')
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# 先頭のバイト列から画像の形式を判定する (拡張子やContent-Typeは信用しない)
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', '.png'),
+    (b'GIF87a', 'image/gif', '.gif'),
+    (b'GIF89a', 'image/gif', '.gif'),
+)
+
+# リサイズ版の名前と最大幅 (ピクセル)。各サイズについてWebPとJPEGを作成する
+VARIANTS = {
+    'thumb': 320,
+    'medium': 960,
+}
+VARIANT_FORMATS = (('webp', 'WEBP', 'image/webp'), ('jpg', 'JPEG', 'image/jpeg'))
+
+
+class UploadError(ValueError):
+    """アップロードされたファイルを受け付けられない場合の例外"""
+
+
+def detect_image_type(head):
+    """先頭のバイト列から (Content-Type, 拡張子) を返します。画像でない場合は None を返します。"""
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', '.webp'
+    return None
+
+
+def original_path(content_hash, extension):
+    return os.path.join(ORIGINALS_DIR, content_hash[:2], content_hash + extension)
+
+
+def find_original(content_hash):
+    """保存されている元画像のパスを返します (拡張子はアップロード時に判定したもの)。"""
+    for extension in sorted({extension for _, _, extension in IMAGE_SIGNATURES} | {'.webp'}):
+        path = original_path(content_hash, extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def variant_path(content_hash, variant, fmt):
+    return os.path.join(VARIANTS_DIR, content_hash[:2], content_hash, f"{variant}.{fmt}")
+
+
+def save_upload(cursor, file_storage):
+    """
+    アップロードされた画像を保存し、Uploads テーブルに記録して content_hash を返します。
+    同じ内容の画像が既にある場合は保存せず、既存の content_hash を返します。
+    """
+    os.makedirs(ORIGINALS_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    # ハッシュを計算しながら一時ファイルに書き出す (大きなファイルをメモリに載せない)
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_ROOT, delete=False) as temp:
+        try:
+            for chunk in iter(lambda: file_storage.stream.read(64 * 1024), b''):
+                if len(head) < 16:
+                    head += chunk[:16]
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadError(f"ファイルサイズが上限 ({MAX_UPLOAD_BYTES // (1024 * 1024)}MB) を超えています。")
+                digest.update(chunk)
+                temp.write(chunk)
+        except BaseException:
+            temp.close()
+            os.remove(temp.name)
+            raise
+
+    detected = detect_image_type(head)
+    if detected is None:
+        os.remove(temp.name)
+        raise UploadError("JPEG / PNG / GIF / WebP 形式の画像を選択してください。")
+    content_type, extension = detected
+    content_hash = digest.hexdigest()
+
+    path = original_path(content_hash, extension)
+    if os.path.exists(path):
+        # 同じ内容のファイルが既にある (重複アップロード)
+        os.remove(temp.name)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp.name, path)
+
+    cursor.execute("""
+        INSERT INTO Uploads (content_hash, extension, content_type, size_bytes, original_name)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (content_hash) DO NOTHING
+    """, (content_hash, extension, content_type, size, (file_storage.filename or '')[:255]))
+    return content_hash
+
+
+def generate_variants(content_hash, extension):
+    """元画像からリサイズ版 (VARIANTS × VARIANT_FORMATS) を作成します。"""
+    from PIL import Image, ImageOps
+
+    with Image.open(original_path(content_hash, extension)) as image:
+        # スマートフォンの写真の向き (EXIF) を反映し、透過をなくしてからリサイズする
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for variant, max_width in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((max_width, max_width * 4))
+            for fmt, pil_format, _ in VARIANT_FORMATS:
+                path = variant_path(content_hash, variant, fmt)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                resized.save(temp_path, pil_format, quality=80, optimize=True)
+                os.replace(temp_path, path)
+        return image.width, image.height
+
+
+def media_url(content_hash, variant='medium'):
+    """テンプレートから画像のURLを生成します。"""
+    return f"/media/{content_hash}/{variant}"
+
+
+def send_media(content_hash, variant):
+    """/media/<content_hash>/<variant> のレスポンスを返します (データベースは参照しません)。"""
+    max_age = IMMUTABLE_MAX_AGE
+    path = None
+    mimetype = None
+    if variant in VARIANTS:
+        accepted = request.headers.get('Accept', '')
+        for fmt, _, fmt_mimetype in VARIANT_FORMATS:
+            if fmt == 'webp' and 'image/webp' not in accepted:
+                continue
+            candidate = variant_path(content_hash, variant, fmt)
+            if os.path.isfile(candidate):
+                path, mimetype = candidate, fmt_mimetype
+                break
+    elif variant != 'original':
+        abort(404)
+
+    if path is None:
+        # リサイズ版がまだない場合は元画像を返す (作成後に切り替わるよう、キャッシュは短くする)
+        path = find_original(content_hash)
+        if path is None:
+            abort(404)
+        if variant != 'original':
+            max_age = 60
+
+    # conditional=True で If-None-Match / Range に対応する (ETagは内容のハッシュから決まる)
+    response = send_file(
+        path, mimetype=mimetype, conditional=True, max_age=max_age,
+        etag=f"{content_hash}-{variant}-{os.path.splitext(path)[1].lstrip('.')}",
+    )
+    response.headers['Cache-Control'] = f"public, max-age={max_age}" + (", immutable" if max_age == IMMUTABLE_MAX_AGE else "")
+    response.vary.add('Accept')
+    return response